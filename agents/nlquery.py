@@ -1,10 +1,23 @@
 import argparse
+import asyncio
+import hashlib
+import inspect
 import json
 import logging
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 import os
 import sys
 import re
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from typing import Optional, Dict, Any
 from tabulate import tabulate  # Add tabulate for pretty table formatting
 
@@ -15,7 +28,31 @@ logger = logging.getLogger(__name__)
 # Global variables
 tables_list = ""
 current_schema = None  # Store the currently selected schema
+current_prompt = ""    # Store the last natural language prompt
 current_query = ""     # Store the currently extracted SQL query
+current_queries = []   # Store all SQL queries extracted from the last answer, in order
+query_guard_notes = []  # Changes made by the large table guard to the queries of the last answer
+current_config = {}    # Store the configuration loaded by main()
+schema_context_cache = {}  # Cache schema contexts keyed by (database, schema)
+connection_pool = None  # Shared database connection pool created by main()
+connection_last_used = {}  # Time each pooled connection was last returned, keyed by id()
+busy_connections = {}  # Checked out connections and the thread using them, keyed by id()
+current_provider = None  # Store the AI provider selected with /provider
+ai_client_registry = {}  # Initialized AI clients keyed by provider name
+active_result = None  # Open server-side cursor of the last query, paged with /more and /next
+response_cache = None  # Persistent AI response cache created by main()
+result_cache = None  # In-memory cache of query results created by main()
+session_stats = None  # Per-stage latency and token statistics created by main()
+schema_warmup = None  # Background load of the schema context started by /schema
+warmup_executor = None  # Worker thread running the schema warm-ups
+
+SUPPORTED_PROVIDERS = ('azure_openai', 'anthropic', 'ollama')
+
+BASE_SYSTEM_MESSAGE = """You are a helpful database assistant. 
+        Help the user understand and work with their PostgreSQL database. 
+        When writing SQL queries, format them clearly and explain what they do.
+        Always put SQL queries in code blocks using ```sql and ``` syntax.
+        Be concise and accurate in your responses."""
 
 def load_configuration(config_path):
     """
@@ -28,7 +65,7 @@ def load_configuration(config_path):
         The parsed configuration object
     """
     try:
-        with open(config_path, 'r') as config_file:
+        with timed_stage('config'), open(config_path, 'r') as config_file:
             return json.load(config_file)
     except FileNotFoundError:
         print(f"Configuration file not found: {config_path}")
@@ -38,7 +75,7 @@ def load_configuration(config_path):
         return {}
 
 
-def setup_ai_client(config: Dict[str, Any], provider: str = None) -> Optional[Any]:
+def setup_ai_client(config: Dict[str, Any], provider: str = None, asynchronous: bool = False) -> Optional[Any]:
     """
     Set up an AI client based on the specified provider.
     
@@ -46,6 +83,7 @@ def setup_ai_client(config: Dict[str, Any], provider: str = None) -> Optional[An
         config: Configuration dictionary containing AI service parameters
         provider: The AI provider to use ('azure', 'anthropic', 'ollama')
                  If None, uses the provider specified in config
+        asynchronous: If True, build the asyncio variant of the provider client
     
     Returns:
         An initialized AI client if successful, None otherwise
@@ -62,46 +100,51 @@ def setup_ai_client(config: Dict[str, Any], provider: str = None) -> Optional[An
     try:
         if provider == 'azure_openai':
             try:
-                from openai import AzureOpenAI
+                from openai import AzureOpenAI, AsyncAzureOpenAI
             
                 azure_config = ai_config.get('azure_openai', {})
                 azure_api_key = os.environ.get("AZURE_API_KEY")
                 if not azure_api_key:
                     raise ValueError("AZURE_API_KEY environment variable not set")
             
-                client = AzureOpenAI(
+                client_class = AsyncAzureOpenAI if asynchronous else AzureOpenAI
+                client = client_class(
                     api_key=azure_api_key,
                     api_version=azure_config.get('api_version', '2024-12-01-preview'),
                     azure_endpoint=azure_config.get('endpoint', os.getenv('AZURE_OPENAI_ENDPOINT'))
                 )
                 print(f"Azure OpenAI client initialized successfully")
                 return {
+                    "provider": provider,
                     "client": client,
                     "model": azure_config.get('model', 'gpt-4o')
                 }
             except Exception as e:
                 logger.error(f"Failed to set up Azure OpenAI client: {str(e)}")
-                sys.exit(1)
+                return None
             
         elif provider == 'anthropic':
             try:
-                from anthropic import Anthropic
+                from anthropic import Anthropic, AsyncAnthropic
             
                 anthropic_config = ai_config.get('anthropic', {})   
                 anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY")
                 if not anthropic_api_key:
                     raise ValueError("ANTHROPIC_API_KEY environment variable not set")
-                client = Anthropic(
+                client_class = AsyncAnthropic if asynchronous else Anthropic
+                client = client_class(
                     api_key=anthropic_api_key
                 )
                 print(f"Anthropic client initialized successfully")
                 return {
+                    "provider": provider,
                     "client": client,
-                    "model": anthropic_config.get('model', 'claude-3-7-sonnet-20250219')
+                    "model": anthropic_config.get('model', 'claude-3-7-sonnet-20250219'),
+                    "max_tokens": anthropic_config.get('max_tokens', 4096)
                 }
             except Exception as e:
                 logger.error(f"Failed to set up Anthropic client: {str(e)}")
-                sys.exit(1)
+                return None
             
         elif provider == 'ollama':
             try:
@@ -111,16 +154,17 @@ def setup_ai_client(config: Dict[str, Any], provider: str = None) -> Optional[An
                 # Configure Ollama with URL from config
                 url = ollama_config.get("url", "http://localhost:11434")
                 # Create client instance with the host URL parameter
-                client = ollama.Client(host=url)
+                client = ollama.AsyncClient(host=url) if asynchronous else ollama.Client(host=url)
                 model = ollama_config.get("model", "llama3.2b")
                 logger.info(f"Ollama client configured with URL {url} and model {model}")
                 return {
+                    "provider": provider,
                     "client" : client,
                     "model" : model
                 }
             except Exception as e:
                 logger.error(f"Failed to set up Ollama client: {str(e)}")
-                sys.exit(1)
+                return None
             
         else:
             print(f"Unsupported AI provider: {provider}")
@@ -135,519 +179,5097 @@ def setup_ai_client(config: Dict[str, Any], provider: str = None) -> Optional[An
         return None
 
 
-def parse_prompt(ai_client_config: Dict[str, Any], prompt: str) -> str | None | Any:
+def get_ai_client(config: Dict[str, Any], provider: str = None,
+                  asynchronous: bool = False) -> Optional[Dict[str, Any]]:
     """
-    Process a natural language prompt using the configured AI client.
+    Return the AI client for a provider from the registry, initializing it on first use.
+    
+    Each provider client is built once per session, so the SDK is imported only when the
+    provider is first used and its HTTP connection pool stays warm across prompts.
     
     Args:
-        ai_client_config: Dictionary containing the AI client and model information
-        prompt: The natural language prompt to process
-        
+        config: Configuration dictionary containing AI service parameters
+        provider: The AI provider to use. If None, uses the provider selected with
+                 /provider or, failing that, the provider specified in config
+        asynchronous: If True, return the asyncio variant of the provider client
+    
     Returns:
-        The AI-generated response as a string
+        The AI client configuration dictionary if successful, None otherwise
     """
-    global current_schema, tables_list, current_query
+    if provider is None:
+        provider = current_provider or config.get('ai', {}).get('provider', '')
+    provider = provider.lower()
     
-    # Clear current_query before processing new prompt
-    current_query = ""
+    registry_key = f"{provider}:async" if asynchronous else provider
+    ai_client_config = ai_client_registry.get(registry_key)
+    if ai_client_config is None:
+        ai_client_config = setup_ai_client(config, provider, asynchronous)
+        if ai_client_config is not None:
+            ai_client_registry[registry_key] = ai_client_config
     
-    if not ai_client_config or not prompt:
-        return "Error: AI client not configured or prompt is empty."
+    return ai_client_config
+
+
+class SqlBlockExtractor:
+    """
+    Incrementally extract ```sql code blocks from an AI response while it is streamed.
+    """
     
-    client = ai_client_config.get("client")
-    model = ai_client_config.get("model")
+    OPEN_FENCE = "```sql\n"
+    CLOSE_FENCE = "\n```"
     
-    try:
-        # Format the system message with database context
-        system_message = """You are a helpful database assistant. 
-        Help the user understand and work with their PostgreSQL database. 
-        When writing SQL queries, format them clearly and explain what they do.
-        Always put SQL queries in code blocks using ```sql and ``` syntax.
-        Be concise and accurate in your responses."""
-        
-        # Get schema information if current_schema is set
-        schema_ddl = ""
-        if current_schema:
-            try:
-                # Get configuration from the main function's scope
-                config = load_configuration('config.json')  # Use default config path
-                connection = connect_to_database(config)
-                if connection:
-                    get_database_tables_by_schema(connection, current_schema)
-                    schema_ddl = generate_ddl(connection, current_schema)
-                    connection.close()
-                    
-                    # Add the schema information to the system message
-                    system_message += f"\n\nCurrent schema: {current_schema}\n"
-                    system_message += f"Available tables: {tables_list}\n"
-                    system_message += f"Schema DDL:\n{schema_ddl}"
-            except Exception as e:
-                logger.error(f"Error retrieving schema DDL: {str(e)}")
-        
-        # Process based on provider type and collect the response
-        llm_response = None
+    def __init__(self, on_query=None):
+        """
+        Args:
+            on_query: Optional callable invoked with each SQL query as soon as its block is closed
+        """
+        self.text = ""
+        self.queries = []
+        self.scan_pos = 0
+        self.on_query = on_query
+        self.elapsed = 0.0  # Time spent scanning the response, in seconds
+    
+    def feed(self, chunk: str) -> None:
+        """
+        Append a chunk of the response and extract every SQL block completed by it.
         
-        if isinstance(client, dict) and "provider" in client:
-            provider = client["provider"]
+        Args:
+            chunk: The next piece of the response text
+        """
+        start_time = time.perf_counter()
+        self.text += chunk
+        completed = []
+        while True:
+            start = self.text.find(self.OPEN_FENCE, self.scan_pos)
+            if start < 0:
+                # Keep a possibly incomplete opening fence in the scan window
+                self.scan_pos = max(self.scan_pos, len(self.text) - len(self.OPEN_FENCE) + 1)
+                break
             
-            if provider == "azure_openai":
-                response = client["client"].chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                llm_response = response.choices[0].message.content
-                
-            elif provider == "anthropic":
-                response = client["client"].messages.create(
-                    model=model,
-                    system=system_message,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                llm_response = response.content[0].text
-                
-            elif provider == "ollama":
-                response = client["client"].generate(
-                    model=model,
-                    prompt=f"{system_message}\n\nUser: {prompt}\n\nAssistant:",
-                    stream=False
-                )
-                llm_response = response.get("response", "No response generated")
-
-        # Handle specific client types directly
-        elif hasattr(client, "chat") and hasattr(client.chat, "completions"):
-            # Azure OpenAI client
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            llm_response = response.choices[0].message.content
-            
-        elif hasattr(client, "messages") and hasattr(client.messages, "create"):
-            # Anthropic client
-            response = client.messages.create(
-                model=model,
-                system=system_message,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            llm_response = response.content[0].text
-            
-        elif hasattr(client, "generate"):
-            # Ollama client
-            response = client.generate(
-                model=model,
-                prompt=f"{system_message}\n\nUser: {prompt}\n\nAssistant:",
-                stream=False
-            )
-            llm_response = response.get("response", "No response generated")
+            end = self.text.find(self.CLOSE_FENCE, start + len(self.OPEN_FENCE) - 1)
+            if end < 0:
+                self.scan_pos = start
+                break
             
-        else:
-            return "Error: Unsupported AI client type."
+            query = self.text[start + len(self.OPEN_FENCE):end].strip()
+            self.queries.append(query)
+            self.scan_pos = end + len(self.CLOSE_FENCE)
+            completed.append(query)
+        self.elapsed += time.perf_counter() - start_time
+        
+        if self.on_query:
+            for query in completed:
+                self.on_query(query)
 
-        # logger.info(llm_response)
 
-        # Extract SQL code blocks from the response using regex
-        if llm_response:
-            sql_matches = re.findall(r'```sql\n(.*?)\n```', llm_response, re.DOTALL)
-            if sql_matches:
-                current_query = sql_matches[0].strip()
-                # logger.info(f"Extracted SQL query: {current_query}")
-        
-        return llm_response
-            
-    except Exception as e:
-        logger.error(f"Error processing prompt with AI: {str(e)}")
-        return f"Error processing your request: {str(e)}"
+class TokenPrinter:
+    """
+    Print the chunks of a streamed AI response to the terminal as they arrive.
+    """
+    
+    def __init__(self):
+        self.started = False
+    
+    def __call__(self, token: str) -> None:
+        if not self.started:
+            print("AI Response: ", end="")
+            self.started = True
+        print(token, end="", flush=True)
 
 
-def connect_to_database(config):
+def get_provider_name(ai_client_config: Dict[str, Any]) -> Optional[str]:
     """
-    Establish a connection to the PostgreSQL database using configuration parameters.
+    Determine the provider of an AI client configuration.
     
     Args:
-        config: Configuration dictionary containing database connection parameters
+        ai_client_config: Dictionary containing the AI client and model information
         
     Returns:
-        A database connection object if successful, None otherwise
+        'azure_openai', 'anthropic' or 'ollama' if the client is supported, None otherwise
     """
-    try:
-        # Extract database connection parameters from config
-        db_config = config.get('database', {})
-        
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=db_config.get('host', 'localhost'),
-            port=db_config.get('port', 5432),
-            database=db_config.get('name', ''),
-            user=db_config.get('user', ''),
-            password=db_config.get('password', '')
-        )
-        
-        return connection
+    if ai_client_config.get("provider"):
+        return ai_client_config["provider"]
     
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+    client = ai_client_config.get("client")
+    if isinstance(client, dict):
+        return client.get("provider")
+    if hasattr(client, "chat") and hasattr(client.chat, "completions"):
+        return "azure_openai"
+    if hasattr(client, "messages") and hasattr(client.messages, "create"):
+        return "anthropic"
+    if hasattr(client, "generate"):
+        return "ollama"
+    return None
 
 
-def get_database_schemas(connection):
+def consume_stream(response, chunks, on_token, start_time=None) -> str:
     """
-    Query and retrieve a list of all schemas in the database.
+    Read a streamed AI response, forwarding each text chunk as soon as it arrives.
+    
+    Pressing Ctrl-C closes the stream and propagates the KeyboardInterrupt to the caller.
     
     Args:
-        connection: A PostgreSQL database connection object
+        response: The provider stream object, closed when the generation is interrupted
+        chunks: Iterable of the text chunks extracted from the stream
+        on_token: Callable invoked with each text chunk
+        start_time: Optional time.perf_counter() value of the request, used to record the
+                    time to the first token
         
     Returns:
-        A list of schema names if successful, empty list otherwise
+        The concatenated response text
     """
+    parts = []
     try:
-        cursor = connection.cursor()
-        
-        # Query to get all schemas in the database
-        cursor.execute("SELECT schema_name FROM information_schema.schemata")
-        
-        # Fetch all results
-        schemas = [row[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        return schemas
-        
-    except psycopg2.Error as e:
-        print(f"Error retrieving database schemas: {e}")
-        return []
+        for chunk in chunks:
+            if not parts and start_time is not None and session_stats is not None:
+                session_stats.record('first_token', time.perf_counter() - start_time)
+            parts.append(chunk)
+            on_token(chunk)
+    except KeyboardInterrupt:
+        close = getattr(response, "close", None)
+        if close:
+            close()
+        raise
+    return "".join(parts)
 
 
-def get_database_tables_by_schema(connection, schema_name):
+def generate_response(ai_client_config: Dict[str, Any], system_message: str, prompt: str,
+                      on_token=None, usage=None) -> str:
     """
-    Query and retrieve a list of all tables in a specific schema.
+    Send a prompt to the AI provider and return its answer.
     
     Args:
-        connection: A PostgreSQL database connection object
-        schema_name: Name of the schema to query tables from
+        ai_client_config: Dictionary containing the AI client and model information
+        system_message: The system message describing the database context
+        prompt: The natural language prompt to process
+        on_token: Optional callable; when given, the response is streamed and each text
+                  chunk is passed to it as soon as it arrives
+        usage: Optional dictionary receiving the 'prompt' and 'completion' token counts
+               reported by the provider, and 'prompt_eval_ms' when Ollama reports it
         
     Returns:
-        A list of table names in the specified schema if successful, empty list otherwise
+        The AI-generated response as a string
     """
-    global tables_list
+    provider = get_provider_name(ai_client_config)
+    client = ai_client_config.get("client")
+    if isinstance(client, dict):
+        client = client.get("client")
+    model = ai_client_config.get("model")
+    stream = on_token is not None
+    start_time = time.perf_counter()
+    usage = {} if usage is None else usage  # Token counts reported by the provider
     
-    try:
-        cursor = connection.cursor()
-        
-        # Query to get all tables in the specified schema
-        cursor.execute(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema = %s",
-            (schema_name,)
+    if provider == "azure_openai":
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            stream=stream,
+            **({"stream_options": {"include_usage": True}} if stream else {})
         )
+        if not stream:
+            if response.usage:
+                usage.update(prompt=response.usage.prompt_tokens, completion=response.usage.completion_tokens)
+            record_token_usage(ai_client_config, usage.get('prompt'), usage.get('completion'))
+            return response.choices[0].message.content
         
-        # Fetch all results
-        tables = [row[0] for row in cursor.fetchall()]
+        def read_chunks():
+            for chunk in response:
+                # The usage is sent in a last chunk without choices
+                if getattr(chunk, "usage", None):
+                    usage.update(prompt=chunk.usage.prompt_tokens, completion=chunk.usage.completion_tokens)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    
+    elif provider == "anthropic":
+        response = client.messages.create(
+            model=model,
+            system=system_message,
+            max_tokens=ai_client_config.get("max_tokens", 4096),
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream
+        )
+        if not stream:
+            usage.update(prompt=response.usage.input_tokens, completion=response.usage.output_tokens)
+            record_token_usage(ai_client_config, usage.get('prompt'), usage.get('completion'))
+            return response.content[0].text
         
-        # Format table names with schema name and create comma-separated string
-        formatted_tables = [f"{schema_name}.{table}" for table in tables]
-        tables_list = ",".join(formatted_tables)
+        def read_chunks():
+            for event in response:
+                if event.type == "message_start":
+                    usage['prompt'] = event.message.usage.input_tokens
+                elif event.type == "message_delta":
+                    usage['completion'] = event.usage.output_tokens
+                elif event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                    yield event.delta.text
+    
+    elif provider == "ollama":
+        response = client.generate(
+            model=model,
+            prompt=f"{system_message}\n\nUser: {prompt}\n\nAssistant:",
+            stream=stream
+        )
+        def read_usage(result):
+            usage.update(prompt=result.get("prompt_eval_count"), completion=result.get("eval_count"))
+            if result.get("prompt_eval_duration"):
+                usage['prompt_eval_ms'] = result.get("prompt_eval_duration") / 1e6
         
-        cursor.close()
-        return tables
+        if not stream:
+            read_usage(response)
+            record_token_usage(ai_client_config, usage.get('prompt'), usage.get('completion'))
+            return response.get("response", "No response generated")
         
-    except psycopg2.Error as e:
-        print(f"Error retrieving tables for schema '{schema_name}': {e}")
-        return []
+        def read_chunks():
+            for chunk in response:
+                # The token counts come with the final chunk
+                if chunk.get("done"):
+                    read_usage(chunk)
+                if chunk["response"]:
+                    yield chunk["response"]
+    
+    else:
+        raise ValueError(f"Unsupported AI provider: {provider}")
+    
+    text = consume_stream(response, read_chunks(), on_token, start_time)
+    record_token_usage(ai_client_config, usage.get('prompt'), usage.get('completion'))
+    return text
 
 
-def get_table_structure(connection, schema_name, table_name):
+class ResponseCache:
     """
-    Query and retrieve the structure of a specific table in a schema.
+    Disk-backed cache of AI responses with LRU eviction and a time to live.
     
-    Args:
-        connection: A PostgreSQL database connection object
-        schema_name: Name of the schema containing the table
-        table_name: Name of the table to get structure for
-        
-    Returns:
-        A list of dictionaries containing column information if successful, empty list otherwise
+    Entries are stored in a SQLite database and keyed by the normalized prompt, the
+    provider, the model and a fingerprint of the system message (i.e. of the schema
+    context sent with the prompt).
     """
-    try:
-        cursor = connection.cursor()
-        
-        # Query to get column information for the specified table
-        query = """
-            SELECT 
-                column_name, 
-                data_type, 
-                character_maximum_length,
-                is_nullable,
-                column_default
-            FROM 
-                information_schema.columns 
-            WHERE 
-                table_schema = %s 
-                AND table_name = %s
-            ORDER BY 
-                ordinal_position
-        """
-        
-        cursor.execute(query, (schema_name, table_name))
-        
-        # Fetch all results and format them as dictionaries
-        columns = []
-        for row in cursor.fetchall():
-            column_info = {
-                'name': row[0],
-                'data_type': row[1],
-                'max_length': row[2],
-                'is_nullable': row[3],
-                'default_value': row[4]
-            }
-            columns.append(column_info)
+    
+    def __init__(self, path: str, max_entries: int = 1000, ttl_seconds: int = 604800):
+        """
+        Args:
+            path: Path of the SQLite cache file; parent directories are created if needed
+            max_entries: Maximum number of entries kept; least recently used entries are evicted
+            ttl_seconds: Time to live of an entry in seconds
+        """
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
         
-        cursor.close()
-        return columns
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
         
-    except psycopg2.Error as e:
-        print(f"Error retrieving structure for table '{schema_name}.{table_name}': {e}")
-        return []
-
-
-def generate_ddl(connection, schema_name):
-    """
-    Generate DDL (Data Definition Language) statements for all tables in a specific schema.
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # Earlier versions also stored the extracted query, which is now re-extracted
+        # from the response on a hit; such caches are discarded
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(responses)")]
+        if 'query' in columns:
+            self.db.execute("DROP TABLE responses")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                provider TEXT,
+                model TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.db.commit()
     
-    Args:
-        connection: A PostgreSQL database connection object
-        schema_name: Name of the schema to generate DDL for
+    @staticmethod
+    def make_key(prompt: str, provider: str, model: str, system_message: str) -> str:
+        """
+        Build the cache key of a prompt.
         
-    Returns:
-        A string containing all DDL statements for the tables in the schema
-    """
-    # Get all tables in the specified schema
-    tables = get_database_tables_by_schema(connection, schema_name)
-    
-    if not tables:
-        return f"No tables found in schema '{schema_name}'."
-    
-    # Initialize an empty list to store the DDL statements
-    ddl_statements = []
+        Args:
+            prompt: The natural language prompt; case and whitespace are normalized
+            provider: The AI provider name
+            model: The model name
+            system_message: The system message sent with the prompt
+            
+        Returns:
+            A hexadecimal SHA-256 digest
+        """
+        normalized_prompt = " ".join(prompt.lower().split())
+        context_fingerprint = hashlib.sha256(system_message.encode('utf-8')).hexdigest()
+        key_material = json.dumps([normalized_prompt, provider, model, context_fingerprint])
+        return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
     
-    # Process each table
-    for table_name in tables:
-        # Get the structure of the table
-        columns = get_table_structure(connection, schema_name, table_name)
-        
-        if not columns:
-            ddl_statements.append(f"-- Could not retrieve structure for '{schema_name}.{table_name}'")
-            continue
-        
-        # Start building the CREATE TABLE statement
-        ddl = f"CREATE TABLE {schema_name}.{table_name} (\n"
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        """
+        Look up a cached response.
         
-        # Add column definitions
-        column_definitions = []
-        for column in columns:
-            # Start with column name and data type
-            column_def = f"    {column['name']} {column['data_type']}"
+        Args:
+            key: Cache key returned by make_key
             
-            # Add character length if applicable
-            if column['max_length'] is not None:
-                column_def += f"({column['max_length']})"
+        Returns:
+            A dictionary with the key 'response' on a hit, None otherwise
+        """
+        now = time.time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
             
-            # Add NULL/NOT NULL constraint
-            if column['is_nullable'] == 'NO':
-                column_def += " NOT NULL"
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                row = None
             
-            # Add default value if present
-            if column['default_value'] is not None:
-                column_def += f" DEFAULT {column['default_value']}"
+            if row is None:
+                self.misses += 1
+                return None
             
-            column_definitions.append(column_def)
+            self.db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self.hits += 1
+            return {'response': row[0]}
+    
+    def put(self, key: str, response: str, provider: str, model: str) -> None:
+        """
+        Store a response and evict the least recently used entries above max_entries.
         
-        # Join column definitions with commas
-        ddl += ",\n".join(column_definitions)
+        Args:
+            key: Cache key returned by make_key
+            response: The AI-generated response
+            provider: The AI provider name
+            model: The model name
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, response, provider, model, now, now)
+            )
+            self.db.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+            self.db.commit()
+    
+    def clear(self) -> int:
+        """
+        Remove all cached responses.
         
-        # Close the CREATE TABLE statement
-        ddl += "\n);"
+        Returns:
+            The number of removed entries
+        """
+        with self.lock:
+            removed = self.db.execute("DELETE FROM responses").rowcount
+            self.db.commit()
+            return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache statistics.
         
-        ddl_statements.append(ddl)
+        Returns:
+            A dictionary with the keys 'entries', 'expired', 'size_bytes', 'hits' and 'misses';
+            hits and misses are counted for the current session
+        """
+        with self.lock:
+            entries, expired = self.db.execute(
+                "SELECT count(*), coalesce(sum(created_at < ?), 0) FROM responses",
+                (time.time() - self.ttl_seconds,)
+            ).fetchone()
+        return {
+            'entries': entries,
+            'expired': expired,
+            'size_bytes': os.path.getsize(self.path),
+            'hits': self.hits,
+            'misses': self.misses
+        }
     
-    # Join all DDL statements with double line breaks
-    return "\n\n".join(ddl_statements)
+    def close(self) -> None:
+        """Close the underlying SQLite database."""
+        with self.lock:
+            self.db.close()
 
 
-def execute_query(sql_query, config=None):
+def create_response_cache(config):
     """
-    Execute an SQL query and display the results as a formatted table.
+    Create the AI response cache from the 'cache' configuration block.
     
     Args:
-        sql_query: SQL query string to execute
-        config: Configuration dictionary containing database connection parameters
-               If None, uses the default config.json
-    
+        config: Configuration dictionary
+        
     Returns:
-        True if execution was successful, False otherwise
+        A ResponseCache if the cache is enabled and could be opened, None otherwise
     """
-    if not sql_query:
-        print("Error: No SQL query provided.")
-        return False
-    
-    # Load config if not provided
-    if config is None:
-        config = load_configuration('config.json')
-    
-    connection = connect_to_database(config)
-    if not connection:
-        print("Failed to connect to the database. Please check your configuration.")
-        return False
+    cache_config = config.get('cache', {})
+    if not cache_config.get('enabled', True):
+        return None
     
+    path = cache_config.get('path', os.path.join('~', '.cache', 'nlquery', 'responses.sqlite'))
     try:
-        # Create cursor
-        cursor = connection.cursor()
-        
-        # Execute query
-        cursor.execute(sql_query)
-        
-        # Check if query returns results (SELECT, SHOW, etc.)
-        if cursor.description:
-            # Get column names from cursor description
-            columns = [desc[0] for desc in cursor.description]
-            
-            # Fetch all results
-            results = cursor.fetchall()
-            
-            # Display results as a table
-            if results:
-                print(f"\nQuery executed successfully. {len(results)} rows returned.\n")
-                print(tabulate(results, headers=columns, tablefmt="psql"))
-            else:
-                print("\nQuery executed successfully. No rows returned.")
-        else:
-            # For non-SELECT queries (INSERT, UPDATE, DELETE, etc.)
-            row_count = cursor.rowcount
-            connection.commit()  # Commit changes for DML statements
-            print(f"\nQuery executed successfully. {row_count} rows affected.")
-        
-        # Close cursor
-        cursor.close()
-        return True
-        
-    except psycopg2.Error as e:
-        print(f"Error executing query: {e}")
-        connection.rollback()  # Rollback any changes in case of error
-        return False
-    finally:
-        connection.close()
+        return ResponseCache(path, cache_config.get('max_entries', 1000), cache_config.get('ttl_seconds', 604800))
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error opening response cache {path}: {e}")
+        return None
 
 
-def display_schemas(schemas):
+def display_cache_stats(cache):
     """
-    Format and display database schema information.
+    Format and display the statistics of the AI response cache.
     
     Args:
-        schemas: List of schema names retrieved from the database
+        cache: The ResponseCache to describe
     """
-    if not schemas:
-        print("No schemas found in the database.")
-        return
-        
-    print("\nAvailable database schemas:")
-    print("=" * 30)
-    
-    for i, schema in enumerate(schemas, 1):
-        print(f"{i}. {schema}")
+    stats = cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    hit_ratio = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
     
-    print("=" * 30)
-    print(f"Total schemas: {len(schemas)}\n")
+    print("\nResponse cache:")
+    print("=" * 40)
+    print(f"Status:        {'enabled' if cache.enabled else 'bypassed'}")
+    print(f"File:          {cache.path}")
+    print(f"Entries:       {stats['entries']} (max {cache.max_entries}, {stats['expired']} expired)")
+    print(f"Size:          {stats['size_bytes'] / 1024:.1f} KB")
+    print(f"Session hits:  {stats['hits']} of {lookups} lookups ({hit_ratio})")
+    print("=" * 40 + "\n")
 
 
-def display_tables(schema_name, tables):
+class SessionStats:
     """
-    Format and display database table information for a specific schema.
+    Collect the latency of each processing stage and the token usage of the session.
     
-    Args:
-        schema_name: Name of the schema containing the tables
-        tables: List of table names retrieved from the database
+    Every recorded span can also be appended to a JSONL file, and the aggregated numbers
+    can be written to an OpenMetrics text file for a node exporter or a scraper to pick up.
     """
-    if not tables:
-        print(f"No tables found in the schema '{schema_name}'.")
-        return
+    
+    def __init__(self, sink_format: Optional[str] = None, sink_path: Optional[str] = None,
+                 flush_interval: float = 10):
+        """
+        Args:
+            sink_format: 'jsonl' to append every span to sink_path, 'openmetrics' to write
+                         the aggregated metrics to sink_path, or None to keep them in memory
+            sink_path: Path of the sink file; parent directories are created if needed
+            flush_interval: Minimum number of seconds between two writes of the OpenMetrics file
+        """
+        self.sink_format = sink_format
+        self.sink_path = os.path.expanduser(sink_path) if sink_path else None
+        self.flush_interval = flush_interval
+        self.last_flush = 0.0
+        self.durations = {}
+        self.tokens = {}
+        self.lock = threading.Lock()
+        self.sink = None
+        
+        if self.sink_path:
+            directory = os.path.dirname(self.sink_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.sink_format == 'jsonl':
+                self.sink = open(self.sink_path, 'a')
+    
+    def write_event(self, event: Dict[str, Any]) -> None:
+        """Append an event to the JSONL sink, if one is configured."""
+        if self.sink is not None:
+            self.sink.write(json.dumps(dict(event, ts=round(time.time(), 3))) + "\n")
+            self.sink.flush()
+    
+    def record(self, stage: str, seconds: float) -> None:
+        """
+        Record the duration of one run of a stage.
+        
+        Args:
+            stage: Name of the stage
+            seconds: Duration of the stage in seconds
+        """
+        with self.lock:
+            self.durations.setdefault(stage, []).append(seconds)
+            self.write_event({'type': 'span', 'stage': stage, 'duration_ms': round(seconds * 1000, 3)})
+        self.flush_if_due()
+    
+    def record_tokens(self, provider: str, model: str, prompt_tokens: Optional[int],
+                      completion_tokens: Optional[int]) -> None:
+        """
+        Record the token counts reported by an AI provider for one response.
+        
+        Args:
+            provider: Name of the AI provider
+            model: Name of the model
+            prompt_tokens: Number of input tokens, or None if not reported
+            completion_tokens: Number of generated tokens, or None if not reported
+        """
+        if prompt_tokens is None and completion_tokens is None:
+            return
+        with self.lock:
+            totals = self.tokens.setdefault((provider, model), {'responses': 0, 'prompt': 0, 'completion': 0})
+            totals['responses'] += 1
+            totals['prompt'] += prompt_tokens or 0
+            totals['completion'] += completion_tokens or 0
+            self.write_event({'type': 'tokens', 'provider': provider, 'model': model,
+                              'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens})
+        self.flush_if_due()
+    
+    @staticmethod
+    def percentile(sorted_values, percent):
+        """Return the nearest-rank percentile of a sorted list of values."""
+        rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+        return sorted_values[rank - 1]
+    
+    def summary(self):
+        """
+        Aggregate the recorded durations per stage.
+        
+        Returns:
+            A list of (stage, count, total, p50, p95, max) tuples in seconds, in the order
+            the stages were first recorded
+        """
+        with self.lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+        return [(stage, len(values), sum(values), self.percentile(values, 50),
+                 self.percentile(values, 95), values[-1])
+                for stage, values in durations.items()]
+    
+    def reset(self) -> None:
+        """Forget the statistics collected so far."""
+        with self.lock:
+            self.durations.clear()
+            self.tokens.clear()
+    
+    def flush_if_due(self) -> None:
+        """Write the OpenMetrics file if the flush interval has elapsed since the last write."""
+        if self.sink_format == 'openmetrics' and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def flush(self) -> None:
+        """
+        Write the aggregated metrics to the OpenMetrics sink, if one is configured.
+        
+        The file is replaced atomically so that readers never see a partial exposition.
+        """
+        if self.sink_format != 'openmetrics' or not self.sink_path:
+            return
+        self.last_flush = time.monotonic()
+        
+        lines = ["# TYPE nlquery_stage_duration_seconds summary",
+                 "# UNIT nlquery_stage_duration_seconds seconds",
+                 "# HELP nlquery_stage_duration_seconds Duration of the nlquery processing stages."]
+        for stage, count, total, p50, p95, _ in self.summary():
+            lines.append(f'nlquery_stage_duration_seconds{{stage="{stage}",quantile="0.5"}} {p50:.6f}')
+            lines.append(f'nlquery_stage_duration_seconds{{stage="{stage}",quantile="0.95"}} {p95:.6f}')
+            lines.append(f'nlquery_stage_duration_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'nlquery_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+        
+        lines += ["# TYPE nlquery_tokens counter",
+                  "# HELP nlquery_tokens Tokens reported by the AI providers."]
+        with self.lock:
+            tokens = dict(self.tokens)
+        for (provider, model), totals in tokens.items():
+            for kind in ('prompt', 'completion'):
+                lines.append(f'nlquery_tokens_total{{provider="{provider}",model="{model}",kind="{kind}"}} '
+                             f'{totals[kind]}')
+        lines.append("# EOF")
+        
+        temp_path = f"{self.sink_path}.tmp"
+        try:
+            with open(temp_path, 'w') as metrics_file:
+                metrics_file.write("\n".join(lines) + "\n")
+            os.replace(temp_path, self.sink_path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics file {self.sink_path}: {e}")
+    
+    def close(self) -> None:
+        """Flush the metrics and close the sink."""
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+
+def create_session_stats(config):
+    """
+    Create the session statistics from the 'stats' configuration block.
+    
+    The 'sink' key selects an optional 'jsonl' or 'openmetrics' sink written to 'path'
+    (nlquery_stats.jsonl or nlquery_metrics.prom by default).
+    
+    Args:
+        config: Configuration dictionary
+        
+    Returns:
+        A SessionStats collecting the statistics of the session
+    """
+    stats_config = config.get('stats', {})
+    sink_format = stats_config.get('sink')
+    if sink_format not in (None, 'jsonl', 'openmetrics'):
+        print(f"Error: Unsupported statistics sink '{sink_format}'. Use 'jsonl' or 'openmetrics'.")
+        sink_format = None
+    
+    default_path = 'nlquery_metrics.prom' if sink_format == 'openmetrics' else 'nlquery_stats.jsonl'
+    path = stats_config.get('path') or default_path if sink_format else None
+    try:
+        return SessionStats(sink_format, path, stats_config.get('flush_interval', 10))
+    except OSError as e:
+        print(f"Error opening statistics sink {path}: {e}")
+        return SessionStats()
+
+
+@contextmanager
+def timed_stage(stage):
+    """
+    Record the duration of a with block as a run of a processing stage.
+    
+    Args:
+        stage: Name of the stage
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        if session_stats is not None:
+            session_stats.record(stage, time.perf_counter() - start_time)
+
+
+def record_token_usage(ai_client_config: Dict[str, Any], prompt_tokens, completion_tokens) -> None:
+    """
+    Record the token counts reported by the provider of an AI client.
+    
+    Args:
+        ai_client_config: Dictionary containing the AI client and model information
+        prompt_tokens: Number of input tokens, or None if not reported
+        completion_tokens: Number of generated tokens, or None if not reported
+    """
+    if session_stats is not None:
+        session_stats.record_tokens(get_provider_name(ai_client_config), ai_client_config.get("model"),
+                                    prompt_tokens, completion_tokens)
+
+
+def display_session_stats(stats):
+    """
+    Format and display the per-stage latency and the token usage of the session.
+    
+    Args:
+        stats: The SessionStats to describe
+    """
+    summary = stats.summary()
+    if not summary:
+        print("No statistics recorded yet.")
+        return
+    
+    rows = [(stage, count, f"{p50 * 1000:.1f}", f"{p95 * 1000:.1f}", f"{maximum * 1000:.1f}",
+             f"{total * 1000:.1f}")
+            for stage, count, total, p50, p95, maximum in summary]
+    print("\nStage latency (ms):")
+    print(tabulate(rows, headers=["Stage", "Count", "p50", "p95", "Max", "Total"], tablefmt="psql"))
+    
+    if stats.tokens:
+        rows = [(provider, model, totals['responses'], totals['prompt'], totals['completion'])
+                for (provider, model), totals in stats.tokens.items()]
+        print("\nToken usage:")
+        print(tabulate(rows, headers=["Provider", "Model", "Responses", "Prompt", "Completion"], tablefmt="psql"))
+    print()
+
+
+def display_result_cache_stats(cache):
+    """
+    Format and display the statistics of the query result cache.
+    
+    Args:
+        cache: The ResultCache to describe
+    """
+    lookups = cache.hits + cache.misses
+    hit_ratio = f"{cache.hits / lookups:.0%}" if lookups else "n/a"
+    
+    print("\nResult cache:")
+    print("=" * 40)
+    print(f"Entries:       {len(cache.entries)} (TTL {cache.ttl_seconds}s)")
+    print(f"Size:          {cache.size_bytes / (1024 * 1024):.1f} of {cache.max_bytes / (1024 * 1024):.0f} MB")
+    print(f"Session hits:  {cache.hits} of {lookups} lookups ({hit_ratio})")
+    print("=" * 40 + "\n")
+
+
+def prepare_system_message(prompt: str, schema_name: Optional[str]) -> str:
+    """
+    Build the system message for a prompt, including the context of the selected schema.
+    
+    Args:
+        prompt: The natural language prompt to process
+        schema_name: Name of the selected schema, or None
+        
+    Returns:
+        The system message
+    """
+    # Format the system message with database context
+    system_message = BASE_SYSTEM_MESSAGE
+    
+    # Get schema information if a schema is selected
+    if schema_name:
+        try:
+            # Reuse the configuration loaded by main() when available
+            config = current_config or load_configuration('config.json')
+            wait_for_schema_warmup(schema_name)
+            with borrow_connection(config) as connection:
+                if connection:
+                    with timed_stage('schema_context'):
+                        context = get_schema_context(connection, schema_name, config)
+                    with timed_stage('system_message'):
+                        system_message, table_count, token_count = build_system_message(
+                            context, schema_name, prompt, config)
+                    print(f"[Schema context: {table_count} of {len(context['tables'])} tables, "
+                          f"~{token_count} tokens]")
+        except Exception as e:
+            logger.error(f"Error retrieving schema DDL: {str(e)}")
+    
+    return system_message
+
+
+def lookup_cached_response(ai_client_config: Dict[str, Any], prompt: str, system_message: str):
+    """
+    Look up a prompt in the response cache.
+    
+    Args:
+        ai_client_config: Dictionary containing the AI client and model information
+        prompt: The natural language prompt to process
+        system_message: The system message sent with the prompt
+        
+    Returns:
+        A tuple (cache_key, cached) where cache_key is None when the cache is not in use
+        and cached is the cached entry on a hit, None otherwise
+    """
+    if response_cache is None or not response_cache.enabled:
+        return None, None
+    
+    with timed_stage('cache_lookup'):
+        cache_key = ResponseCache.make_key(prompt, get_provider_name(ai_client_config),
+                                           ai_client_config.get("model"), system_message)
+        return cache_key, response_cache.get(cache_key)
+
+
+def extract_sql_queries(text: str) -> list:
+    """
+    Extract every SQL query of a complete AI response.
+    
+    Args:
+        text: The AI response
+        
+    Returns:
+        The list of queries, in the order they appear
+    """
+    extractor = SqlBlockExtractor()
+    extractor.feed(text or "")
+    return extractor.queries
+
+
+def create_sql_extractor(on_token=None,
+                         notice="[SQL query extracted: press Ctrl-C to stop the answer and run it with /exec]"
+                         ) -> SqlBlockExtractor:
+    """
+    Create an extractor that stores the SQL queries of an answer in current_queries and
+    the first one in current_query.
+    
+    Args:
+        on_token: The streaming callback of the answer, if any; when set, the user is
+                  told as soon as a query is available
+        notice: The message printed when the first query of a streamed answer is available
+        
+    Returns:
+        A SqlBlockExtractor
+    """
+    def on_query(query):
+        global current_query
+        query = guard_extracted_query(query)
+        current_queries.append(query)
+        if not current_query:
+            current_query = query
+            if on_token is not None:
+                print(f"\n{notice}")
+    
+    return SqlBlockExtractor(on_query)
+
+
+def parse_prompt(ai_client_config: Dict[str, Any], prompt: str, on_token=None) -> str | None | Any:
+    """
+    Process a natural language prompt using the configured AI client.
+    
+    When on_token is given the answer is streamed, and current_query is set as soon as the
+    first ```sql block of the answer is complete, before the generation has finished.
+    
+    Args:
+        ai_client_config: Dictionary containing the AI client and model information
+        prompt: The natural language prompt to process
+        on_token: Optional callable receiving each chunk of the streamed answer
+        
+    Returns:
+        The AI-generated response as a string
+    """
+    global current_query, current_prompt
+    
+    # Clear the extracted queries before processing new prompt
+    current_prompt = prompt
+    current_query = ""
+    current_queries.clear()
+    query_guard_notes.clear()
+    
+    if not ai_client_config or not prompt:
+        return "Error: AI client not configured or prompt is empty."
+    
+    if get_provider_name(ai_client_config) is None:
+        return "Error: Unsupported AI client type."
+    
+    try:
+        system_message = prepare_system_message(prompt, current_schema)
+        
+        # Answer repeated prompts from the response cache
+        cache_key, cached = lookup_cached_response(ai_client_config, prompt, system_message)
+        if cached is not None:
+            # Guard the cached answer like a new one, so that /exec and /exec 1 run the same query
+            current_queries.extend(guard_extracted_query(query) for query in extract_sql_queries(cached['response']))
+            current_query = current_queries[0] if current_queries else ""
+            print("[Cached response]")
+            if on_token is not None:
+                on_token(cached['response'])
+            return cached['response']
+        
+        # Extract SQL code blocks from the response as soon as each block is complete
+        extractor = create_sql_extractor(on_token)
+        
+        def forward_token(token):
+            on_token(token)
+            extractor.feed(token)
+        
+        try:
+            with timed_stage('generation'):
+                llm_response = generate_response(ai_client_config, system_message, prompt,
+                                                 forward_token if on_token is not None else None)
+        except KeyboardInterrupt:
+            # Keep the text received so far; interrupted answers are not cached
+            print("\n[Generation stopped]")
+            return extractor.text
+        
+        # logger.info(llm_response)
+        
+        # Non-streamed responses are scanned once they are complete
+        if llm_response and on_token is None:
+            extractor.feed(llm_response)
+        if session_stats is not None:
+            session_stats.record('extraction', extractor.elapsed)
+        
+        if cache_key is not None and llm_response:
+            response_cache.put(cache_key, llm_response, get_provider_name(ai_client_config),
+                               ai_client_config.get("model"))
+        
+        return llm_response
+            
+    except Exception as e:
+        logger.error(f"Error processing prompt with AI: {str(e)}")
+        return f"Error processing your request: {str(e)}"
+
+
+async def close_async_stream(response) -> None:
+    """
+    Close an asynchronous provider stream, whatever its close method is called.
+    
+    Args:
+        response: The provider stream object
+    """
+    close = getattr(response, "aclose", None) or getattr(response, "close", None)
+    if close:
+        result = close()
+        if inspect.isawaitable(result):
+            await result
+
+
+async def generate_response_async(ai_client_config: Dict[str, Any], system_message: str, prompt: str,
+                                  on_token=None) -> str:
+    """
+    Send a prompt to the AI provider with its asyncio client and return its answer.
+    
+    Cancelling the awaiting task closes the provider stream.
+    
+    Args:
+        ai_client_config: Dictionary containing the asynchronous AI client and model information
+        system_message: The system message describing the database context
+        prompt: The natural language prompt to process
+        on_token: Optional callable; when given, the response is streamed and each text
+                  chunk is passed to it as soon as it arrives
+        
+    Returns:
+        The AI-generated response as a string
+    """
+    provider = get_provider_name(ai_client_config)
+    client = ai_client_config.get("client")
+    model = ai_client_config.get("model")
+    stream = on_token is not None
+    start_time = time.perf_counter()
+    usage = {}  # Token counts reported by the provider, filled while the stream is read
+    
+    if provider == "azure_openai":
+        response = await client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt}
+            ],
+            stream=stream,
+            **({"stream_options": {"include_usage": True}} if stream else {})
+        )
+        if not stream:
+            if response.usage:
+                record_token_usage(ai_client_config, response.usage.prompt_tokens,
+                                   response.usage.completion_tokens)
+            return response.choices[0].message.content
+        
+        def extract(chunk):
+            if getattr(chunk, "usage", None):
+                usage.update(prompt=chunk.usage.prompt_tokens, completion=chunk.usage.completion_tokens)
+            return chunk.choices[0].delta.content if chunk.choices else None
+    
+    elif provider == "anthropic":
+        response = await client.messages.create(
+            model=model,
+            system=system_message,
+            max_tokens=ai_client_config.get("max_tokens", 4096),
+            messages=[{"role": "user", "content": prompt}],
+            stream=stream
+        )
+        if not stream:
+            record_token_usage(ai_client_config, response.usage.input_tokens, response.usage.output_tokens)
+            return response.content[0].text
+        
+        def extract(event):
+            if event.type == "message_start":
+                usage['prompt'] = event.message.usage.input_tokens
+            elif event.type == "message_delta":
+                usage['completion'] = event.usage.output_tokens
+            return getattr(event.delta, "text", None) if event.type == "content_block_delta" else None
+    
+    elif provider == "ollama":
+        response = await client.generate(
+            model=model,
+            prompt=f"{system_message}\n\nUser: {prompt}\n\nAssistant:",
+            stream=stream
+        )
+        if not stream:
+            record_token_usage(ai_client_config, response.get("prompt_eval_count"), response.get("eval_count"))
+            return response.get("response", "No response generated")
+        
+        def extract(chunk):
+            if chunk.get("done"):
+                usage.update(prompt=chunk.get("prompt_eval_count"), completion=chunk.get("eval_count"))
+            return chunk["response"]
+    
+    else:
+        raise ValueError(f"Unsupported AI provider: {provider}")
+    
+    parts = []
+    try:
+        async for chunk in response:
+            text = extract(chunk)
+            if text:
+                if not parts and session_stats is not None:
+                    session_stats.record('first_token', time.perf_counter() - start_time)
+                parts.append(text)
+                on_token(text)
+    except asyncio.CancelledError:
+        await close_async_stream(response)
+        raise
+    record_token_usage(ai_client_config, usage.get('prompt'), usage.get('completion'))
+    return "".join(parts)
+
+
+async def parse_prompt_async(ai_client_config: Dict[str, Any], prompt: str, on_token=None) -> str | None | Any:
+    """
+    Process a natural language prompt with an asyncio AI client.
+    
+    The schema context is built in a worker thread, so the event loop stays free for
+    other tasks while the catalog is loaded and while the model generates.
+    
+    Args:
+        ai_client_config: Dictionary containing the asynchronous AI client and model information
+        prompt: The natural language prompt to process
+        on_token: Optional callable receiving each chunk of the streamed answer
+        
+    Returns:
+        The AI-generated response as a string
+    """
+    global current_query, current_prompt
+    
+    current_prompt = prompt
+    current_query = ""
+    current_queries.clear()
+    query_guard_notes.clear()
+    
+    if not ai_client_config or not prompt:
+        return "Error: AI client not configured or prompt is empty."
+    
+    if get_provider_name(ai_client_config) is None:
+        return "Error: Unsupported AI client type."
+    
+    try:
+        system_message = await asyncio.to_thread(prepare_system_message, prompt, current_schema)
+        
+        cache_key, cached = lookup_cached_response(ai_client_config, prompt, system_message)
+        if cached is not None:
+            # Guard the cached answer like a new one, so that /exec and /exec 1 run the same query
+            current_queries.extend(guard_extracted_query(query) for query in extract_sql_queries(cached['response']))
+            current_query = current_queries[0] if current_queries else ""
+            print("[Cached response]")
+            if on_token is not None:
+                on_token(cached['response'])
+            return cached['response']
+        
+        extractor = create_sql_extractor(on_token, "[SQL query extracted: run it with /exec while the answer continues]")
+        
+        def forward_token(token):
+            on_token(token)
+            extractor.feed(token)
+        
+        with timed_stage('generation'):
+            llm_response = await generate_response_async(ai_client_config, system_message, prompt,
+                                                         forward_token if on_token is not None else None)
+        
+        if llm_response and on_token is None:
+            extractor.feed(llm_response)
+        if session_stats is not None:
+            session_stats.record('extraction', extractor.elapsed)
+        
+        if cache_key is not None and llm_response:
+            response_cache.put(cache_key, llm_response, get_provider_name(ai_client_config),
+                               ai_client_config.get("model"))
+        
+        return llm_response
+    
+    except Exception as e:
+        logger.error(f"Error processing prompt with AI: {str(e)}")
+        return f"Error processing your request: {str(e)}"
+
+
+def get_connection_parameters(config):
+    """
+    Extract the psycopg2 connection parameters from the configuration.
+    
+    Args:
+        config: Configuration dictionary containing database connection parameters
+        
+    Returns:
+        A dictionary of keyword arguments for psycopg2.connect
+    """
+    db_config = config.get('database', {})
+    return {
+        'host': db_config.get('host', 'localhost'),
+        'port': db_config.get('port', 5432),
+        'database': db_config.get('name', ''),
+        'user': db_config.get('user', ''),
+        'password': db_config.get('password', '')
+    }
+
+
+def connect_to_database(config):
+    """
+    Establish a connection to the PostgreSQL database using configuration parameters.
+    
+    Args:
+        config: Configuration dictionary containing database connection parameters
+        
+    Returns:
+        A database connection object if successful, None otherwise
+    """
+    try:
+        # Connect to the PostgreSQL database
+        connection = psycopg2.connect(**get_connection_parameters(config))
+        
+        return connection
+    
+    except psycopg2.Error as e:
+        print(f"Database connection error: {e}")
+        return None
+
+
+def create_connection_pool(config):
+    """
+    Create the shared connection pool used by the REPL.
+    
+    The pool size is read from the 'pool_min_size' and 'pool_max_size' keys of the
+    'database' configuration block.
+    
+    Args:
+        config: Configuration dictionary containing database connection parameters
+        
+    Returns:
+        A psycopg2 ThreadedConnectionPool if successful, None otherwise
+    """
+    db_config = config.get('database', {})
+    min_size = db_config.get('pool_min_size', 1)
+    max_size = db_config.get('pool_max_size', 5)
+    
+    try:
+        pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **get_connection_parameters(config))
+        logger.info(f"Database connection pool created (min={min_size}, max={max_size})")
+        return pool
+    except psycopg2.Error as e:
+        print(f"Database connection error: {e}")
+        return None
+
+
+def is_connection_healthy(connection, ping_interval):
+    """
+    Check that a pooled connection can still be used.
+    
+    Closed connections and connections left in a broken transaction state are rejected
+    without a round trip, as are connections whose open transaction cannot be rolled back.
+    Connections idle for longer than ping_interval seconds are
+    additionally verified with a 'SELECT 1'.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        ping_interval: Idle time in seconds after which the connection is pinged
+        
+    Returns:
+        True if the connection is usable, False otherwise
+    """
+    if connection.closed:
+        return False
+    
+    status = connection.get_transaction_status()
+    if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+    
+    last_used = connection_last_used.get(id(connection), 0)
+    if time.monotonic() - last_used < ping_interval:
+        return True
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        connection.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def get_pooled_connection(config):
+    """
+    Check out a healthy connection from the shared pool.
+    
+    Broken connections are discarded and replaced by new ones. When no pool has been
+    created, a new dedicated connection is opened instead.
+    
+    Args:
+        config: Configuration dictionary containing database connection parameters
+        
+    Returns:
+        A database connection object if successful, None otherwise
+    """
+    if connection_pool is None:
+        connection = connect_to_database(config)
+        if connection:
+            busy_connections[id(connection)] = (threading.get_ident(), connection)
+        return connection
+    
+    ping_interval = config.get('database', {}).get('pool_ping_interval', 30)
+    
+    # Try every connection slot once before giving up
+    attempts = connection_pool.maxconn + 1
+    for _ in range(attempts):
+        try:
+            connection = connection_pool.getconn()
+        except psycopg2.pool.PoolError as e:
+            print(f"Database connection pool error: {e}")
+            return None
+        except psycopg2.Error as e:
+            print(f"Database connection error: {e}")
+            return None
+        
+        if is_connection_healthy(connection, ping_interval):
+            busy_connections[id(connection)] = (threading.get_ident(), connection)
+            return connection
+        
+        logger.warning("Discarding broken pooled database connection")
+        connection_last_used.pop(id(connection), None)
+        connection_pool.putconn(connection, close=True)
+    
+    print("Database connection error: could not obtain a healthy connection from the pool")
+    return None
+
+
+def release_connection(connection, broken=False):
+    """
+    Return a connection to the shared pool, or close it when no pool is in use.
+    
+    Args:
+        connection: A database connection obtained from get_pooled_connection
+        broken: If True, the connection is closed instead of being reused
+    """
+    busy_connections.pop(id(connection), None)
+    
+    if connection_pool is None:
+        connection.close()
+        return
+    
+    if not broken and not connection.closed:
+        try:
+            if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            broken = True
+    
+    broken = broken or bool(connection.closed)
+    if broken:
+        connection_last_used.pop(id(connection), None)
+    else:
+        connection_last_used[id(connection)] = time.monotonic()
+    connection_pool.putconn(connection, close=broken)
+
+
+def cancel_thread_queries(thread_id):
+    """
+    Cancel the statements running on the connections checked out by a thread.
+    
+    Args:
+        thread_id: Identifier of the thread, as returned by threading.get_ident()
+        
+    Returns:
+        The number of connections on which a cancel request was sent
+    """
+    cancelled = 0
+    for owner, connection in list(busy_connections.values()):
+        if owner == thread_id and not connection.closed:
+            try:
+                connection.cancel()
+                cancelled += 1
+            except psycopg2.Error as e:
+                logger.warning(f"Could not cancel query: {e}")
+    return cancelled
+
+
+class DatabaseGate:
+    """
+    Shared/exclusive lock between the statements run on borrowed connections and the CSV
+    exports, which remove the process-wide psycopg2 wait callback.
+    
+    Any number of threads may hold shared access. Exclusive access waits until no other
+    thread holds shared access, and keeps other threads from acquiring it until released.
+    The thread holding exclusive access may still borrow connections.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.shared = Counter()  # Shared holds, keyed by thread identifier
+        self.owner = None  # Thread holding exclusive access
+    
+    @contextmanager
+    def shared_access(self):
+        """Hold shared access for the duration of a with block."""
+        thread_id = threading.get_ident()
+        with self.condition:
+            while self.owner not in (None, thread_id):
+                self.condition.wait()
+            self.shared[thread_id] += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.shared[thread_id] -= 1
+                if not self.shared[thread_id]:
+                    del self.shared[thread_id]
+                self.condition.notify_all()
+    
+    @contextmanager
+    def exclusive_access(self):
+        """Hold exclusive access for the duration of a with block."""
+        thread_id = threading.get_ident()
+        with self.condition:
+            while self.owner is not None or any(holder != thread_id for holder in self.shared):
+                self.condition.wait()
+            self.owner = thread_id
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.owner = None
+                self.condition.notify_all()
+
+
+database_gate = DatabaseGate()  # Keeps borrowed connections and CSV exports apart
+
+
+@contextmanager
+def borrow_connection(config):
+    """
+    Borrow a database connection for the duration of a with block.
+    
+    The connection is used with shared access to the database gate, so it is never used
+    while a CSV export runs without the wait callback.
+    
+    Args:
+        config: Configuration dictionary containing database connection parameters
+        
+    Yields:
+        A database connection object, or None if no connection could be obtained
+    """
+    with database_gate.shared_access():
+        with timed_stage('connect'):
+            connection = get_pooled_connection(config)
+        broken = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if connection is not None:
+                release_connection(connection, broken)
+
+
+def get_database_schemas(connection):
+    """
+    Query and retrieve a list of all schemas in the database.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        
+    Returns:
+        A list of schema names if successful, empty list otherwise
+    """
+    try:
+        cursor = connection.cursor()
+        
+        # Query to get all schemas in the database
+        cursor.execute("SELECT schema_name FROM information_schema.schemata")
+        
+        # Fetch all results
+        schemas = [row[0] for row in cursor.fetchall()]
+        
+        cursor.close()
+        return schemas
+        
+    except psycopg2.Error as e:
+        print(f"Error retrieving database schemas: {e}")
+        return []
+
+
+def get_database_tables_by_schema(connection, schema_name):
+    """
+    Query and retrieve a list of all tables in a specific schema.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to query tables from
+        
+    Returns:
+        A list of table names in the specified schema if successful, empty list otherwise
+    """
+    global tables_list
+    
+    try:
+        cursor = connection.cursor()
+        
+        # Query to get all tables in the specified schema
+        cursor.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = %s",
+            (schema_name,)
+        )
+        
+        # Fetch all results
+        tables = [row[0] for row in cursor.fetchall()]
+        
+        # Format table names with schema name and create comma-separated string
+        formatted_tables = [f"{schema_name}.{table}" for table in tables]
+        tables_list = ",".join(formatted_tables)
+        
+        cursor.close()
+        return tables
+        
+    except psycopg2.Error as e:
+        print(f"Error retrieving tables for schema '{schema_name}': {e}")
+        return []
+
+
+def load_schema_catalog(connection, schema_name, table_name=None):
+    """
+    Load the catalog of a schema with a fixed number of set-based queries against pg_catalog.
+    
+    Columns, constraints (primary keys, unique constraints, foreign keys) and indexes of
+    all tables are fetched with three queries, regardless of the number of tables. The
+    planner statistics of each table (pg_class.reltuples) and its partition key are
+    loaded with the columns.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to load
+        table_name: Optional name of a single table to restrict the catalog to
+        
+    Returns:
+        A dictionary mapping table names (in alphabetical order) to dictionaries with the keys
+        'kind', 'comment', 'row_estimate', 'partition_key', 'partition_columns', 'columns',
+        'primary_key', 'unique_constraints', 'foreign_keys' and 'indexes'. 'row_estimate' is
+        None for tables that have never been analyzed.
+        An empty dictionary is returned on error.
+    """
+    try:
+        cursor = connection.cursor()
+        
+        # Query 1: relations and their columns
+        cursor.execute("""
+            SELECT
+                c.relname,
+                c.relkind,
+                a.attname,
+                format_type(a.atttypid, NULL),
+                CASE WHEN a.atttypid IN (1042, 1043) AND a.atttypmod > 0 THEN a.atttypmod - 4 END,
+                a.attnotnull,
+                CASE WHEN a.attgenerated = '' THEN pg_get_expr(d.adbin, d.adrelid) END,
+                obj_description(c.oid, 'pg_class'),
+                col_description(c.oid, a.attnum),
+                CASE WHEN c.reltuples >= 0 AND (c.relpages > 0 OR c.reltuples > 0) THEN c.reltuples::bigint END,
+                CASE WHEN c.relkind = 'p' THEN pg_get_partkeydef(c.oid) END,
+                ARRAY(
+                    SELECT pa.attname::text
+                    FROM unnest(pt.partattrs::int2[]) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_catalog.pg_attribute pa ON pa.attrelid = c.oid AND pa.attnum = k.attnum
+                    ORDER BY k.ord
+                )
+            FROM
+                pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_catalog.pg_partitioned_table pt ON pt.partrelid = c.oid
+                LEFT JOIN pg_catalog.pg_attribute a
+                    ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+                LEFT JOIN pg_catalog.pg_attrdef d
+                    ON d.adrelid = c.oid AND d.adnum = a.attnum
+            WHERE
+                n.nspname = %s
+                AND c.relkind IN ('r', 'p', 'v', 'm', 'f')
+                AND (%s::text IS NULL OR c.relname = %s)
+            ORDER BY
+                c.relname, a.attnum
+        """, (schema_name, table_name, table_name))
+        
+        catalog = {}
+        for (relname, relkind, column_name, data_type, max_length, not_null, default_value,
+             table_comment, column_comment, row_estimate, partition_key,
+             partition_columns) in cursor.fetchall():
+            table = catalog.setdefault(relname, {
+                'kind': relkind,
+                'comment': table_comment,
+                'row_estimate': row_estimate,
+                'partition_key': partition_key,
+                'partition_columns': partition_columns,
+                'columns': [],
+                'primary_key': [],
+                'unique_constraints': [],
+                'foreign_keys': [],
+                'indexes': []
+            })
+            if column_name is None:
+                continue
+            table['columns'].append({
+                'name': column_name,
+                'data_type': data_type,
+                'max_length': max_length,
+                'is_nullable': 'NO' if not_null else 'YES',
+                'default_value': default_value,
+                'comment': column_comment
+            })
+        
+        # Query 2: primary key, unique and foreign key constraints
+        cursor.execute("""
+            SELECT
+                c.relname,
+                con.conname,
+                con.contype,
+                ARRAY(
+                    SELECT a.attname::text
+                    FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                    ORDER BY k.ord
+                ),
+                fn.nspname,
+                fc.relname,
+                ARRAY(
+                    SELECT a.attname::text
+                    FROM unnest(con.confkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_catalog.pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                    ORDER BY k.ord
+                )
+            FROM
+                pg_catalog.pg_constraint con
+                JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN pg_catalog.pg_class fc ON fc.oid = con.confrelid
+                LEFT JOIN pg_catalog.pg_namespace fn ON fn.oid = fc.relnamespace
+            WHERE
+                n.nspname = %s
+                AND con.contype IN ('p', 'u', 'f')
+                AND (%s::text IS NULL OR c.relname = %s)
+            ORDER BY
+                c.relname, con.conname
+        """, (schema_name, table_name, table_name))
+        
+        for relname, conname, contype, columns, ref_schema, ref_table, ref_columns in cursor.fetchall():
+            table = catalog.get(relname)
+            if table is None:
+                continue
+            if contype == 'p':
+                table['primary_key'] = columns
+            elif contype == 'u':
+                table['unique_constraints'].append(columns)
+            else:
+                table['foreign_keys'].append({
+                    'name': conname,
+                    'columns': columns,
+                    'ref_schema': ref_schema,
+                    'ref_table': ref_table,
+                    'ref_columns': ref_columns
+                })
+        
+        # Query 3: indexes, flagging those that back a constraint
+        cursor.execute("""
+            SELECT
+                c.relname,
+                i.relname,
+                pg_get_indexdef(x.indexrelid),
+                ARRAY(
+                    SELECT pg_get_indexdef(x.indexrelid, k, true)
+                    FROM generate_series(1, x.indnkeyatts) AS k
+                    ORDER BY k
+                ),
+                x.indisunique,
+                EXISTS (
+                    SELECT 1 FROM pg_catalog.pg_constraint con
+                    WHERE con.conindid = x.indexrelid AND con.contype IN ('p', 'u', 'x')
+                )
+            FROM
+                pg_catalog.pg_index x
+                JOIN pg_catalog.pg_class c ON c.oid = x.indrelid
+                JOIN pg_catalog.pg_class i ON i.oid = x.indexrelid
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE
+                n.nspname = %s
+                AND (%s::text IS NULL OR c.relname = %s)
+            ORDER BY
+                c.relname, i.relname
+        """, (schema_name, table_name, table_name))
+        
+        for relname, index_name, definition, columns, is_unique, is_constraint in cursor.fetchall():
+            table = catalog.get(relname)
+            if table is None:
+                continue
+            table['indexes'].append({
+                'name': index_name,
+                'definition': definition,
+                'columns': columns,
+                'is_unique': is_unique,
+                'is_constraint': is_constraint
+            })
+        
+        cursor.close()
+        return catalog
+        
+    except psycopg2.Error as e:
+        print(f"Error loading catalog for schema '{schema_name}': {e}")
+        connection.rollback()
+        return {}
+
+
+def get_table_structure(connection, schema_name, table_name):
+    """
+    Query and retrieve the structure of a specific table in a schema.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema containing the table
+        table_name: Name of the table to get structure for
+        
+    Returns:
+        A list of dictionaries containing column information if successful, empty list otherwise
+    """
+    catalog = load_schema_catalog(connection, schema_name, table_name)
+    table = catalog.get(table_name)
+    return table['columns'] if table else []
+
+
+def format_row_estimate(row_estimate):
+    """
+    Format a planner row estimate for the schema description.
+    
+    Args:
+        row_estimate: Estimated number of rows, or None if the table has never been analyzed
+        
+    Returns:
+        A short string such as '~830 rows', '~1.25M rows' or 'rows unknown (not analyzed)'
+    """
+    if row_estimate is None:
+        return "rows unknown (not analyzed)"
+    for threshold, suffix in ((10 ** 9, 'B'), (10 ** 6, 'M'), (10 ** 3, 'K')):
+        if row_estimate >= threshold:
+            return f"~{row_estimate / threshold:.3g}{suffix} rows"
+    return f"~{row_estimate} rows"
+
+
+def render_table_ddl(schema_name, table_name, table, statistics=False):
+    """
+    Render the DDL (Data Definition Language) statements of a single table.
+    
+    Args:
+        schema_name: Name of the schema containing the table
+        table_name: Name of the table
+        table: Table entry of the dictionary returned by load_schema_catalog
+        statistics: If True, add the row estimate as a comment and the partition key
+        
+    Returns:
+        A string containing the CREATE TABLE statement and the table's secondary indexes
+    """
+    columns = table['columns']
+    
+    if not columns:
+        return f"-- Could not retrieve structure for '{schema_name}.{table_name}'"
+    
+    # Start building the CREATE TABLE statement
+    ddl = ""
+    if statistics and table['kind'] != 'v':
+        ddl += f"-- {format_row_estimate(table['row_estimate'])}\n"
+    ddl += f"CREATE TABLE {schema_name}.{table_name} (\n"
+    
+    # Add column definitions
+    column_definitions = []
+    for column in columns:
+        # Start with column name and data type
+        column_def = f"    {column['name']} {column['data_type']}"
+        
+        # Add character length if applicable
+        if column['max_length'] is not None:
+            column_def += f"({column['max_length']})"
+        
+        # Add NULL/NOT NULL constraint
+        if column['is_nullable'] == 'NO':
+            column_def += " NOT NULL"
+        
+        # Add default value if present
+        if column['default_value'] is not None:
+            column_def += f" DEFAULT {column['default_value']}"
+        
+        column_definitions.append(column_def)
+    
+    # Add table constraints
+    if table['primary_key']:
+        column_definitions.append(f"    PRIMARY KEY ({', '.join(table['primary_key'])})")
+    for unique_columns in table['unique_constraints']:
+        column_definitions.append(f"    UNIQUE ({', '.join(unique_columns)})")
+    for foreign_key in table['foreign_keys']:
+        column_definitions.append(
+            f"    FOREIGN KEY ({', '.join(foreign_key['columns'])}) "
+            f"REFERENCES {foreign_key['ref_schema']}.{foreign_key['ref_table']}"
+            f"({', '.join(foreign_key['ref_columns'])})"
+        )
+    
+    # Join column definitions with commas
+    ddl += ",\n".join(column_definitions)
+    
+    # Close the CREATE TABLE statement
+    ddl += "\n)"
+    if statistics and table['partition_key']:
+        ddl += f" PARTITION BY {table['partition_key']}"
+    ddl += ";"
+    
+    # Add indexes that are not already expressed by a constraint
+    for index in table['indexes']:
+        if not index['is_constraint']:
+            ddl += f"\n{index['definition']};"
+    
+    return ddl
+
+
+SCHEMA_FORMATS = ('ddl', 'compact')
+
+# Short names of the PostgreSQL types used by the compact schema format
+COMPACT_TYPE_NAMES = {
+    'integer': 'int',
+    'bigint': 'int8',
+    'smallint': 'int2',
+    'character varying': 'vc',
+    'character': 'char',
+    'boolean': 'bool',
+    'numeric': 'num',
+    'double precision': 'float8',
+    'real': 'float4',
+    'timestamp without time zone': 'ts',
+    'timestamp with time zone': 'tstz',
+    'time without time zone': 'time',
+    'time with time zone': 'timetz',
+    'interval': 'intvl'
+}
+
+COMPACT_FORMAT_LEGEND = ("Schema (one table per line as schema.table(column type, ...); "
+                         "* primary key, ! not null, U unique, =default, -> foreign key reference, "
+                         "types: vc=varchar, num=numeric, ts=timestamp, tstz=timestamptz):\n")
+
+COMPACT_STATISTICS_LEGEND = COMPACT_FORMAT_LEGEND.replace(
+    "):\n", "; IX(columns) secondary index, ~N rows planner estimate):\n")
+
+STATISTICS_GUIDANCE = ("Row counts are planner estimates. On large tables, filter on indexed columns or the "
+                       "partition key, keep those columns free of functions in WHERE clauses, and add a LIMIT "
+                       "when not all rows are needed.\n")
+
+
+def abbreviate_type(data_type, max_length=None):
+    """
+    Return the short name of a column type for the compact schema format.
+    
+    Args:
+        data_type: Type name as returned by format_type, e.g. 'character varying' or 'integer[]'
+        max_length: Optional length of a character type
+        
+    Returns:
+        The abbreviated type, e.g. 'vc(100)' or 'int[]'
+    """
+    base_type, array_suffix = (data_type[:-2], '[]') if data_type.endswith('[]') else (data_type, '')
+    short_type = COMPACT_TYPE_NAMES.get(base_type, base_type)
+    if max_length is not None:
+        short_type += f"({max_length})"
+    return short_type + array_suffix
+
+
+def render_table_compact(schema_name, table_name, table, statistics=False):
+    """
+    Render a single table on one line for the compact schema format.
+    
+    Defaults other than plain constants, such as sequence defaults, are dropped.
+    
+    Args:
+        schema_name: Name of the schema containing the table
+        table_name: Name of the table
+        table: Table entry of the dictionary returned by load_schema_catalog
+        statistics: If True, add the row estimate, the secondary indexes and the partition key
+        
+    Returns:
+        A line such as 'shop.orders(id int8*, customer_id int->customers.id, ordered_at date!)'
+    """
+    if not table['columns']:
+        return f"{schema_name}.{table_name}(?)"
+    
+    def reference(foreign_key):
+        ref_table = foreign_key['ref_table']
+        if foreign_key['ref_schema'] != schema_name:
+            ref_table = f"{foreign_key['ref_schema']}.{ref_table}"
+        return ref_table
+    
+    # Single-column keys are written next to their column, composite keys after the columns
+    references = {fk['columns'][0]: f"->{reference(fk)}.{fk['ref_columns'][0]}"
+                  for fk in table['foreign_keys'] if len(fk['columns']) == 1}
+    unique_columns = {columns[0] for columns in table['unique_constraints'] if len(columns) == 1}
+    primary_key = set(table['primary_key'])
+    
+    columns = []
+    for column in table['columns']:
+        text = f"{column['name']} {abbreviate_type(column['data_type'], column['max_length'])}"
+        if column['name'] in primary_key:
+            text += "*"
+        elif column['is_nullable'] == 'NO':
+            text += "!"
+        if column['name'] in unique_columns:
+            text += " U"
+        
+        default_value = column['default_value']
+        if default_value is not None:
+            constant = re.match(r"^('(?:[^']|'')*'|-?\d+(?:\.\d+)?|true|false)(?:::[\w ]+)?$", default_value)
+            if constant:
+                text += f"={constant.group(1)}"
+        
+        text += references.get(column['name'], "")
+        columns.append(text)
+    
+    line = f"{schema_name}.{table_name}({', '.join(columns)})"
+    
+    if len(primary_key) > 1:
+        line += f" PK({','.join(table['primary_key'])})"
+    for unique in table['unique_constraints']:
+        if len(unique) > 1:
+            line += f" U({','.join(unique)})"
+    for foreign_key in table['foreign_keys']:
+        if len(foreign_key['columns']) > 1:
+            line += (f" ({','.join(foreign_key['columns'])})->"
+                     f"{reference(foreign_key)}({','.join(foreign_key['ref_columns'])})")
+    if table['kind'] in ('v', 'm'):
+        line += " [view]"
+    
+    if statistics:
+        for index in table['indexes']:
+            if not index['is_constraint']:
+                line += f" IX({','.join(index['columns'])})"
+        if table['partition_key']:
+            line += f" PARTITION BY {table['partition_key']}"
+        if table['kind'] != 'v':
+            line += f" {format_row_estimate(table['row_estimate'])}"
+    
+    return line
+
+
+def render_schema_text(schema_name, catalog, schema_format, statistics=False):
+    """
+    Render the description of every table of a catalog in a schema format.
+    
+    Args:
+        schema_name: Name of the schema the catalog belongs to
+        catalog: Dictionary returned by load_schema_catalog
+        schema_format: 'ddl' for CREATE TABLE statements, 'compact' for one line per table
+        statistics: If True, describe the row estimates, indexes and partition keys
+        
+    Returns:
+        A dictionary mapping table names to their description
+    """
+    render = render_table_compact if schema_format == 'compact' else render_table_ddl
+    return {table_name: render(schema_name, table_name, table, statistics)
+            for table_name, table in catalog.items()}
+
+
+def join_schema_text(table_text, schema_format, statistics=False):
+    """
+    Join table descriptions into the schema section of the system message.
+    
+    Args:
+        table_text: Table descriptions in the order they are sent
+        schema_format: The schema format of the descriptions
+        statistics: If True, the descriptions include table statistics, which are explained
+        
+    Returns:
+        The schema section, starting with its header
+    """
+    schema_text = STATISTICS_GUIDANCE if statistics else ""
+    if schema_format == 'compact':
+        legend = COMPACT_STATISTICS_LEGEND if statistics else COMPACT_FORMAT_LEGEND
+        return schema_text + legend + "\n".join(table_text)
+    return schema_text + "Schema DDL:\n" + "\n\n".join(table_text)
+
+
+def get_schema_format(config):
+    """
+    Return the schema format selected by the 'format' key of the 'ai.context' configuration block.
+    
+    Args:
+        config: Configuration dictionary
+        
+    Returns:
+        'ddl' or 'compact'
+    """
+    schema_format = config.get('ai', {}).get('context', {}).get('format', 'ddl')
+    if schema_format not in SCHEMA_FORMATS:
+        logger.warning(f"Unknown schema format '{schema_format}', using 'ddl'")
+        return 'ddl'
+    return schema_format
+
+
+def render_ddl(schema_name, catalog):
+    """
+    Render DDL (Data Definition Language) statements from a loaded schema catalog.
+    
+    Args:
+        schema_name: Name of the schema the catalog belongs to
+        catalog: Dictionary returned by load_schema_catalog
+        
+    Returns:
+        A string containing all DDL statements for the tables in the catalog
+    """
+    if not catalog:
+        return f"No tables found in schema '{schema_name}'."
+    
+    # Join all DDL statements with double line breaks
+    return "\n\n".join(
+        render_table_ddl(schema_name, table_name, table) for table_name, table in catalog.items()
+    )
+
+
+def generate_ddl(connection, schema_name, catalog=None):
+    """
+    Generate DDL (Data Definition Language) statements for all tables in a specific schema.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to generate DDL for
+        catalog: Optional catalog already returned by load_schema_catalog; loaded if None
+        
+    Returns:
+        A string containing all DDL statements for the tables in the schema
+    """
+    global tables_list
+    
+    # Load the whole schema catalog in a fixed number of round trips
+    if catalog is None:
+        catalog = load_schema_catalog(connection, schema_name)
+    
+    tables_list = ",".join(f"{schema_name}.{table}" for table in catalog)
+    
+    return render_ddl(schema_name, catalog)
+
+
+def get_database_key(config):
+    """
+    Build a key identifying the configured database.
+
+    Args:
+        config: Configuration dictionary containing database connection parameters
+
+    Returns:
+        A string of the form 'host:port/name'
+    """
+    db_config = config.get('database', {})
+    return f"{db_config.get('host', 'localhost')}:{db_config.get('port', 5432)}/{db_config.get('name', '')}"
+
+
+def get_catalog_fingerprint(connection, schema_name):
+    """
+    Compute a cheap fingerprint of the catalog entries of a schema.
+
+    The fingerprint changes whenever a relation of the schema is created, dropped,
+    altered or rewritten, because each of these operations writes a new pg_class
+    or pg_attribute row version (new xmin) or assigns a new relfilenode.
+
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to fingerprint
+
+    Returns:
+        The fingerprint string if successful, None otherwise
+    """
+    try:
+        cursor = connection.cursor()
+
+        query = """
+            SELECT
+                count(*),
+                md5(coalesce(string_agg(
+                    c.oid::text || ':' || c.xmin::text || ':' || c.relfilenode::text
+                        || ':' || coalesce(a.max_xmin::text, ''),
+                    ',' ORDER BY c.oid), ''))
+            FROM
+                pg_catalog.pg_class c
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                LEFT JOIN LATERAL (
+                    SELECT max(att.xmin::text::bigint) AS max_xmin
+                    FROM pg_catalog.pg_attribute att
+                    WHERE att.attrelid = c.oid
+                ) a ON true
+            WHERE
+                n.nspname = %s
+        """
+
+        cursor.execute(query, (schema_name,))
+        count, digest = cursor.fetchone()
+        cursor.close()
+        return f"{count}:{digest}"
+
+    except psycopg2.Error as e:
+        print(f"Error computing catalog fingerprint for schema '{schema_name}': {e}")
+        connection.rollback()
+        return None
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of LLM tokens of a text (about four characters per token).
+    
+    Args:
+        text: The text to measure
+        
+    Returns:
+        The estimated token count
+    """
+    return (len(text) + 3) // 4
+
+
+def tokenize_terms(text):
+    """
+    Split identifiers and free text into normalized search terms.
+    
+    snake_case and camelCase identifiers are split into words, which are lowercased and
+    reduced to a crude singular form so that 'orders' matches 'order_id'.
+    
+    Args:
+        text: Identifier, comment or prompt text; None is treated as empty
+        
+    Returns:
+        A list of terms
+    """
+    terms = []
+    for word in re.findall(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+', text or ''):
+        word = word.lower()
+        if len(word) > 4 and word.endswith('ies'):
+            word = word[:-3] + 'y'
+        elif len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def build_schema_index(catalog):
+    """
+    Build a BM25 lexical index over the tables of a schema catalog.
+    
+    Each table is a document made of its name (weighted three times), its comment and the
+    names and comments of its columns. Foreign keys between tables of the catalog are
+    recorded as an undirected neighbourhood graph.
+    
+    Args:
+        catalog: Dictionary returned by load_schema_catalog
+        
+    Returns:
+        A dictionary with the keys 'documents', 'lengths', 'document_frequency',
+        'average_length' and 'neighbours'
+    """
+    documents = {}
+    neighbours = {table_name: set() for table_name in catalog}
+    
+    for table_name, table in catalog.items():
+        terms = tokenize_terms(table_name) * 3 + tokenize_terms(table.get('comment'))
+        for column in table['columns']:
+            terms += tokenize_terms(column['name']) + tokenize_terms(column.get('comment'))
+        documents[table_name] = Counter(terms)
+        
+        for foreign_key in table['foreign_keys']:
+            ref_table = foreign_key['ref_table']
+            if ref_table in neighbours and ref_table != table_name:
+                neighbours[table_name].add(ref_table)
+                neighbours[ref_table].add(table_name)
+    
+    document_frequency = Counter()
+    for terms in documents.values():
+        document_frequency.update(terms.keys())
+    
+    lengths = {table_name: sum(terms.values()) for table_name, terms in documents.items()}
+    average_length = (sum(lengths.values()) / len(lengths)) if lengths else 1
+    
+    return {
+        'documents': documents,
+        'lengths': lengths,
+        'document_frequency': document_frequency,
+        'average_length': average_length or 1,
+        'neighbours': neighbours
+    }
+
+
+def rank_tables(index, prompt, k1=1.2, b=0.75):
+    """
+    Rank the tables of a schema index by BM25 relevance to a prompt.
+    
+    Args:
+        index: Dictionary returned by build_schema_index
+        prompt: The natural language prompt
+        k1: BM25 term frequency saturation parameter
+        b: BM25 document length normalization parameter
+        
+    Returns:
+        A list of (table_name, score) tuples with a positive score, best match first
+    """
+    query_terms = set(tokenize_terms(prompt))
+    document_count = len(index['documents'])
+    
+    scores = []
+    for table_name, terms in index['documents'].items():
+        length_ratio = index['lengths'][table_name] / index['average_length']
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term)
+            if not frequency:
+                continue
+            df = index['document_frequency'][term]
+            idf = math.log(1 + (document_count - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length_ratio))
+        if score > 0:
+            scores.append((table_name, score))
+    
+    return sorted(scores, key=lambda item: (-item[1], item[0]))
+
+
+def select_relevant_tables(context, prompt, max_tables, max_tokens, expand_foreign_keys=True):
+    """
+    Select the tables whose description is sent to the AI for a prompt.
+    
+    The max_tables best ranked tables are taken first, followed by the tables linked to
+    them by foreign keys. When no table matches the prompt, the tables with the most
+    foreign key links, then the most rows, are taken instead. Tables are added in that
+    order while their description fits in the token budget; the first table is always
+    included.
+    
+    Args:
+        context: Schema context returned by get_schema_context
+        prompt: The natural language prompt
+        max_tables: Number of top ranked tables to select before the foreign key expansion
+        max_tokens: Token budget for the description of the selected tables
+        expand_foreign_keys: If True, add the foreign key neighbours of the top ranked tables
+        
+    Returns:
+        A tuple (table_names, token_count)
+    """
+    ranked = rank_tables(context['index'], prompt)
+    scores = dict(ranked)
+    candidates = [table_name for table_name, _ in ranked[:max_tables]]
+    
+    if not candidates:
+        # No table name matches the prompt (synonyms, another language): describe the
+        # central tables of the schema rather than none
+        neighbours = context['index']['neighbours']
+        catalog = context['catalog']
+        candidates = sorted(context['tables'], key=lambda table_name: (
+            -len(neighbours[table_name]), -(catalog[table_name].get('row_estimate') or 0), table_name))
+    elif expand_foreign_keys:
+        seeds = set(candidates)
+        neighbours = {neighbour for table_name in candidates
+                      for neighbour in context['index']['neighbours'][table_name]} - seeds
+        candidates += sorted(neighbours, key=lambda table_name: (-scores.get(table_name, 0), table_name))
+    
+    selected = []
+    token_count = 0
+    for table_name in candidates:
+        cost = estimate_tokens(context['table_text'][table_name])
+        if selected and token_count + cost > max_tokens:
+            continue
+        selected.append(table_name)
+        token_count += cost
+    
+    return selected, token_count
+
+
+def build_system_message(context, schema_name, prompt, config):
+    """
+    Build the AI system message for a prompt from a schema context.
+    
+    When the description of the whole schema exceeds the token budget, only the tables
+    relevant to the prompt are described. The budget is read from the 'max_tables', 'max_tokens' and
+    'expand_foreign_keys' keys of the 'ai.context' configuration block.
+    
+    Args:
+        context: Schema context returned by get_schema_context
+        schema_name: Name of the schema the context belongs to
+        prompt: The natural language prompt
+        config: Configuration dictionary
+        
+    Returns:
+        A tuple (system_message, table_count, token_count) where token_count is the
+        estimated size of the schema description
+    """
+    context_config = config.get('ai', {}).get('context', {})
+    max_tokens = context_config.get('max_tokens', 8000)
+    
+    # The whole schema fits in the budget: reuse the cached system message
+    if context['schema_tokens'] <= max_tokens:
+        return context['system_message'], len(context['tables']), context['schema_tokens']
+    
+    selected, token_count = select_relevant_tables(
+        context, prompt,
+        context_config.get('max_tables', 15),
+        max_tokens,
+        context_config.get('expand_foreign_keys', True)
+    )
+    
+    system_message = BASE_SYSTEM_MESSAGE
+    system_message += f"\n\nCurrent schema: {schema_name}\n"
+    system_message += f"Relevant tables ({len(selected)} of {len(context['tables'])}): "
+    system_message += ",".join(f"{schema_name}.{table_name}" for table_name in selected) + "\n"
+    
+    # List the remaining table names if they still fit in the budget
+    other_tables = ",".join(f"{schema_name}.{table_name}" for table_name in context['tables']
+                            if table_name not in selected)
+    if other_tables and token_count + estimate_tokens(other_tables) <= max_tokens:
+        system_message += f"Other tables: {other_tables}\n"
+        token_count += estimate_tokens(other_tables)
+    
+    system_message += join_schema_text([context['table_text'][table_name] for table_name in selected],
+                                       context['format'], context['statistics'])
+    
+    return system_message, len(selected), token_count
+
+
+def format_schema_context(context, schema_name, schema_format, statistics=None):
+    """
+    Render the schema description of a context in a schema format.
+    
+    Args:
+        context: Schema context holding at least the 'catalog', 'tables_list' and 'ddl' keys
+        schema_name: Name of the schema the context belongs to
+        schema_format: 'ddl' or 'compact'
+        statistics: If True, describe table statistics; defaults to the setting of the context
+        
+    Returns:
+        A copy of the context with the 'format', 'statistics', 'table_text', 'schema_tokens'
+        and 'system_message' keys set for the schema format
+    """
+    if statistics is None:
+        statistics = context.get('statistics', False)
+    table_text = render_schema_text(schema_name, context['catalog'], schema_format, statistics)
+    if context['catalog']:
+        schema_text = join_schema_text(table_text.values(), schema_format, statistics)
+    else:
+        schema_text = f"Schema DDL:\n{context['ddl']}"
+    
+    system_message = BASE_SYSTEM_MESSAGE
+    system_message += f"\n\nCurrent schema: {schema_name}\n"
+    # Compact lines start with the table name, so the table list would be redundant
+    if schema_format != 'compact' or not context['catalog']:
+        system_message += f"Available tables: {context['tables_list']}\n"
+    system_message += schema_text
+    
+    return dict(context, format=schema_format, statistics=statistics, table_text=table_text,
+                schema_tokens=estimate_tokens(schema_text), system_message=system_message)
+
+
+def get_schema_context(connection, schema_name, config, refresh=False, progress=None):
+    """
+    Return the schema context used to build the AI system message, using the cache when possible.
+
+    The context is cached per (database, schema) and reused as long as the catalog
+    fingerprint of the schema does not change. Tables are described to the AI in the
+    schema format selected by the 'format' key of the 'ai.context' configuration block,
+    with their row estimates, indexes and partition keys when its 'statistics' key is true.
+    Row estimates are refreshed with the context, e.g. by /refresh after an ANALYZE.
+
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to build the context for
+        config: Configuration dictionary containing database connection parameters
+        refresh: If True, rebuild the context even if a valid cached entry exists
+        progress: Optional callable invoked with the name of each build step
+                  ('catalog', 'ddl', 'index') and the number of relations of the schema
+
+    Returns:
+        A dictionary with the keys 'fingerprint', 'format', 'statistics', 'catalog', 'tables',
+        'tables_list', 'ddl', 'table_text', 'schema_tokens', 'index' and 'system_message'
+    """
+    global tables_list
+
+    key = (get_database_key(config), schema_name)
+    schema_format = get_schema_format(config)
+    statistics = config.get('ai', {}).get('context', {}).get('statistics', False)
+    fingerprint = get_catalog_fingerprint(connection, schema_name)
+
+    context = schema_context_cache.get(key)
+    if (context and not refresh and fingerprint is not None and context['fingerprint'] == fingerprint
+            and context['format'] == schema_format and context['statistics'] == statistics):
+        tables_list = context['tables_list']
+        return context
+
+    def report(step):
+        if progress is not None:
+            progress(step, int(fingerprint.split(':')[0]) if fingerprint else None)
+
+    # Build the context from the catalog
+    report('catalog')
+    with timed_stage('catalog'):
+        catalog = load_schema_catalog(connection, schema_name)
+    tables = list(catalog)
+    report('ddl')
+    with timed_stage('ddl'):
+        schema_ddl = generate_ddl(connection, schema_name, catalog)
+    report('index')
+
+    context = {
+        'fingerprint': fingerprint,
+        'catalog': catalog,
+        'tables': tables,
+        'tables_list': tables_list,
+        'ddl': schema_ddl,
+        'index': build_schema_index(catalog)
+    }
+    context = format_schema_context(context, schema_name, schema_format, statistics)
+
+    # Only cache contexts that can be validated later
+    if fingerprint is not None and catalog:
+        schema_context_cache[key] = context
+
+    return context
+
+
+def invalidate_schema_context(config=None, schema_name=None):
+    """
+    Remove entries from the schema context cache.
+
+    Args:
+        config: Configuration dictionary identifying the database; required when schema_name is given
+        schema_name: Name of the schema to invalidate. If None, the whole cache is cleared
+
+    Returns:
+        The number of removed cache entries
+    """
+    if schema_name is None:
+        removed = len(schema_context_cache)
+        schema_context_cache.clear()
+        return removed
+
+    key = (get_database_key(config or {}), schema_name)
+    return 1 if schema_context_cache.pop(key, None) is not None else 0
+
+
+class SchemaWarmup:
+    """
+    Load the context of a schema in a background thread while the user types a prompt.
+    """
+    
+    STEP_DESCRIPTIONS = {
+        'fingerprint': "checking the catalog",
+        'catalog': "loading tables and columns",
+        'ddl': "rendering the DDL",
+        'index': "indexing the tables",
+        'done': "ready"
+    }
+    
+    def __init__(self, schema_name, config):
+        """
+        Args:
+            schema_name: Name of the schema to load
+            config: Configuration dictionary
+        """
+        self.schema_name = schema_name
+        self.config = config
+        self.step = 'fingerprint'
+        self.relation_count = None
+        self.thread_id = None
+        self.started_at = time.monotonic()
+        self.progress_threshold = config.get('ai', {}).get('context', {}).get('warmup_progress_threshold', 1000)
+        self.future = None
+    
+    def is_large(self):
+        """Return True if the schema is large enough for the warm-up progress to be shown."""
+        return self.relation_count is not None and self.relation_count >= self.progress_threshold
+    
+    def on_progress(self, step, relation_count):
+        """Record the current build step and report it for large schemas."""
+        self.step = step
+        self.relation_count = relation_count
+        if self.is_large():
+            print(f"\n[Schema warm-up of '{self.schema_name}': {self.STEP_DESCRIPTIONS[step]} "
+                  f"({relation_count:,} relations)]")
+    
+    def run(self):
+        """Build the schema context into the cache."""
+        self.thread_id = threading.get_ident()
+        with borrow_connection(self.config) as connection:
+            if not connection:
+                return None
+            context = get_schema_context(connection, self.schema_name, self.config, progress=self.on_progress)
+        
+        self.step = 'done'
+        elapsed = time.monotonic() - self.started_at
+        message = (f"Schema context of '{self.schema_name}' ready in {elapsed:.1f}s "
+                   f"({len(context['tables'])} tables, ~{context['schema_tokens']} tokens)")
+        if self.is_large():
+            print(f"\n[{message}]")
+        else:
+            logger.info(message)
+        return context
+    
+    def wait(self):
+        """
+        Wait for the warm-up to finish, telling the user what is still being loaded.
+        
+        Errors of the warm-up are logged; the caller then builds the context itself.
+        """
+        if not self.future.done():
+            print(f"[Waiting for the schema context of '{self.schema_name}': "
+                  f"{self.STEP_DESCRIPTIONS[self.step]}...]")
+        try:
+            self.future.result()
+        except Exception as e:
+            logger.error(f"Schema warm-up of '{self.schema_name}' failed: {e}")
+
+
+def start_schema_warmup(schema_name, config):
+    """
+    Start loading the context of a schema in the background.
+    
+    A warm-up of another schema that has not started yet is cancelled.
+    
+    Args:
+        schema_name: Name of the schema to load
+        config: Configuration dictionary
+        
+    Returns:
+        The SchemaWarmup
+    """
+    global schema_warmup, warmup_executor
+    
+    if warmup_executor is None:
+        warmup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="schema-warmup")
+    if schema_warmup is not None:
+        schema_warmup.future.cancel()
+    
+    warmup = SchemaWarmup(schema_name, config)
+    warmup.future = warmup_executor.submit(warmup.run)
+    schema_warmup = warmup
+    return warmup
+
+
+def wait_for_schema_warmup(schema_name):
+    """
+    Wait for the background warm-up of a schema, if one is in progress.
+    
+    Args:
+        schema_name: Name of the schema about to be used
+    """
+    warmup = schema_warmup
+    if warmup is not None and warmup.schema_name == schema_name and not warmup.future.cancelled():
+        warmup.wait()
+
+
+def stop_schema_warmup():
+    """
+    Stop the background warm-up, cancelling its running catalog queries.
+    """
+    if warmup_executor is None:
+        return
+    if schema_warmup is not None and not schema_warmup.future.done():
+        schema_warmup.future.cancel()
+        if schema_warmup.thread_id is not None:
+            cancel_thread_queries(schema_warmup.thread_id)
+    warmup_executor.shutdown(wait=True)
+
+
+def strip_leading_comments(sql_query):
+    """
+    Remove leading whitespace and SQL comments from a query.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        The query text starting at its first keyword
+    """
+    return re.sub(r'^(\s+|--[^\n]*(\n|$)|/\*.*?\*/)*', '', sql_query, flags=re.DOTALL)
+
+
+def strip_literals_and_comments(sql_query):
+    """
+    Return the lowercase text of a query with its string literals and comments blanked out.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        The query text, with each string literal and comment replaced by a space
+    """
+    return re.sub(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", " ", sql_query, flags=re.DOTALL).lower()
+
+
+SQL_STATEMENT_TOKEN_PATTERN = re.compile(
+    r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|(\$\w*\$).*?\1|;""", flags=re.DOTALL)
+
+
+def split_sql_statements(sql_query):
+    """
+    Split a script into its statements at the semicolons outside string literals, quoted
+    identifiers, dollar-quoted bodies and comments.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        The list of statements without their semicolon; statements holding only comments
+        or whitespace are left out
+    """
+    statements = []
+    start = 0
+    # The newline ends a comment on the last line, which would otherwise swallow the semicolon
+    for match in SQL_STATEMENT_TOKEN_PATTERN.finditer(sql_query + "\n;"):
+        if match.group(0) == ';':
+            statement = sql_query[start:match.start()].strip()
+            if strip_literals_and_comments(statement).strip():
+                statements.append(statement)
+            start = match.end()
+    return statements
+
+
+def is_streamable_query(sql_query):
+    """
+    Check whether a query can be read through a server-side cursor.
+    
+    Only plain reads (SELECT, WITH ... SELECT, VALUES and TABLE) are accepted; data-modifying
+    CTEs and SELECT ... INTO are excluded because they cannot be declared as cursors.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        True if the query can be executed with a named cursor, False otherwise
+    """
+    body = strip_literals_and_comments(sql_query).lstrip()
+    if not re.match(r'(select|with|values|table)\b', body):
+        return False
+    if re.search(r'\b(insert|update|delete|merge|into)\b', body):
+        return False
+    return True
+
+
+def get_top_level_text(sql_query):
+    """
+    Return the lowercase text of a query outside string literals, comments and parentheses.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        The text of the outermost statement, with the content of parentheses removed
+    """
+    text = strip_literals_and_comments(sql_query)
+    depth = 0
+    parts = []
+    for character in text:
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            parts.append(character)
+    return "".join(parts)
+
+
+def guard_large_table_query(sql_query, catalog, schema_name, config):
+    """
+    Limit a generated read query that targets large tables and hint at missing filters.
+    
+    Tables named after FROM and JOIN whose planner row estimate reaches the 'large_table_rows'
+    key of the 'query' configuration block are large. A plain row query reading a large table
+    gets a LIMIT of 'large_table_limit' rows unless it already has one; queries that
+    aggregate, group, sort, deduplicate or combine rows are never limited, since a LIMIT
+    would silently cut their result. When the query reads all the rows of a large table,
+    without a LIMIT or to sort or group them, it gets a hint comment if its WHERE clauses
+    use none of the indexed or partition key columns of the table. A 'large_table_rows' of
+    0 disables the guard.
+    
+    Args:
+        sql_query: SQL query string
+        catalog: Dictionary returned by load_schema_catalog for the schema
+        schema_name: Name of the schema the query was generated for
+        config: Configuration dictionary
+        
+    Returns:
+        A tuple (sql_query, notes) with the guarded query and the list of the changes made
+    """
+    query_config = config.get('query', {})
+    threshold = query_config.get('large_table_rows', 1000000)
+    if not threshold or not catalog or not is_streamable_query(sql_query):
+        return sql_query, []
+    
+    text = strip_literals_and_comments(sql_query)
+    tables = {table_name.lower(): table_name for table_name in catalog}
+    large_tables = []
+    for ref_schema, ref_table in re.findall(r'\b(?:from|join)\s+(?:"?(\w+)"?\s*\.\s*)?"?(\w+)"?', text):
+        table_name = tables.get(ref_table)
+        if ref_schema not in ('', schema_name.lower()) or table_name is None or table_name in large_tables:
+            continue
+        row_estimate = catalog[table_name]['row_estimate']
+        if row_estimate is not None and row_estimate >= threshold:
+            large_tables.append(table_name)
+    
+    if not large_tables:
+        return sql_query, []
+    
+    # Parentheses are removed from the top level text, so count(*) reads as count
+    top_level = get_top_level_text(sql_query)
+    has_limit = re.search(r'\blimit\b|\bfetch\s+(?:first|next)\b', top_level)
+    # The common table expressions are in parentheses, so the first top level SELECT or
+    # TABLE is the main statement
+    main_statement = re.search(r'\b(?:select|table)\b.*', top_level, flags=re.DOTALL)
+    plain_rows = main_statement is not None and not re.search(
+        r'\b(?:group\s+by|having|distinct|order\s+by|union|intersect|except|count|sum|avg|min|max'
+        r'|array_agg|string_agg|json_agg|jsonb_agg|json_object_agg|jsonb_object_agg|bool_and|bool_or|every)\b',
+        main_statement.group(0))
+    # A LIMIT stops a plain scan early, unless all rows must be read to sort or group them
+    reads_all_rows = not has_limit or re.search(r'\b(?:order\s+by|group\s+by|distinct)\b', top_level)
+    
+    notes = []
+    hints = []
+    where_text = " ".join(re.findall(
+        r'\bwhere\b(.*?)(?=\b(?:group|order|limit|offset|having|window|union|intersect|except|fetch)\b|$)',
+        text, flags=re.DOTALL))
+    for table_name in large_tables if reads_all_rows else []:
+        table = catalog[table_name]
+        filter_columns = list(dict.fromkeys(
+            [index['columns'][0] for index in table['indexes'] if index['columns']] + table['partition_columns']))
+        if any(re.search(r'(?<!\w)' + re.escape(column.lower()) + r'(?!\w)', where_text)
+               for column in filter_columns):
+            continue
+        description = f"{schema_name}.{table_name} has {format_row_estimate(table['row_estimate'])}"
+        if filter_columns:
+            hints.append(f"{description}; filter on an indexed or partition key column: "
+                         f"{', '.join(filter_columns)}")
+        else:
+            hints.append(f"{description} and no index; the query reads the whole table")
+    
+    limit = query_config.get('large_table_limit', 1000)
+    if limit and not has_limit and plain_rows:
+        sql_query = re.sub(r';(?:\s|--[^\n]*)*$', '', sql_query.rstrip()) + f"\nLIMIT {limit}"
+        notes.append(f"added LIMIT {limit} because "
+                     f"{', '.join(f'{schema_name}.{table_name}' for table_name in large_tables)} "
+                     f"{'is a large table' if len(large_tables) == 1 else 'are large tables'}")
+    
+    if hints:
+        sql_query = "".join(f"-- Hint: {hint}\n" for hint in hints) + sql_query
+        notes.extend(hints)
+    
+    return sql_query, notes
+
+
+def guard_extracted_query(sql_query):
+    """
+    Apply the large table guard to a query generated for the current schema.
+    
+    The row estimates are read from the cached context of the current schema, which is
+    built before the prompt is sent. The changes made are added to query_guard_notes.
+    
+    Args:
+        sql_query: SQL query extracted from an AI answer
+        
+    Returns:
+        The guarded query
+    """
+    if not current_schema or not current_config:
+        return sql_query
+    context = schema_context_cache.get((get_database_key(current_config), current_schema))
+    if context is None:
+        return sql_query
+    
+    sql_query, notes = guard_large_table_query(sql_query, context['catalog'], current_schema, current_config)
+    query_guard_notes.extend(notes)
+    return sql_query
+
+
+class ResultCache:
+    """
+    In-memory cache of query results with a memory budget, LRU eviction and a time to live.
+    
+    Entries are keyed by the database, the database user and the normalized SQL text.
+    Only results that were read completely are cached, and only for queries calling no
+    volatile function (see is_cacheable_query).
+    """
+    
+    def __init__(self, max_bytes: int, ttl_seconds: float = 300):
+        """
+        Args:
+            max_bytes: Estimated memory budget of all cached results; least recently used
+                       results are evicted above it
+            ttl_seconds: Time to live of a cached result in seconds
+        """
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(sql_query: str, config: Dict[str, Any]) -> tuple:
+        """
+        Build the cache key of a query.
+        
+        Whitespace outside string literals and quoted identifiers, leading comments and a
+        trailing semicolon do not change the key.
+        
+        Args:
+            sql_query: SQL query string
+            config: Configuration dictionary identifying the database
+            
+        Returns:
+            A (database, user, normalized_sql) tuple
+        """
+        normalized_sql = re.sub(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""",
+                                lambda match: match.group(1) or " ",
+                                strip_leading_comments(sql_query)).strip().rstrip(';').rstrip()
+        return get_database_key(config), config.get('database', {}).get('user'), normalized_sql
+    
+    @staticmethod
+    def estimate_size(rows) -> int:
+        """Estimate the memory used by a list of result rows, in bytes."""
+        return sys.getsizeof(rows) + sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+                                         for row in rows)
+    
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached result.
+        
+        Args:
+            key: Cache key returned by make_key
+            
+        Returns:
+            A dictionary with the keys 'columns', 'rows' and 'created_at' on a hit, None otherwise
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry['created_at'] > self.ttl_seconds:
+                self.remove(key)
+                entry = None
+            
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def contains(self, key: tuple) -> bool:
+        """Return True if a result that has not expired is cached under key."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() - entry['created_at'] <= self.ttl_seconds
+    
+    def put(self, key: tuple, columns, rows, size_bytes: int) -> None:
+        """
+        Store a result and evict the least recently used results above the memory budget.
+        
+        Args:
+            key: Cache key returned by make_key
+            columns: Column names of the result
+            rows: All rows of the result
+            size_bytes: Estimated memory used by the rows
+        """
+        if size_bytes > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = {'columns': columns, 'rows': rows, 'size_bytes': size_bytes,
+                                 'created_at': time.time()}
+            self.size_bytes += size_bytes
+            while self.size_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+    
+    def remove(self, key: tuple) -> None:
+        """Remove an entry; the caller holds the lock."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry['size_bytes']
+    
+    def invalidate(self, config: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Remove the cached results of a database.
+        
+        Args:
+            config: Configuration dictionary identifying the database. If None, all
+                    results are removed
+            
+        Returns:
+            The number of removed entries
+        """
+        database = get_database_key(config) if config is not None else None
+        with self.lock:
+            keys = [key for key in self.entries if database is None or key[0] == database]
+            for key in keys:
+                self.remove(key)
+            return len(keys)
+
+
+def create_result_cache(config):
+    """
+    Create the query result cache from the 'result_cache' configuration block.
+    
+    Args:
+        config: Configuration dictionary
+        
+    Returns:
+        A ResultCache if the cache is enabled, None otherwise
+    """
+    cache_config = config.get('result_cache', {})
+    if not cache_config.get('enabled', False):
+        return None
+    return ResultCache(int(cache_config.get('max_mb', 64) * 1024 * 1024), cache_config.get('ttl_seconds', 300))
+
+
+# Functions whose result changes from one execution to the next; queries calling them are not cached.
+# The SQL value functions among them are called without parentheses
+VOLATILE_FUNCTION_PATTERN = re.compile(
+    r'\b(?:(?:now|random|setseed|clock_timestamp|statement_timestamp|transaction_timestamp|timeofday'
+    r'|gen_random_uuid|uuid_generate_v[14]|nextval|currval|lastval|current_setting|txid_current'
+    r'|pg_current_xact_id|pg_backend_pid|inet_client_addr|pg_sleep)\s*\('
+    r'|(?:current_date|current_time|current_timestamp|localtime|localtimestamp'
+    r'|current_user|current_role|session_user|user)\b)')
+
+
+def is_cacheable_query(sql_query):
+    """
+    Check whether the result of a query can be stored in the result cache.
+    
+    Only streamable reads that call no volatile function (now(), random(), current_user...)
+    are cached, since the others may return a different result when run again.
+    
+    Args:
+        sql_query: SQL query string
+        
+    Returns:
+        True if the result of the query can be cached, False otherwise
+    """
+    if not is_streamable_query(sql_query):
+        return False
+    text = re.sub(r'"(?:[^"]|"")*"', ' ', strip_literals_and_comments(sql_query))
+    return not VOLATILE_FUNCTION_PATTERN.search(text)
+
+
+def is_result_cached(sql_query, config):
+    """
+    Check whether the result of a query can be served from the result cache.
+    
+    Args:
+        sql_query: SQL query string
+        config: Configuration dictionary
+        
+    Returns:
+        True if a valid cached result exists, False otherwise
+    """
+    if result_cache is None or not is_cacheable_query(sql_query):
+        return False
+    return result_cache.contains(ResultCache.make_key(sql_query, config))
+
+
+class CachedResultCursor:
+    """
+    Cursor-like reader over a cached result, paged by fetch_result_page like a server-side cursor.
+    """
+    
+    def __init__(self, rows):
+        self.rows = rows
+        self.position = 0
+    
+    def fetchmany(self, size):
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        return rows
+    
+    def close(self):
+        pass
+
+
+def close_active_result():
+    """
+    Close the open server-side cursor, if any, and return its connection to the pool.
+    """
+    global active_result
+    
+    if active_result is None:
+        return
+    
+    result, active_result = active_result, None
+    try:
+        result['cursor'].close()
+    except psycopg2.Error:
+        pass
+    # Cached results are not bound to a connection
+    if result['connection'] is not None:
+        release_connection(result['connection'])
+
+
+def fetch_result_page(row_count):
+    """
+    Fetch and display the next rows of the open server-side cursor.
+    
+    At most row_count rows (plus one look-ahead row) are held in memory, so memory stays
+    bounded regardless of the size of the result. The cursor is closed once the result
+    is exhausted or the configured row cap is reached.
+    
+    Args:
+        row_count: Maximum number of rows to fetch and display
+        
+    Returns:
+        True if rows could be fetched, False otherwise
+    """
+    if active_result is None:
+        print("No open result set. Run a query with /exec or /execute first.")
+        return False
+    
+    result = active_result
+    max_rows = result['max_rows']
+    if max_rows:
+        row_count = min(row_count, max_rows - result['fetched'])
+    
+    try:
+        # Fetch one extra row to know whether more rows are available
+        with timed_stage('fetch'):
+            rows = result['lookahead'] + result['cursor'].fetchmany(row_count + 1 - len(result['lookahead']))
+    except psycopg2.extensions.QueryCanceledError as e:
+        print(f"Query cancelled: {str(e).strip()}")
+        close_active_result()
+        return False
+    except psycopg2.Error as e:
+        print(f"Error fetching rows: {e}")
+        close_active_result()
+        return False
+    
+    result['lookahead'] = rows[row_count:]
+    rows = rows[:row_count]
+    
+    # Keep the rows of the result for the result cache while they fit in its budget
+    if result.get('cache_rows') is not None:
+        result['cache_rows'].extend(rows)
+        result['cache_size'] += ResultCache.estimate_size(rows)
+        if result['cache_size'] > result_cache.max_bytes:
+            result['cache_rows'] = None
+    
+    if result['columns'] is None:
+        result['columns'] = [desc[0] for desc in result['cursor'].description]
+    
+    first_row = result['fetched'] + 1
+    result['fetched'] += len(rows)
+    has_more = bool(result['lookahead'])
+    
+    if not rows and first_row == 1:
+        print("\nQuery executed successfully. No rows returned.")
+    elif rows:
+        prefix = "Query executed successfully. " if first_row == 1 else ""
+        print(f"\n{prefix}Showing rows {first_row}-{result['fetched']}.\n")
+        with timed_stage('render'):
+            print(tabulate(rows, headers=result['columns'], tablefmt="psql"))
+    
+    if has_more and max_rows and result['fetched'] >= max_rows:
+        print(f"Row cap of {max_rows} rows reached; refine the query to see more rows.")
+        close_active_result()
+    elif has_more:
+        print(f"{result['fetched']} rows fetched so far. More rows available: use /more or /next N.")
+    else:
+        if rows or first_row > 1:
+            print(f"All rows fetched: {result['fetched']} rows returned.")
+        if result.get('cache_rows') is not None:
+            result_cache.put(result['cache_key'], result['columns'], result['cache_rows'], result['cache_size'])
+        close_active_result()
+    
+    return True
+
+
+def apply_query_timeouts(connection, config, statement_timeout=None):
+    """
+    Limit the run time of the statements of the current transaction.
+    
+    The limits are read from the 'statement_timeout' and 'lock_timeout' keys of the 'query'
+    configuration block (PostgreSQL interval strings such as '30s', or milliseconds; 0
+    disables a limit). They are set transaction-locally so that pooled connections are not
+    affected once the transaction ends.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        config: Configuration dictionary
+        statement_timeout: Optional statement timeout overriding the configured one
+    """
+    query_config = config.get('query', {})
+    if statement_timeout is None:
+        statement_timeout = query_config.get('statement_timeout', '60s')
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT set_config('statement_timeout', %s, true), set_config('lock_timeout', %s, true)",
+        (str(statement_timeout), str(query_config.get('lock_timeout', '5s')))
+    )
+    cursor.close()
+
+
+def explain_query(connection, sql_query, raise_cancel=False):
+    """
+    Retrieve the estimated execution plan of a query without running it.
+    
+    Only single statements are explained, in a read-only transaction, so that a script
+    such as 'SELECT ...; DELETE ...' cannot modify data through EXPLAIN.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        sql_query: SQL query string to explain
+        raise_cancel: If True, an EXPLAIN cancelled by Ctrl-C or a timeout raises
+                      QueryCanceledError instead of returning None
+        
+    Returns:
+        The root plan node of EXPLAIN (FORMAT JSON) as a dictionary, or None if the
+        statement cannot be explained
+    """
+    statements = split_sql_statements(sql_query)
+    if len(statements) != 1:
+        if statements:
+            logger.warning(f"Not explaining a script of {len(statements)} statements")
+        return None
+    sql_query = statements[0]
+    
+    # Utility statements such as DDL cannot be explained
+    if not re.match(r'(select|with|values|table|insert|update|delete|merge)\b',
+                    strip_leading_comments(sql_query).lower()):
+        return None
+    
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql_query}")
+        plan = cursor.fetchone()[0]
+        cursor.close()
+        connection.rollback()
+        
+        # The JSON plan is decoded by psycopg2 unless the server returned it as text
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+    
+    except psycopg2.Error as e:
+        connection.rollback()
+        if raise_cancel and isinstance(e, psycopg2.extensions.QueryCanceledError):
+            raise
+        logger.warning(f"Could not explain query: {str(e).strip().splitlines()[0]}")
+        return None
+
+
+def preflight_query(sql_query, config):
+    """
+    Show the estimated cost of a query and ask for confirmation when it is expensive.
+    
+    The check is controlled by the 'preflight' and 'cost_threshold' keys of the 'query'
+    configuration block. Statements that cannot be explained are let through, but a check
+    interrupted with Ctrl-C stops the query.
+    
+    Args:
+        sql_query: SQL query string to check
+        config: Configuration dictionary
+        
+    Returns:
+        True if the query may be executed, False if the user declined or interrupted the check
+    """
+    query_config = config.get('query', {})
+    if not query_config.get('preflight', True):
+        return True
+    
+    try:
+        with borrow_connection(config) as connection:
+            if not connection:
+                return True  # execute_query reports the connection failure
+            apply_query_timeouts(connection, config)
+            plan = explain_query(connection, sql_query, raise_cancel=True)
+        
+        if plan is None:
+            return True
+        
+        cost = plan.get('Total Cost', 0)
+        print(f"Estimated cost: {cost:,.0f}, estimated rows: {plan.get('Plan Rows', 0):,}")
+        
+        threshold = query_config.get('cost_threshold', 1000000)
+        if threshold and cost > threshold:
+            answer = input(f"Estimated cost exceeds the threshold of {threshold:,}. Run the query anyway? [y/N] ")
+            if answer.strip().lower() not in ('y', 'yes'):
+                print("Query execution cancelled.")
+                return False
+    
+    # The query the user tried to stop must not run unchecked
+    except (KeyboardInterrupt, EOFError, psycopg2.extensions.QueryCanceledError):
+        print("\nPreflight check cancelled, the query was not executed.")
+        return False
+    
+    return True
+
+
+REWRITE_PROMPT = """The following PostgreSQL query was written for this request: {prompt}
+
+```sql
+{sql_query}
+```
+
+Its estimated plan (total cost {cost:,.0f}) is:
+{plan}
+
+Problems found in the plan:
+{issues}
+
+Rewrite the query so that it returns exactly the same result with a cheaper plan, for example by
+replacing correlated subqueries with joins or aggregates, keeping functions off indexed columns in
+WHERE clauses, and removing the join fan-out instead of hiding it with DISTINCT.
+Answer with the rewritten query in a single ```sql block."""
+
+
+def iterate_plan_nodes(plan, parent=None, depth=0):
+    """
+    Walk the nodes of an EXPLAIN (FORMAT JSON) plan depth first.
+    
+    Args:
+        plan: A plan node
+        parent: The parent node of plan, if any
+        depth: The depth of plan in the tree
+        
+    Yields:
+        Tuples (node, parent, depth)
+    """
+    yield plan, parent, depth
+    for child in plan.get('Plans', []):
+        yield from iterate_plan_nodes(child, plan, depth + 1)
+
+
+def get_work_mem(connection):
+    """
+    Return the work_mem setting of a connection in bytes.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        
+    Returns:
+        The number of bytes, or None if the setting cannot be read
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_size_bytes(current_setting('work_mem'))")
+        work_mem = cursor.fetchone()[0]
+        cursor.close()
+        connection.rollback()
+        return work_mem
+    except psycopg2.Error as e:
+        logger.warning(f"Could not read work_mem: {str(e).strip()}")
+        connection.rollback()
+        return None
+
+
+def find_plan_issues(sql_query, plan, work_mem, config, catalog=None):
+    """
+    Detect the costly patterns of a query and its estimated plan.
+    
+    The patterns are sequential scans of large tables, nested loops over large row
+    estimates without an index on the inner side, correlated subqueries evaluated for many
+    rows, sorts and hashes larger than work_mem, and SELECT DISTINCT over joins. The
+    thresholds are read from the 'seq_scan_rows', 'nested_loop_rows' and 'subplan_rows'
+    keys of the 'optimize' configuration block.
+    
+    Args:
+        sql_query: SQL query string
+        plan: Root plan node returned by explain_query
+        work_mem: The work_mem setting in bytes, or None if unknown
+        config: Configuration dictionary
+        catalog: Optional catalog of the current schema, whose row estimates size the scans
+        
+    Returns:
+        A list of issue descriptions
+    """
+    optimize_config = config.get('optimize', {})
+    seq_scan_rows = optimize_config.get('seq_scan_rows', 100000)
+    nested_loop_rows = optimize_config.get('nested_loop_rows', 1000000)
+    subplan_rows = optimize_config.get('subplan_rows', 1000)
+    
+    issues = []
+    for node, parent, _ in iterate_plan_nodes(plan):
+        node_type = node.get('Node Type')
+        rows = node.get('Plan Rows', 0)
+        
+        if node_type == 'Seq Scan':
+            relation = node.get('Relation Name')
+            table = (catalog or {}).get(relation)
+            table_rows = table['row_estimate'] if table and table['row_estimate'] is not None else rows
+            if table_rows >= seq_scan_rows:
+                issue = f"sequential scan of {relation} (~{table_rows:,} rows)"
+                if node.get('Filter'):
+                    issue += f" with filter {node['Filter']}"
+                issues.append(issue)
+        
+        elif node_type == 'Nested Loop' and len(node.get('Plans', [])) == 2:
+            outer, inner = node['Plans']
+            # A memoized inner side is as good as the scan it caches
+            inner_scan = inner['Plans'][0] if inner.get('Node Type') == 'Memoize' else inner
+            if ('Index' not in inner_scan.get('Node Type', '') and 'Bitmap' not in inner_scan.get('Node Type', '')
+                    and outer.get('Plan Rows', 0) * inner.get('Plan Rows', 0) >= nested_loop_rows):
+                issues.append(f"nested loop joining ~{outer.get('Plan Rows', 0):,} outer rows with "
+                              f"~{inner.get('Plan Rows', 0):,} rows of a {inner_scan.get('Node Type')} per loop")
+        
+        elif node_type in ('Sort', 'Hash') and work_mem:
+            size = rows * node.get('Plan Width', 0)
+            if size > work_mem:
+                action = f"sort on {', '.join(node.get('Sort Key', []))}" if node_type == 'Sort' else "hash table"
+                issues.append(f"{action} of ~{size / (1024 * 1024):,.0f} MB ({rows:,} rows) exceeds work_mem "
+                              f"({work_mem / (1024 * 1024):,.0f} MB) and likely spills to disk")
+        
+        if node.get('Parent Relationship') == 'SubPlan' and parent is not None:
+            parent_rows = parent.get('Plan Rows', 0)
+            if parent_rows >= subplan_rows:
+                issues.append(f"correlated subquery ({node.get('Subplan Name', 'SubPlan')}) evaluated for "
+                              f"each of ~{parent_rows:,} rows of a {parent.get('Node Type')}")
+    
+    top_level = get_top_level_text(sql_query)
+    if re.search(r'\bselect\s+distinct\b', top_level) and re.search(r'\bjoin\b|\bfrom\b[^;]*?,', top_level):
+        issues.append("SELECT DISTINCT over a join, which may hide duplicate rows produced by the join")
+    
+    # A table scanned twice, e.g. in a self join, is reported once
+    return list(dict.fromkeys(issues))
+
+
+def summarize_plan(plan, max_nodes=40):
+    """
+    Describe an estimated plan as an indented list of nodes for the AI.
+    
+    Args:
+        plan: Root plan node returned by explain_query
+        max_nodes: Maximum number of nodes described
+        
+    Returns:
+        The plan summary
+    """
+    lines = []
+    for node, _, depth in iterate_plan_nodes(plan):
+        if len(lines) == max_nodes:
+            lines.append("  ...")
+            break
+        line = f"{'  ' * depth}{node.get('Node Type')}"
+        if node.get('Join Type'):
+            line += f" ({node['Join Type']})"
+        if node.get('Relation Name'):
+            line += f" on {node['Relation Name']}"
+        if node.get('Index Name'):
+            line += f" using {node['Index Name']}"
+        line += f"  rows={node.get('Plan Rows', 0):,} cost={node.get('Total Cost', 0):,.0f}"
+        for key in ('Index Cond', 'Hash Cond', 'Join Filter', 'Filter', 'Sort Key', 'Group Key'):
+            if node.get(key):
+                value = node[key] if isinstance(node[key], str) else ", ".join(node[key])
+                line += f"  {key.lower()}: {value}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def plan_variant(sql_query, config, catalog=None):
+    """
+    Explain a query variant and detect the costly patterns of its plan.
+    
+    Args:
+        sql_query: SQL query string
+        config: Configuration dictionary
+        catalog: Optional catalog of the current schema
+        
+    Returns:
+        A dictionary with the keys 'sql', 'plan', 'cost', 'rows' and 'issues'; 'plan' and
+        'cost' are None when the query cannot be explained
+    """
+    variant = {'sql': sql_query, 'plan': None, 'cost': None, 'rows': None, 'issues': []}
+    with borrow_connection(config) as connection:
+        if not connection:
+            return variant
+        apply_query_timeouts(connection, config)
+        plan = explain_query(connection, sql_query)
+        work_mem = get_work_mem(connection) if plan is not None else None
+    
+    if plan is not None:
+        variant.update(plan=plan, cost=plan.get('Total Cost', 0), rows=plan.get('Plan Rows', 0),
+                       issues=find_plan_issues(sql_query, plan, work_mem, config, catalog))
+    return variant
+
+
+def optimize_query(ai_client_config, sql_query, prompt, config):
+    """
+    Ask the AI to rewrite a query whose estimated plan has costly patterns.
+    
+    The plan summary and the detected issues are sent back to the model, and the rewrite
+    is kept when its estimated cost is lower. Rewrites are requested until the plan has no
+    issue left, a rewrite is not cheaper, or the 'max_rounds' key of the 'optimize'
+    configuration block is reached. The cost of every variant is shown to the user.
+    
+    Args:
+        ai_client_config: Dictionary containing the AI client and model information
+        sql_query: SQL query string
+        prompt: The natural language prompt the query was generated for
+        config: Configuration dictionary
+        
+    Returns:
+        The cheapest query variant
+    """
+    max_rounds = config.get('optimize', {}).get('max_rounds', 2)
+    context = schema_context_cache.get((get_database_key(config), current_schema)) if current_schema else None
+    catalog = context['catalog'] if context else None
+    
+    with timed_stage('optimize'):
+        best = plan_variant(sql_query, config, catalog)
+        if best['plan'] is None:
+            print("[Optimize: the query cannot be explained; it is kept as is]")
+            return sql_query
+        if not best['issues']:
+            print(f"[Optimize: estimated cost {best['cost']:,.0f}, no costly plan pattern found]")
+            return sql_query
+        
+        print("Plan issues of the query:")
+        for issue in best['issues']:
+            print(f"  - {issue}")
+        
+        system_message = prepare_system_message(prompt or sql_query, current_schema)
+        variants = [("original", best)]
+        for round_number in range(1, max_rounds + 1):
+            rewrite_prompt = REWRITE_PROMPT.format(
+                prompt=prompt or "(not available)", sql_query=best['sql'], cost=best['cost'],
+                plan=summarize_plan(best['plan']), issues="\n".join(f"- {issue}" for issue in best['issues']))
+            try:
+                queries = extract_sql_queries(generate_response(ai_client_config, system_message, rewrite_prompt))
+            except Exception as e:
+                print(f"Error requesting a rewrite from the AI: {e}")
+                break
+            if not queries:
+                print("[Optimize: the AI answer contains no SQL query]")
+                break
+            
+            candidate = plan_variant(queries[0], config, catalog)
+            variants.append((f"rewrite {round_number}", candidate))
+            if candidate['cost'] is None or candidate['cost'] >= best['cost']:
+                break
+            best = candidate
+            if not best['issues']:
+                break
+    
+    rows = [(name, f"{variant['cost']:,.0f}" if variant['cost'] is not None else "not plannable",
+             f"{variant['rows']:,}" if variant['rows'] is not None else "", len(variant['issues']),
+             "*" if variant is best else "")
+            for name, variant in variants]
+    print(tabulate(rows, headers=["Variant", "Est. cost", "Est. rows", "Plan issues", "Kept"], tablefmt="psql"))
+    
+    original = variants[0][1]
+    if best is original:
+        print("The original query is kept.")
+    else:
+        print(f"Rewritten query kept, estimated cost {original['cost']:,.0f} -> {best['cost']:,.0f} "
+              f"({(best['cost'] - original['cost']) / original['cost']:+.0%}). Review it before running it:\n"
+              f"{best['sql']}")
+    return best['sql']
+
+
+def optimize_current_query(config, position=1):
+    """
+    Run the plan-guided rewrite on a query of the last answer and keep the cheaper variant.
+    
+    Args:
+        config: Configuration dictionary
+        position: Position of the query in the last answer, starting at 1
+    """
+    global current_query
+    
+    sql_query = current_queries[position - 1] if current_queries else current_query
+    if not sql_query:
+        print("Error: No SQL query to optimize. First generate a query using natural language.")
+        return
+    
+    ai_client_config = get_ai_client(config)
+    if ai_client_config is None:
+        print("Error: AI client not configured.")
+        return
+    
+    optimized = optimize_query(ai_client_config, sql_query, current_prompt, config)
+    if optimized != sql_query:
+        if current_queries:
+            current_queries[position - 1] = optimized
+        if current_query == sql_query:
+            current_query = optimized
+
+
+def execute_query(sql_query, config=None, fresh=False):
+    """
+    Execute an SQL query and display the results as a formatted table.
+    
+    Read queries are streamed through a server-side cursor: only the first page of rows
+    is fetched and displayed, further pages are retrieved with /more and /next N.
+    Page size and row cap are read from the 'page_size' and 'max_rows' keys of the
+    'query' configuration block. Every statement runs under the configured statement and
+    lock timeouts; pressing Ctrl-C cancels the running statement on the server.
+    
+    When the result cache is enabled, completely read results are cached and served
+    again for the same query; any other statement invalidates the cached results of
+    the database.
+    
+    Args:
+        sql_query: SQL query string to execute
+        config: Configuration dictionary containing database connection parameters
+               If None, uses the default config.json
+        fresh: If True, bypass the result cache and run the query on the database
+    
+    Returns:
+        True if execution was successful, False otherwise
+    """
+    global active_result
+    
+    if not sql_query:
+        print("Error: No SQL query provided.")
+        return False
+    
+    # Load config if not provided
+    if config is None:
+        config = load_configuration('config.json')
+    
+    # A new query replaces the previously open result set
+    close_active_result()
+    
+    query_config = config.get('query', {})
+    streamable = is_streamable_query(sql_query)
+    cache_key = (ResultCache.make_key(sql_query, config)
+                 if result_cache is not None and is_cacheable_query(sql_query) else None)
+    
+    # Serve repeated reads from the result cache
+    cached = result_cache.get(cache_key) if cache_key is not None and not fresh else None
+    if cached is not None:
+        age = time.time() - cached['created_at']
+        print(f"[Cached result from {age:.0f}s ago: use /exec --fresh to run the query again]")
+        active_result = {
+            'connection': None,
+            'cursor': CachedResultCursor(cached['rows']),
+            'columns': cached['columns'],
+            'fetched': 0,
+            'lookahead': [],
+            'max_rows': query_config.get('max_rows', 0)
+        }
+        return fetch_result_page(query_config.get('page_size', 100))
+    
+    with timed_stage('connect'):
+        connection = get_pooled_connection(config)
+    if not connection:
+        print("Failed to connect to the database. Please check your configuration.")
+        return False
+    
+    if streamable:
+        try:
+            apply_query_timeouts(connection, config)
+            
+            # Named cursors are declared on the server and read in batches
+            cursor = connection.cursor(name="nlquery_result")
+            with timed_stage('execution'):
+                cursor.execute(sql_query)
+        except psycopg2.Error as e:
+            print(f"Error executing query: {e}")
+            release_connection(connection)
+            return False
+        
+        active_result = {
+            'connection': connection,
+            'cursor': cursor,
+            'columns': None,
+            'fetched': 0,
+            'lookahead': [],
+            'max_rows': query_config.get('max_rows', 0),
+            'cache_key': cache_key,
+            'cache_rows': [] if cache_key is not None else None,
+            'cache_size': 0
+        }
+        return fetch_result_page(query_config.get('page_size', 100))
+    
+    try:
+        apply_query_timeouts(connection, config)
+        
+        # Create cursor
+        cursor = connection.cursor()
+        
+        # Execute query
+        with timed_stage('execution'):
+            cursor.execute(sql_query)
+        
+        # Check if query returns results (SHOW, INSERT ... RETURNING, etc.)
+        if cursor.description:
+            # Get column names from cursor description
+            columns = [desc[0] for desc in cursor.description]
+            
+            # Fetch all results
+            with timed_stage('fetch'):
+                results = cursor.fetchall()
+            connection.commit()  # Commit changes made by statements returning rows
+            
+            # Display results as a table
+            if results:
+                print(f"\nQuery executed successfully. {len(results)} rows returned.\n")
+                with timed_stage('render'):
+                    print(tabulate(results, headers=columns, tablefmt="psql"))
+            else:
+                print("\nQuery executed successfully. No rows returned.")
+        else:
+            # For non-SELECT queries (INSERT, UPDATE, DELETE, etc.)
+            row_count = cursor.rowcount
+            connection.commit()  # Commit changes for DML statements
+            print(f"\nQuery executed successfully. {row_count} rows affected.")
+        
+        # Statements other than plain reads may have changed the data or the schema
+        if result_cache is not None:
+            result_cache.invalidate(config)
+        
+        # Close cursor
+        cursor.close()
+        return True
+        
+    except psycopg2.Error as e:
+        if isinstance(e, psycopg2.extensions.QueryCanceledError):
+            print(f"Query cancelled: {str(e).strip()}")
+        else:
+            print(f"Error executing query: {e}")
+        if not connection.closed:
+            connection.rollback()  # Rollback any changes in case of error
+        return False
+    finally:
+        release_connection(connection)
+
+
+def read_statement_result(cursor, max_rows):
+    """
+    Read the result of an executed statement, keeping at most max_rows rows.
+    
+    Args:
+        cursor: Cursor that executed the statement
+        max_rows: Maximum number of rows kept
+        
+    Returns:
+        A dictionary with the keys 'columns', 'rows', 'truncated' and 'row_count'
+    """
+    # Named cursors only describe their result once rows have been fetched
+    if cursor.name is None and not cursor.description:
+        return {'columns': None, 'rows': [], 'truncated': False, 'row_count': cursor.rowcount}
+    
+    rows = cursor.fetchmany(max_rows + 1)
+    return {
+        'columns': [desc[0] for desc in cursor.description],
+        'rows': rows[:max_rows],
+        'truncated': len(rows) > max_rows,
+        'row_count': min(len(rows), max_rows)
+    }
+
+
+def run_read_statement(sql_query, config, max_rows, connections):
+    """
+    Run a read-only statement on its own pooled connection.
+    
+    Args:
+        sql_query: SQL query string
+        config: Configuration dictionary
+        max_rows: Maximum number of rows kept
+        connections: List the connection is added to while the statement runs, so that
+                     it can be cancelled
+        
+    Returns:
+        A result dictionary as returned by read_statement_result, or with an 'error' key
+    """
+    start_time = time.perf_counter()
+    with borrow_connection(config) as connection:
+        if not connection:
+            return {'error': "Failed to connect to the database"}
+        
+        connections.append(connection)
+        try:
+            apply_query_timeouts(connection, config)
+            # Read through a server-side cursor so that only max_rows rows are transferred
+            cursor = connection.cursor(name="nlquery_statement")
+            with timed_stage('execution'):
+                cursor.execute(sql_query)
+                result = read_statement_result(cursor, max_rows)
+            cursor.close()
+        except psycopg2.Error as e:
+            result = {'error': str(e).strip()}
+        finally:
+            connections.remove(connection)
+    
+    result['elapsed'] = time.perf_counter() - start_time
+    return result
+
+
+def run_statements_in_transaction(queries, config, max_rows):
+    """
+    Run statements one after the other in a single transaction.
+    
+    The transaction is committed when every statement succeeds and rolled back as soon
+    as one fails; the remaining statements are then skipped.
+    
+    Args:
+        queries: SQL query strings, in execution order
+        config: Configuration dictionary
+        max_rows: Maximum number of rows kept per statement
+        
+    Returns:
+        A list of result dictionaries, one per executed statement
+    """
+    results = []
+    with borrow_connection(config) as connection:
+        if not connection:
+            return [{'error': "Failed to connect to the database"}]
+        
+        try:
+            apply_query_timeouts(connection, config)
+            cursor = connection.cursor()
+            for sql_query in queries:
+                start_time = time.perf_counter()
+                with timed_stage('execution'):
+                    cursor.execute(sql_query)
+                result = read_statement_result(cursor, max_rows)
+                result['elapsed'] = time.perf_counter() - start_time
+                results.append(result)
+            cursor.close()
+            connection.commit()
+        except psycopg2.Error as e:
+            results.append({'error': str(e).strip()})
+            connection.rollback()
+        except KeyboardInterrupt:
+            connection.cancel()
+            connection.rollback()
+            raise
+    
+    if result_cache is not None:
+        result_cache.invalidate(config)
+    return results
+
+
+def display_statement_result(position, sql_query, result):
+    """
+    Display the result of one of several executed statements.
+    
+    Args:
+        position: Number of the statement in the list of extracted queries
+        sql_query: SQL query string
+        result: Result dictionary of the statement, or None if it was not executed
+    """
+    print(f"\n[{position}] {sql_query}")
+    if result is None:
+        print("Not executed.")
+    elif 'error' in result:
+        print(f"Error executing query: {result['error']}")
+    elif result['columns'] is None:
+        print(f"Query executed successfully in {result['elapsed']:.2f}s. {result['row_count']} rows affected.")
+    else:
+        truncated = f" (first {result['row_count']} rows shown)" if result['truncated'] else ""
+        print(f"Query executed successfully in {result['elapsed']:.2f}s. "
+              f"{result['row_count']} rows returned{truncated}.\n")
+        if result['rows']:
+            with timed_stage('render'):
+                print(tabulate(result['rows'], headers=result['columns'], tablefmt="psql"))
+
+
+def execute_all_queries(queries, config):
+    """
+    Execute all the SQL queries extracted from an answer and display their results in order.
+    
+    When every statement is a plain read, the statements run concurrently, each on its own
+    pooled connection. Otherwise they run one after the other in a single transaction, so
+    that later statements see the changes of earlier ones and a failure rolls back all of
+    them. At most 'page_size' rows of the 'query' configuration block are shown per statement.
+    
+    Args:
+        queries: SQL query strings
+        config: Configuration dictionary
+        
+    Returns:
+        True if every statement was successful, False otherwise
+    """
+    max_rows = config.get('query', {}).get('page_size', 100)
+    start_time = time.perf_counter()
+    
+    # Give the connection of the open result set back to the pool before fanning out
+    close_active_result()
+    
+    if all(is_streamable_query(sql_query) for sql_query in queries):
+        # Only use the pooled connections that are free, since a running schema warm-up keeps
+        # its own: asking the pool for more fails instead of waiting
+        free_connections = connection_pool.maxconn - len(busy_connections) if connection_pool is not None else 1
+        connections = []
+        with ThreadPoolExecutor(max_workers=max(1, min(len(queries), free_connections))) as executor:
+            futures = [executor.submit(run_read_statement, sql_query, config, max_rows, connections)
+                       for sql_query in queries]
+            try:
+                results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                # Cancel the running statements so that the workers finish promptly
+                for future in futures:
+                    future.cancel()
+                for connection in list(connections):
+                    connection.cancel()
+                print("Query cancelled.")
+                return False
+        mode = "concurrently"
+    else:
+        try:
+            results = run_statements_in_transaction(queries, config, max_rows)
+        except KeyboardInterrupt:
+            print("Query cancelled. The transaction was rolled back.")
+            return False
+        mode = "in one transaction"
+    
+    for position, sql_query in enumerate(queries, 1):
+        display_statement_result(position, sql_query, results[position - 1] if position <= len(results) else None)
+    
+    failed = sum(1 for result in results if 'error' in result)
+    if mode == "in one transaction" and failed:
+        print("\nThe transaction was rolled back.")
+    print(f"\n{len(results)} of {len(queries)} statements executed {mode} in "
+          f"{time.perf_counter() - start_time:.2f}s, {failed} failed.")
+    return failed == 0
+
+
+def display_extracted_queries():
+    """
+    Tell the user how to run the queries of the last answer when it contains several, and
+    what the large table guard changed in them.
+    """
+    for note in query_guard_notes:
+        print(f"[Query guard: {note}]")
+    if len(current_queries) > 1:
+        print(f"[{len(current_queries)} SQL queries extracted: run one with /exec <n>, all with /exec all]")
+
+
+def display_queries():
+    """
+    Display the numbered list of the SQL queries extracted from the last answer.
+    """
+    if not current_queries:
+        print("No SQL queries extracted. First generate a query using natural language.")
+        return
+    
+    print("\nExtracted SQL queries:")
+    print("=" * 60)
+    for position, sql_query in enumerate(current_queries, 1):
+        print(f"{position}. {sql_query}")
+    print("=" * 60 + "\n")
+
+
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+
+
+@contextmanager
+def without_wait_callback():
+    """
+    Temporarily remove the psycopg2 wait callback, which COPY does not support.
+    
+    The callback is global to the process: the caller holds exclusive access to the
+    database gate, so that no other thread runs a statement without it meanwhile.
+    """
+    callback = psycopg2.extensions.get_wait_callback()
+    psycopg2.extensions.set_wait_callback(None)
+    try:
+        yield
+    finally:
+        psycopg2.extensions.set_wait_callback(callback)
+
+
+def run_cancellable(connection, func, *args):
+    """
+    Run a blocking database call in a helper thread, so that Ctrl-C can cancel it.
+    
+    Without the wait callback, libpq blocks the calling thread and Ctrl-C is only seen
+    once the call returns. The calling thread waits for the helper instead, and cancels
+    the statement running on the connection when it is interrupted.
+    
+    Args:
+        connection: The connection the call runs on
+        func: The blocking function to run
+        *args: Positional arguments passed to func
+        
+    Returns:
+        The return value of func
+    """
+    outcome = {}
+    # Thread.join() interrupted by Ctrl-C can mark a running thread as stopped, so the
+    # helper signals its end with an event instead
+    finished = threading.Event()
+    
+    def target():
+        try:
+            outcome['result'] = func(*args)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            finished.set()
+    
+    threading.Thread(target=target, name="nlquery-copy", daemon=True).start()
+    try:
+        while not finished.wait(0.1):
+            pass
+    except KeyboardInterrupt:
+        connection.cancel()
+        finished.wait()
+        raise
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+def export_csv(connection, sql_query, path):
+    """
+    Stream the result of a query into a CSV file with COPY ... TO STDOUT.
+    
+    The rows are written by the server in CSV format and copied to the file in chunks,
+    without being converted to Python tuples.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        sql_query: SQL query whose result is exported
+        path: Path of the CSV file to write
+        
+    Returns:
+        The number of exported rows
+    """
+    cursor = connection.cursor()
+    with open(path, 'wb') as export_file, without_wait_callback():
+        # The newline ends a comment on the last line of the query
+        run_cancellable(connection, cursor.copy_expert,
+                        f"COPY ({sql_query}\n) TO STDOUT WITH (FORMAT csv, HEADER)", export_file)
+    row_count = cursor.rowcount
+    cursor.close()
+    return row_count
+
+
+def get_arrow_columns(description):
+    """
+    Map the columns of a query result to Arrow types.
+    
+    Args:
+        description: The cursor description of the query result
+        
+    Returns:
+        A tuple (schema, converters) where converters holds, for each column, None or a
+        function converting a Python value into a value of the column's Arrow type
+    """
+    import pyarrow as pa
+    
+    type_map = {
+        16: pa.bool_(),
+        17: pa.binary(),
+        20: pa.int64(),
+        21: pa.int16(),
+        23: pa.int32(),
+        700: pa.float32(),
+        701: pa.float64(),
+        1082: pa.date32(),
+        1083: pa.time64('us'),
+        1114: pa.timestamp('us'),
+        1184: pa.timestamp('us', tz='UTC')
+    }
+    
+    fields = []
+    converters = []
+    for column in description:
+        arrow_type = type_map.get(column.type_code)
+        converter = None
+        
+        if column.type_code == 1700 and column.precision and column.precision <= 38:
+            # numeric with a declared precision keeps its exact decimal value
+            arrow_type = pa.decimal128(column.precision, column.scale or 0)
+        elif column.type_code in (114, 3802):
+            # json and jsonb values are decoded by psycopg2; store them as JSON text
+            converter = json.dumps
+        elif arrow_type is None:
+            # Every other type (text, uuid, unconstrained numeric, ...) is exported as text
+            converter = str
+        
+        fields.append(pa.field(column.name, arrow_type or pa.string()))
+        converters.append(converter)
+    
+    return pa.schema(fields), converters
+
+
+def export_arrow(connection, sql_query, path, export_format, batch_size):
+    """
+    Write the result of a query to a Parquet or Arrow IPC file in record batches.
+    
+    Rows are read through a server-side cursor and written batch by batch, so memory use
+    is bounded by the batch size regardless of the size of the result.
+    
+    Args:
+        connection: A PostgreSQL database connection object
+        sql_query: SQL query whose result is exported
+        path: Path of the file to write
+        export_format: 'parquet' or 'arrow'
+        batch_size: Number of rows per record batch
+        
+    Returns:
+        The number of exported rows
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    cursor = connection.cursor(name="nlquery_export")
+    cursor.execute(sql_query)
+    
+    rows = cursor.fetchmany(batch_size)
+    schema, converters = get_arrow_columns(cursor.description)
+    
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(path, schema)
+    else:
+        writer = pa.ipc.new_file(path, schema)
+    
+    row_count = 0
+    try:
+        while rows:
+            columns = []
+            for index, converter in enumerate(converters):
+                values = [row[index] for row in rows]
+                if converter is not None:
+                    values = [None if value is None else converter(value) for value in values]
+                columns.append(values)
+            
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            row_count += len(rows)
+            rows = cursor.fetchmany(batch_size)
+    finally:
+        writer.close()
+        cursor.close()
+    
+    return row_count
+
+
+def export_query(sql_query, export_format, path, config):
+    """
+    Export the result of a query to a file and report the throughput.
+    
+    The batch size and statement timeout of exports are read from the 'batch_size' and
+    'statement_timeout' keys of the 'export' configuration block; by default exports are
+    not limited by the interactive statement timeout.
+    
+    Args:
+        sql_query: SQL query whose result is exported
+        export_format: 'csv', 'parquet' or 'arrow'
+        path: Path of the file to write
+        config: Configuration dictionary
+        
+    Returns:
+        True if the export was successful, False otherwise
+    """
+    if export_format not in EXPORT_FORMATS:
+        print(f"Error: Unsupported export format '{export_format}'. Choose one of: {', '.join(EXPORT_FORMATS)}")
+        return False
+    
+    if export_format != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print(f"Error: The {export_format} export requires pyarrow. Install it with: pip install pyarrow")
+            return False
+    
+    export_config = config.get('export', {})
+    statements = split_sql_statements(sql_query)
+    if len(statements) != 1:
+        print(f"Error: Only a single query can be exported, got {len(statements)} statements.")
+        return False
+    sql_query = statements[0]
+    
+    # The result is written next to the target and moved into place once complete,
+    # so that a failed or cancelled export does not leave a partial file behind
+    temporary_path = f"{path}.tmp"
+    # COPY runs without the wait callback, which no other thread may observe
+    gate = database_gate.exclusive_access() if export_format == 'csv' else nullcontext()
+    with gate, borrow_connection(config) as connection:
+        if not connection:
+            print("Failed to connect to the database. Please check your configuration.")
+            return False
+        
+        start_time = time.perf_counter()
+        completed = False
+        try:
+            apply_query_timeouts(connection, config, export_config.get('statement_timeout', 0))
+            if export_format == 'csv':
+                row_count = export_csv(connection, sql_query, temporary_path)
+            else:
+                row_count = export_arrow(connection, sql_query, temporary_path, export_format,
+                                         export_config.get('batch_size', 10000))
+            os.replace(temporary_path, path)
+            completed = True
+        except psycopg2.Error as e:
+            print(f"Error exporting query: {e}")
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Error writing export file {path}: {e}")
+            return False
+        except KeyboardInterrupt:
+            connection.cancel()
+            print("Export cancelled.")
+            return False
+        finally:
+            if not connection.closed:
+                connection.rollback()
+            if not completed and os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+    
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"Exported {row_count:,} rows to {path} ({size_mb:,.1f} MB) in {elapsed:.2f}s: "
+          f"{row_count / elapsed:,.0f} rows/s, {size_mb / elapsed:,.1f} MB/s")
+    return True
+
+
+def display_schemas(schemas):
+    """
+    Format and display database schema information.
+    
+    Args:
+        schemas: List of schema names retrieved from the database
+    """
+    if not schemas:
+        print("No schemas found in the database.")
+        return
+        
+    print("\nAvailable database schemas:")
+    print("=" * 30)
+    
+    for i, schema in enumerate(schemas, 1):
+        print(f"{i}. {schema}")
+    
+    print("=" * 30)
+    print(f"Total schemas: {len(schemas)}\n")
+
+
+def display_tables(schema_name, tables):
+    """
+    Format and display database table information for a specific schema.
+    
+    Args:
+        schema_name: Name of the schema containing the tables
+        tables: List of table names retrieved from the database
+    """
+    if not tables:
+        print(f"No tables found in the schema '{schema_name}'.")
+        return
+        
+    print(f"\nTables in schema '{schema_name}':")
+    print("=" * 40)
+    
+    for i, table in enumerate(tables, 1):
+        print(f"{i}. {table}")
+    
+    print("=" * 40)
+    print(f"Total tables: {len(tables)}\n")
+
+
+def display_table_structure(schema_name, table_name, columns):
+    """
+    Format and display the structure of a database table.
+    
+    Args:
+        schema_name: Name of the schema containing the table
+        table_name: Name of the table
+        columns: List of dictionaries containing column information
+    """
+    if not columns:
+        print(f"No column information found for table '{schema_name}.{table_name}'.")
+        return
+        
+    print(f"\nStructure of table '{schema_name}.{table_name}':")
+    print("=" * 160)
+    
+    # Print header
+    print(f"{'Column Name':<25} {'Data Type':<30} {'Max Length':<10} {'Nullable':<10} {'Default':<30}")
+    print("-" * 160)
+    
+    # Print each column's details
+    for column in columns:
+        name = column['name']
+        data_type = column['data_type']
+        max_length = str(column['max_length']) if column['max_length'] is not None else 'N/A'
+        is_nullable = 'YES' if column['is_nullable'] == 'YES' else 'NO'
+        default_value = str(column['default_value']) if column['default_value'] is not None else 'NULL'
+        
+        print(f"{name:<25} {data_type:<30} {max_length:<10} {is_nullable:<10} {default_value:<30}")
+    
+    print("=" * 160)
+    print(f"Total columns: {len(columns)}\n")
+
+
+def split_fresh_flag(arguments):
+    """
+    Split the optional --fresh flag from the arguments of /exec and /execute.
+    
+    Args:
+        arguments: The command arguments
+        
+    Returns:
+        A tuple (fresh, remaining_arguments)
+    """
+    arguments = arguments.strip()
+    if arguments == '--fresh' or arguments.startswith('--fresh '):
+        return True, arguments[7:].strip()
+    return False, arguments
+
+
+def display_schema_formats(context, schema_name):
+    """
+    Display the size of the schema description in every schema format.
+    
+    Args:
+        context: Schema context returned by get_schema_context
+        schema_name: Name of the schema the context belongs to
+    """
+    rows = []
+    ddl_tokens = None
+    for schema_format in SCHEMA_FORMATS:
+        formatted = format_schema_context(context, schema_name, schema_format)
+        text = "".join(formatted['table_text'].values())
+        ddl_tokens = ddl_tokens or formatted['schema_tokens']
+        rows.append((schema_format, len(formatted['tables']), len(text), formatted['schema_tokens'],
+                     f"{formatted['schema_tokens'] / ddl_tokens:.0%}"))
+    
+    print(f"\nSchema description of '{schema_name}':")
+    print(tabulate(rows, headers=["Format", "Tables", "Characters", "Est. tokens", "vs DDL"], tablefmt="psql"))
+    print()
+
+
+def compare_schema_formats(ai_client_config, context, schema_name, prompt, config):
+    """
+    Send a prompt once with each schema format and compare cost, latency and answers.
+    
+    The response cache is bypassed. The answer quality is approximated by whether a SQL
+    query was extracted and whether the database can plan it; the queries are printed
+    for a side by side review.
+    
+    Args:
+        ai_client_config: Dictionary containing the AI client and model information
+        context: Schema context returned by get_schema_context
+        schema_name: Name of the schema the context belongs to
+        prompt: The natural language prompt
+        config: Configuration dictionary
+    """
+    rows = []
+    for schema_format in SCHEMA_FORMATS:
+        formatted = format_schema_context(context, schema_name, schema_format)
+        system_message, table_count, token_count = build_system_message(formatted, schema_name, prompt, config)
+        
+        usage = {}
+        start_time = time.perf_counter()
+        try:
+            llm_response = generate_response(ai_client_config, system_message, prompt, usage=usage)
+        except Exception as e:
+            print(f"Error processing prompt with AI ({schema_format} format): {e}")
+            continue
+        elapsed = time.perf_counter() - start_time
+        
+        queries = extract_sql_queries(llm_response)
+        sql_query = queries[0] if queries else ""
+        
+        plannable = "n/a"
+        if sql_query:
+            with borrow_connection(config) as connection:
+                if connection:
+                    apply_query_timeouts(connection, config)
+                    plannable = "yes" if explain_query(connection, sql_query) is not None else "no"
+        
+        prompt_eval = usage.get('prompt_eval_ms')
+        rows.append((schema_format, table_count, token_count, usage.get('prompt', "n/a"),
+                     f"{prompt_eval:.0f}" if prompt_eval is not None else "n/a",
+                     f"{elapsed:.2f}", "yes" if sql_query else "no", plannable))
+        print(f"\n[{schema_format}] SQL query:\n{sql_query or '(none)'}")
+    
+    print()
+    print(tabulate(rows, headers=["Format", "Tables", "Est. tokens", "Prompt tokens", "Prompt eval ms",
+                                  "Total s", "SQL", "Plannable"], tablefmt="psql"))
+    print()
+
+
+def display_help():
+    """
+    Display a list of all available commands with short descriptions.
+    """
+    print("\nAvailable Commands:")
+    print("=" * 80)
+    print("/help                            - Display this help message")
+    print("/exit                            - Exit the program")
+    print("/clear                           - Reset all global variables")
+    print("/schema <schema_name>            - Set the current working schema")
+    print("/refresh [schema_name]           - Invalidate the cached schema context (all schemas if omitted)")
+    print("/provider [name]                 - Show or switch the AI provider (azure_openai, anthropic, ollama)")
+    print("/context [compare <prompt>]      - Compare the schema formats by size, or by answers to a prompt")
+    print("/cache stats|clear|on|off        - Show, clear, enable or bypass the AI response cache")
+    print("/cache results [clear]           - Show or clear the query result cache")
+    print("/stats [reset]                   - Show or reset the per-stage latency and token usage of the session")
+    print("/schemas                         - List all available database schemas")
+    print("/tables <schema_name>            - List all tables in a specific schema")
+    print("/table <schema_name> <table_name> - Show structure of a specific table")
+    print("/ddl <schema_name>               - Generate DDL statements for all tables in a schema")
+    print("/exec                            - Execute the last extracted SQL query (shorthand)")
+    print("/exec --fresh                    - Execute the last extracted SQL query, bypassing the result cache")
+    print("/exec [--fresh] <n>              - Execute the n-th SQL query of the last answer")
+    print("/exec all                        - Execute all SQL queries of the last answer")
+    print("/queries                         - List the SQL queries of the last answer")
+    print("/optimize [n]                    - Rewrite the last (or n-th) query when its plan has costly patterns")
+    print("/execute                         - Execute the last extracted SQL query")
+    print("/execute <custom_sql>            - Execute a custom SQL query")
+    print("/export <format> <path> [sql]    - Export the last extracted or a custom query to csv, parquet or arrow (parquet and arrow need pyarrow)")
+    print("/more                            - Show the next page of the last query result")
+    print("/next <n>                        - Show the next n rows of the last query result")
+    print("/tasks                           - List running background tasks (--async mode)")
+    print("/cancel <task_id>|all            - Cancel background tasks (--async mode)")
+    print("=" * 80)
+    print("For any other input, the system will process it as a natural language query")
+    print("to the AI assistant about the database.\n")
+
+
+def handle_command(nlcommand, config):
+    """
+    Execute a REPL command.
+    
+    Args:
+        nlcommand: The command without its '/' prefix
+        config: Configuration dictionary
+        
+    Returns:
+        False if the REPL should exit, True otherwise
+    """
+    global tables_list, current_schema, current_query, current_provider
+    
+    # Check if the command is 'exit' (case-insensitive)
+    if nlcommand.lower() == 'exit':
+        return False  # Exit the program
+    
+    # Handle the 'help' command to display available commands
+    elif nlcommand.lower() == 'help':
+        display_help()
+    
+    # Handle the 'clear' command to reset all global variables
+    elif nlcommand.lower() == 'clear':
+        tables_list = ""
+        current_schema = None
+        close_active_result()
+        invalidate_schema_context()
+        print("All global variables have been reset.")
+    
+    # Handle the 'refresh [schema_name]' command to invalidate cached schema contexts
+    elif nlcommand.lower() == 'refresh' or nlcommand.lower().startswith('refresh '):
+        schema_name = nlcommand[8:].strip()
+        
+        if schema_name:
+            removed = invalidate_schema_context(config, schema_name)
+            print(f"Schema context cache cleared for '{schema_name}' ({removed} entries removed).")
+        else:
+            removed = invalidate_schema_context()
+            print(f"Schema context cache cleared ({removed} entries removed).")
+    
+    # Handle the 'schema <schema_name>' command to set the current schema
+    elif nlcommand.lower().startswith('schema '):
+        # Extract schema name from the command
+        current_schema = nlcommand[7:].strip()
+        
+        if not current_schema:
+            print("Error: Schema name is required. Usage: /schema <schema_name>")
+        else:
+            print(f"Current schema set to '{current_schema}'")
+            
+            # Verify the schema exists
+            with borrow_connection(config) as connection:
+                if connection:
+                    schemas = get_database_schemas(connection)
+                    if current_schema in schemas:
+                        print(f"Schema '{current_schema}' found in the database.")
+                        # Load the schema context while the user types the first prompt
+                        start_schema_warmup(current_schema, config)
+                    else:
+                        print(f"Warning: Schema '{current_schema}' not found in the database.")
+                else:
+                    print("Failed to connect to the database. Please check your configuration.")
+    
+    # Handle the 'provider [name]' command to show or switch the AI provider
+    elif nlcommand.lower() == 'provider' or nlcommand.lower().startswith('provider '):
+        provider = nlcommand[9:].strip().lower()
+        
+        if not provider:
+            active = current_provider or config.get('ai', {}).get('provider', '')
+            initialized = ", ".join(ai_client_registry) or "none"
+            print(f"Current AI provider: {active or 'not configured'} (initialized clients: {initialized})")
+        elif provider not in SUPPORTED_PROVIDERS:
+            print(f"Unsupported AI provider: {provider}. Choose one of: {', '.join(SUPPORTED_PROVIDERS)}")
+        else:
+            current_provider = provider
+            print(f"AI provider switched to '{provider}'")
+    
+    # Handle the 'context [compare <prompt>]' command to compare the schema formats
+    elif nlcommand.lower() == 'context' or nlcommand.lower().startswith('context '):
+        arguments = nlcommand[7:].strip()
+        
+        if not current_schema:
+            print("Error: No schema selected. Use /schema <schema_name> first.")
+        elif arguments and not arguments.lower().startswith('compare '):
+            print("Error: Unknown context action. Usage: /context [compare <prompt>]")
+        else:
+            context = None
+            with borrow_connection(config) as connection:
+                if connection:
+                    context = get_schema_context(connection, current_schema, config)
+                else:
+                    print("Failed to connect to the database. Please check your configuration.")
+            
+            if context is not None and not arguments:
+                display_schema_formats(context, current_schema)
+            elif context is not None:
+                ai_client_config = get_ai_client(config)
+                if ai_client_config is None:
+                    print("Error: AI client not configured.")
+                else:
+                    compare_schema_formats(ai_client_config, context, current_schema, arguments[8:].strip(), config)
+    
+    # Handle the 'stats [reset]' command to show the latency of each processing stage
+    elif nlcommand.lower() == 'stats' or nlcommand.lower().startswith('stats '):
+        action = nlcommand[5:].strip().lower()
+        if session_stats is None:
+            print("Statistics are not collected in this session.")
+        elif action == 'reset':
+            session_stats.reset()
+            print("Session statistics reset.")
+        elif not action:
+            display_session_stats(session_stats)
+        else:
+            print("Error: Unknown stats action. Usage: /stats [reset]")
+    
+    # Handle the 'cache stats|clear|on|off' command to manage the AI response cache
+    elif nlcommand.lower() == 'cache' or nlcommand.lower().startswith('cache '):
+        action = nlcommand[6:].strip().lower() or 'stats'
+        
+        if action in ('results', 'results clear'):
+            if result_cache is None:
+                print("The result cache is disabled in the configuration.")
+            elif action == 'results clear':
+                print(f"Result cache cleared ({result_cache.invalidate()} results removed).")
+            else:
+                display_result_cache_stats(result_cache)
+        elif response_cache is None:
+            print("The response cache is disabled in the configuration.")
+        elif action == 'stats':
+            display_cache_stats(response_cache)
+        elif action == 'clear':
+            removed = response_cache.clear()
+            print(f"Response cache cleared ({removed} entries removed).")
+        elif action in ('on', 'off'):
+            response_cache.enabled = action == 'on'
+            print(f"Response cache {'enabled' if response_cache.enabled else 'bypassed'}.")
+        else:
+            print("Error: Unknown cache action. Usage: /cache stats|clear|on|off")
+    
+    # Handle the 'schemas' command to retrieve database schemas
+    elif nlcommand.lower() == 'schemas':
+        print("Retrieving database schemas...")
+        with borrow_connection(config) as connection:
+            if connection:
+                schemas = get_database_schemas(connection)
+                display_schemas(schemas)
+            else:
+                print("Failed to connect to the database. Please check your configuration.")
+            
+    # Handle the 'tables <schema_name>' command to retrieve tables from a specific schema
+    elif nlcommand.lower().startswith('tables '):
+        # Extract schema name from the command
+        schema_name = nlcommand[7:].strip()
+        
+        if not schema_name:
+            print("Error: Schema name is required. Usage: /tables <schema_name>")
+        else:
+            print(f"Retrieving tables for schema '{schema_name}'...")
+            with borrow_connection(config) as connection:
+                if connection:
+                    tables = get_database_tables_by_schema(connection, schema_name)
+                    display_tables(schema_name, tables)
+                else:
+                    print("Failed to connect to the database. Please check your configuration.")
+    
+    # Handle the 'table <schema_name> <table_name>' command to retrieve table structure
+    elif nlcommand.lower().startswith('table '):
+        # Split the command into parts to extract schema and table names
+        parts = nlcommand.split()
+        
+        if len(parts) < 3:
+            print("Error: Schema name and table name are required. Usage: /table <schema_name> <table_name>")
+        else:
+            schema_name = parts[1]
+            table_name = parts[2]
+            
+            print(f"Retrieving structure for table '{schema_name}.{table_name}'...")
+            with borrow_connection(config) as connection:
+                if connection:
+                    context = get_schema_context(connection, schema_name, config)
+                    table = context['catalog'].get(table_name)
+                    columns = table['columns'] if table else []
+                    display_table_structure(schema_name, table_name, columns)
+                else:
+                    print("Failed to connect to the database. Please check your configuration.")
+    
+    # Handle the 'ddl <schema_name>' command to generate DDL statements for a schema
+    elif nlcommand.lower().startswith('ddl '):
+        # Extract schema name from the command
+        schema_name = nlcommand[4:].strip()
+        
+        if not schema_name:
+            print("Error: Schema name is required. Usage: /ddl <schema_name>")
+        else:
+            print(f"Generating DDL for schema '{schema_name}'...")
+            with borrow_connection(config) as connection:
+                if connection:
+                    context = get_schema_context(connection, schema_name, config)
+                    print(context['ddl'])
+                else:
+                    print("Failed to connect to the database. Please check your configuration.")
         
-    print(f"\nTables in schema '{schema_name}':")
-    print("=" * 40)
+    # Handle the 'exec' command to execute the current SQL query
+    elif nlcommand.lower() in ('exec', 'exec --fresh'):
+        fresh, _ = split_fresh_flag(nlcommand[4:])
+        if not current_query:
+            print("Error: No SQL query to execute. First generate a query using natural language.")
+        else:
+            print(f"Executing SQL query:\n{current_query}\n")
+            # Cached results are served without checking the plan again
+            if (not fresh and is_result_cached(current_query, config)) or preflight_query(current_query, config):
+                execute_query(current_query, config, fresh)
+        
+    # Handle the 'exec all' and 'exec <n>' commands to run the queries of the last answer
+    elif nlcommand.lower().startswith('exec '):
+        fresh, target = split_fresh_flag(nlcommand[5:])
+        target = target.lower()
+        
+        if not current_queries:
+            print("Error: No SQL query to execute. First generate a query using natural language.")
+        elif target == 'all':
+            print(f"Executing {len(current_queries)} SQL queries...")
+            if all(preflight_query(sql_query, config) for sql_query in current_queries):
+                execute_all_queries(list(current_queries), config)
+        elif target.isdigit() and 1 <= int(target) <= len(current_queries):
+            query_to_execute = current_queries[int(target) - 1]
+            print(f"Executing SQL query:\n{query_to_execute}\n")
+            # Cached results are served without checking the plan again
+            if (not fresh and is_result_cached(query_to_execute, config)) or preflight_query(query_to_execute, config):
+                execute_query(query_to_execute, config, fresh)
+        else:
+            print(f"Error: Unknown query. Usage: /exec all|[--fresh] <n> with n between 1 and {len(current_queries)}")
     
-    for i, table in enumerate(tables, 1):
-        print(f"{i}. {table}")
+    # Handle the 'optimize [n]' command to rewrite a query of the last answer with a cheaper plan
+    elif nlcommand.lower() == 'optimize' or nlcommand.lower().startswith('optimize '):
+        target = nlcommand[8:].strip()
+        
+        if target and not (target.isdigit() and 1 <= int(target) <= max(len(current_queries), 1)):
+            print(f"Error: Unknown query. Usage: /optimize [n] with n between 1 and {max(len(current_queries), 1)}")
+        else:
+            optimize_current_query(config, int(target) if target else 1)
     
-    print("=" * 40)
-    print(f"Total tables: {len(tables)}\n")
+    # Handle the 'queries' command to list the queries of the last answer
+    elif nlcommand.lower() == 'queries':
+        display_queries()
+    
+    # Handle the 'more' command to display the next page of the open result set
+    elif nlcommand.lower() == 'more':
+        fetch_result_page(config.get('query', {}).get('page_size', 100))
+    
+    # Handle the 'next <n>' command to display the next n rows of the open result set
+    elif nlcommand.lower().startswith('next '):
+        row_count = nlcommand[5:].strip()
+        
+        if not row_count.isdigit() or int(row_count) < 1:
+            print("Error: A positive number of rows is required. Usage: /next <n>")
+        else:
+            fetch_result_page(int(row_count))
+    
+    # Handle the 'export <format> <path> [sql]' command to export a query result to a file
+    elif nlcommand.lower().startswith('export '):
+        parts = nlcommand.split(None, 3)
+        
+        if len(parts) < 3:
+            print("Error: Format and path are required. Usage: /export <csv|parquet|arrow> <path> [custom_sql]")
+        else:
+            query_to_export = parts[3].strip() if len(parts) > 3 else current_query
+            
+            if not query_to_export:
+                print("Error: No SQL query to export. Use '/export <format> <path> <sql_query>' or first generate a query.")
+            else:
+                print(f"Exporting SQL query:\n{query_to_export}\n")
+                export_query(query_to_export, parts[1].lower(), parts[2], config)
+    
+    # Handle the 'execute' command to execute SQL queries
+    elif nlcommand.lower().startswith('execute'):
+        # Check if a custom query is provided after 'execute [--fresh]'
+        fresh, custom_query = split_fresh_flag(nlcommand[7:])
+        
+        # If custom query is provided, use it; otherwise use the last extracted query
+        query_to_execute = custom_query if custom_query else current_query
+        
+        if not query_to_execute:
+            print("Error: No SQL query to execute. Use '/execute <sql_query>' or first generate a query.")
+        else:
+            print(f"Executing SQL query:\n{query_to_execute}\n")
+            # Generated queries are checked before they run, unless their result is cached
+            if (custom_query or (not fresh and is_result_cached(query_to_execute, config))
+                    or preflight_query(query_to_execute, config)):
+                execute_query(query_to_execute, config, fresh)
+    else:
+        print(f"Unknown command: {nlcommand}")
+    
+    return True
 
 
-def display_table_structure(schema_name, table_name, columns):
+def run_repl(config):
     """
-    Format and display the structure of a database table.
+    Run the interactive read-eval-print loop.
+    
+    Ctrl-C interrupts the current command or prompt and returns to the prompt; /exit or
+    Ctrl-D leave the loop.
     
     Args:
-        schema_name: Name of the schema containing the table
-        table_name: Name of the table
-        columns: List of dictionaries containing column information
+        config: Configuration dictionary
     """
-    if not columns:
-        print(f"No column information found for table '{schema_name}.{table_name}'.")
+    nlprompt = ""
+    nlcommand = ""
+    
+    while True:
+        try:
+            # Display the prompt and get user input
+            user_input = input("nlquery> ")
+            
+            # Check if input is a command (starts with '/')
+            if user_input.startswith('/'):
+                nlcommand = user_input[1:]  # Store the command without the '/' prefix
+                nlprompt = ""  # Clear nlprompt as input is a command
+                
+                # Execute the command; stop when it asks to exit
+                if not handle_command(nlcommand, config):
+                    break
+            else:
+                # Input is not a command, store it in nlprompt
+                nlprompt = user_input
+                nlcommand = ""  # Clear nlcommand as input is not a command
+                # Process the natural language prompt using the AI client
+                printer = TokenPrinter() if config.get('ai', {}).get('stream', True) else None
+                response = parse_prompt(get_ai_client(config), nlprompt, printer)
+                if printer is not None and printer.started:
+                    print()  # Terminate the streamed response line
+                elif response:
+                    print(f"AI Response: {response}")
+                else:
+                    print("Error processing the prompt. Please check your input or configuration.")
+                display_extracted_queries()
+                if current_query and config.get('optimize', {}).get('enabled', False):
+                    optimize_current_query(config)
+        
+        # Ctrl-C outside a database call (rendering, paging, confirmation) only stops the
+        # current command
+        except KeyboardInterrupt:
+            print("\n[Interrupted]")
+        except EOFError:
+            break
+
+
+async def run_in_worker(func, *args):
+    """
+    Run a blocking function in a worker thread.
+    
+    Cancelling the awaiting task cancels the database statements the worker is running,
+    so that the thread finishes promptly.
+    
+    Args:
+        func: The blocking function to run
+        *args: Positional arguments passed to func
+        
+    Returns:
+        The return value of func
+    """
+    worker = {}
+    
+    def target():
+        worker['thread'] = threading.get_ident()
+        return func(*args)
+    
+    try:
+        return await asyncio.to_thread(target)
+    except asyncio.CancelledError:
+        if 'thread' in worker:
+            cancel_thread_queries(worker['thread'])
+        raise
+
+
+async def run_prompt_task(nlprompt, config, prompt_lock):
+    """
+    Answer a natural language prompt as an asyncio task.
+    
+    Prompts are answered one at a time, since each answer replaces the current query,
+    its alternatives and their notes.
+    
+    Args:
+        nlprompt: The natural language prompt
+        config: Configuration dictionary
+        prompt_lock: asyncio.Lock held while the prompt is answered
+    """
+    if prompt_lock.locked():
+        print("[Waiting for the previous prompt to be answered]")
+    async with prompt_lock:
+        await answer_prompt_task(nlprompt, config)
+
+
+async def answer_prompt_task(nlprompt, config):
+    """
+    Answer a natural language prompt; the caller holds the prompt lock.
+    
+    Args:
+        nlprompt: The natural language prompt
+        config: Configuration dictionary
+    """
+    # Wait for the schema warm-up without blocking the event loop
+    warmup = schema_warmup
+    if warmup is not None and warmup.schema_name == current_schema and not warmup.future.done():
+        print(f"[Waiting for the schema context of '{warmup.schema_name}': "
+              f"{warmup.STEP_DESCRIPTIONS[warmup.step]}...]")
+        try:
+            await asyncio.shield(asyncio.wrap_future(warmup.future))
+        except Exception as e:
+            logger.error(f"Schema warm-up of '{warmup.schema_name}' failed: {e}")
+    
+    ai_client_config = await asyncio.to_thread(get_ai_client, config, None, True)
+    printer = TokenPrinter() if config.get('ai', {}).get('stream', True) else None
+    
+    try:
+        response = await parse_prompt_async(ai_client_config, nlprompt, printer)
+    except asyncio.CancelledError:
+        print("\n[Generation cancelled]")
+        raise
+    
+    if printer is not None and printer.started:
+        print()  # Terminate the streamed response line
+    elif response:
+        print(f"AI Response: {response}")
+    else:
+        print("Error processing the prompt. Please check your input or configuration.")
+    display_extracted_queries()
+    if current_query and config.get('optimize', {}).get('enabled', False):
+        await run_in_worker(optimize_current_query, config)
+
+
+async def run_exec_task(sql_query, config, fresh, exec_lock):
+    """
+    Execute a query as an asyncio task.
+    
+    Queries run one at a time, since each execution replaces the open result set paged
+    with /more and /next.
+    
+    Args:
+        sql_query: SQL query string
+        config: Configuration dictionary
+        fresh: If True, bypass the result cache
+        exec_lock: asyncio.Lock held while the query runs
+    """
+    if exec_lock.locked():
+        print("[Waiting for the running query to finish]")
+    async with exec_lock:
+        await run_in_worker(execute_query, sql_query, config, fresh)
+
+
+def display_tasks(tasks):
+    """
+    Format and display the running background tasks.
+    
+    Args:
+        tasks: Dictionary mapping task ids to (task, description) tuples
+    """
+    if not tasks:
+        print("No background tasks are running.")
         return
+    
+    print("\nRunning tasks:")
+    print("=" * 60)
+    for task_id, (_, description) in tasks.items():
+        print(f"{task_id}. {description}")
+    print("=" * 60 + "\n")
+
+
+async def run_async_repl(config):
+    """
+    Run the read-eval-print loop on asyncio.
+    
+    Natural language prompts and query executions run as background tasks, so a new
+    prompt can be sent while a query runs or the model generates.
+    Generation uses the asyncio provider clients; database work runs on pooled psycopg2
+    connections in worker threads, which keeps a single PostgreSQL driver for both modes.
+    Prompts are answered one at a time, and so are query executions, since they share the
+    current query and the open result set. Tasks are listed with /tasks and cancelled
+    with /cancel.
+    
+    Args:
+        config: Configuration dictionary
+    """
+    tasks = {}
+    task_ids = iter(range(1, sys.maxsize))
+    prompt_lock = asyncio.Lock()
+    exec_lock = asyncio.Lock()
+    
+    def spawn(coroutine, description):
+        task_id = next(task_ids)
+        task = asyncio.create_task(coroutine)
+        tasks[task_id] = (task, description)
         
-    print(f"\nStructure of table '{schema_name}.{table_name}':")
-    print("=" * 160)
+        def on_done(finished):
+            tasks.pop(task_id, None)
+            if not finished.cancelled() and finished.exception() is not None:
+                logger.error(f"Task {task_id} ({description}) failed: {finished.exception()}")
+        
+        task.add_done_callback(on_done)
+        return task
     
-    # Print header
-    print(f"{'Column Name':<25} {'Data Type':<30} {'Max Length':<10} {'Nullable':<10} {'Default':<30}")
-    print("-" * 160)
+    while True:
+        try:
+            user_input = await asyncio.to_thread(input, "nlquery> ")
+        except EOFError:
+            break
+        
+        if not user_input.startswith('/'):
+            spawn(run_prompt_task(user_input, config, prompt_lock), f"prompt: {user_input[:50]}")
+            continue
+        
+        nlcommand = user_input[1:]
+        command = nlcommand.lower()
+        
+        if command == 'exit':
+            break
+        
+        # Handle the 'tasks' command to list the running background tasks
+        elif command == 'tasks':
+            display_tasks(tasks)
+        
+        # Handle the 'cancel <id>|all' command to cancel background tasks
+        elif command.startswith('cancel'):
+            target = command[6:].strip()
+            if target == 'all':
+                selected = list(tasks)
+            elif target.isdigit() and int(target) in tasks:
+                selected = [int(target)]
+            else:
+                print("Error: Unknown task. Usage: /cancel <task_id>|all (see /tasks)")
+                selected = []
+            for task_id in selected:
+                tasks[task_id][0].cancel()
+                print(f"Task {task_id} cancelled.")
+        
+        # Execute queries in the background once the preflight check has passed
+        elif command in ('exec', 'exec --fresh') or command.startswith('execute'):
+            fresh, custom_query = split_fresh_flag(nlcommand[7:] if command.startswith('execute') else nlcommand[4:])
+            query_to_execute = custom_query or current_query
+            
+            if not query_to_execute:
+                print("Error: No SQL query to execute. Use '/execute <sql_query>' or first generate a query.")
+            else:
+                print(f"Executing SQL query:\n{query_to_execute}\n")
+                if (custom_query or (not fresh and is_result_cached(query_to_execute, config))
+                        or await asyncio.to_thread(preflight_query, query_to_execute, config)):
+                    summary = " ".join(query_to_execute.split())[:50]
+                    spawn(run_exec_task(query_to_execute, config, fresh, exec_lock), f"exec: {summary}")
+        
+        # Exports remove the process-wide wait callback, which the queries of other tasks need
+        # to be cancelled
+        elif command.startswith('export ') and tasks:
+            print("Error: /export cannot run while background tasks are running. Wait for them or cancel them (see /tasks).")
+        
+        # Commands using the current queries or the open result set run in the foreground,
+        # so they are refused while a prompt is answered or a query runs
+        elif command in ('clear', 'more') or command.startswith(('exec ', 'next ', 'optimize', 'export ')):
+            if prompt_lock.locked() or exec_lock.locked():
+                print("Error: A prompt or query task is running. Wait for it to finish or cancel it (see /tasks).")
+            else:
+                async with prompt_lock, exec_lock:
+                    await asyncio.to_thread(handle_command, nlcommand, config)
+        
+        else:
+            await asyncio.to_thread(handle_command, nlcommand, config)
     
-    # Print each column's details
-    for column in columns:
-        name = column['name']
-        data_type = column['data_type']
-        max_length = str(column['max_length']) if column['max_length'] is not None else 'N/A'
-        is_nullable = 'YES' if column['is_nullable'] == 'YES' else 'NO'
-        default_value = str(column['default_value']) if column['default_value'] is not None else 'NULL'
+    # Cancel the remaining background tasks before leaving
+    for task, _ in list(tasks.values()):
+        task.cancel()
+    await asyncio.gather(*(task for task, _ in list(tasks.values())), return_exceptions=True)
+
+
+class RateLimiter:
+    """
+    Space the requests sent to an AI provider to stay under a requests-per-minute limit.
+    """
+    
+    def __init__(self, requests_per_minute: float = 0):
+        """
+        Args:
+            requests_per_minute: Maximum request rate; 0 disables the limit
+        """
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self) -> None:
+        """
+        Wait until the next request may be sent.
+        """
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def load_batch_prompts(path):
+    """
+    Read the prompts of a batch from a JSONL file.
+    
+    Each line holds either a JSON string with the prompt or a JSON object with a 'prompt'
+    key and the optional keys 'id', 'schema' and 'provider'. Blank lines are ignored.
+    
+    Args:
+        path: Path of the JSONL file
         
-        print(f"{name:<25} {data_type:<30} {max_length:<10} {is_nullable:<10} {default_value:<30}")
+    Returns:
+        A list of prompt records, or None if the file cannot be read
+    """
+    records = []
+    try:
+        with open(path, 'r') as prompts_file:
+            for line_number, line in enumerate(prompts_file, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, str):
+                    record = {'prompt': record}
+                if not isinstance(record, dict) or not record.get('prompt'):
+                    print(f"Error: Line {line_number} of {path} has no prompt.")
+                    return None
+                record.setdefault('id', len(records) + 1)
+                records.append(record)
+    except OSError as e:
+        print(f"Error reading batch file {path}: {e}")
+        return None
+    except json.JSONDecodeError as e:
+        print(f"Error: Invalid JSON in batch file {path}: {e}")
+        return None
+    return records
+
+
+def run_batch_statement(sql_query, config, mode, max_rows):
+    """
+    Explain or execute a statement generated for a batch prompt.
     
-    print("=" * 160)
-    print(f"Total columns: {len(columns)}\n")
+    Executed statements run in a transaction that is always rolled back, so that the
+    statements of a regression set cannot modify the database.
+    
+    Args:
+        sql_query: SQL query string
+        config: Configuration dictionary
+        mode: 'explain' or 'execute'
+        max_rows: Maximum number of result rows included in the output record
+        
+    Returns:
+        A dictionary describing the plan or the result of the statement
+    """
+    with borrow_connection(config) as connection:
+        if not connection:
+            return {'error': "Failed to connect to the database"}
+        
+        try:
+            apply_query_timeouts(connection, config)
+            if mode == 'explain':
+                plan = explain_query(connection, sql_query)
+                if plan is None:
+                    return {'error': "The statement could not be explained"}
+                return {'cost': plan.get('Total Cost'), 'rows': plan.get('Plan Rows'),
+                        'node': plan.get('Node Type')}
+            
+            if is_streamable_query(sql_query):
+                # Read through a server-side cursor so that only max_rows rows are transferred
+                cursor = connection.cursor(name="nlquery_batch")
+                cursor.execute(sql_query)
+                result = read_statement_result(cursor, max_rows)
+                result['rows'] = [list(row) for row in result['rows']]
+                cursor.close()
+                return result
+            
+            cursor = connection.cursor()
+            cursor.execute(sql_query)
+            result = {'row_count': cursor.rowcount}
+            if cursor.description:
+                result['columns'] = [column[0] for column in cursor.description]
+                result['rows'] = [list(row) for row in cursor.fetchmany(max_rows)] if max_rows else []
+            cursor.close()
+            return result
+        
+        except psycopg2.Error as e:
+            return {'error': str(e).strip()}
+        finally:
+            if not connection.closed:
+                connection.rollback()
 
 
-def display_help():
+async def answer_batch_prompt(record, contexts, config, mode, rate_limiters):
     """
-    Display a list of all available commands with short descriptions.
+    Generate the SQL query for one batch prompt and optionally explain or execute it.
+    
+    Args:
+        record: The prompt record read from the batch file
+        contexts: Schema contexts built for the batch, keyed by schema name
+        config: Configuration dictionary
+        mode: 'sql', 'explain' or 'execute'
+        rate_limiters: Rate limiters keyed by provider name
+        
+    Returns:
+        The output record of the prompt
     """
-    print("\nAvailable Commands:")
-    print("=" * 80)
-    print("/help                            - Display this help message")
-    print("/exit                            - Exit the program")
-    print("/clear                           - Reset all global variables")
-    print("/schema <schema_name>            - Set the current working schema")
-    print("/schemas                         - List all available database schemas")
-    print("/tables <schema_name>            - List all tables in a specific schema")
-    print("/table <schema_name> <table_name> - Show structure of a specific table")
-    print("/ddl <schema_name>               - Generate DDL statements for all tables in a schema")
-    print("/exec                            - Execute the last extracted SQL query (shorthand)")
-    print("/execute                         - Execute the last extracted SQL query")
-    print("/execute <custom_sql>            - Execute a custom SQL query")
-    print("=" * 80)
-    print("For any other input, the system will process it as a natural language query")
-    print("to the AI assistant about the database.\n")
+    batch_config = config.get('batch', {})
+    prompt = record['prompt']
+    schema_name = record.get('schema')
+    result = {'id': record['id'], 'prompt': prompt, 'schema': schema_name}
+    timings = {}
+    
+    ai_client_config = await asyncio.to_thread(get_ai_client, config, record.get('provider'), True)
+    if ai_client_config is None:
+        result['error'] = "AI client not configured"
+        return result
+    provider = get_provider_name(ai_client_config)
+    result.update(provider=provider, model=ai_client_config.get('model'))
+    
+    start_time = time.perf_counter()
+    system_message = BASE_SYSTEM_MESSAGE
+    if schema_name:
+        context = contexts.get(schema_name)
+        if context is None:
+            result['error'] = f"Schema context of '{schema_name}' is not available"
+            return result
+        system_message, result['context_tables'], result['context_tokens'] = build_system_message(
+            context, schema_name, prompt, config)
+    timings['context_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+    
+    start_time = time.perf_counter()
+    cache_key, cached = lookup_cached_response(ai_client_config, prompt, system_message)
+    if cached is not None:
+        llm_response = cached['response']
+    else:
+        limiter = rate_limiters.get(provider)
+        if limiter is None:
+            limiter = rate_limiters[provider] = RateLimiter(
+                batch_config.get('rate_limits', {}).get(provider, 0))
+        await limiter.acquire()
+        start_time = time.perf_counter()
+        try:
+            llm_response = await generate_response_async(ai_client_config, system_message, prompt)
+        except Exception as e:
+            result['error'] = f"Error processing prompt with AI: {e}"
+            return result
+    timings['generation_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+    
+    queries = extract_sql_queries(llm_response)
+    if schema_name:
+        guard_notes = []
+        for position, query in enumerate(queries):
+            queries[position], notes = guard_large_table_query(query, contexts[schema_name]['catalog'],
+                                                               schema_name, config)
+            guard_notes.extend(notes)
+        if guard_notes:
+            result['guard'] = guard_notes
+    sql_query = queries[0] if queries else ""
+    if cache_key is not None and cached is None and llm_response:
+        response_cache.put(cache_key, llm_response, provider, ai_client_config.get('model'))
+    
+    result.update(cached=cached is not None, sql=sql_query, queries=queries,
+                  response=llm_response)
+    
+    if sql_query and mode in ('explain', 'execute'):
+        start_time = time.perf_counter()
+        result[mode] = await run_in_worker(run_batch_statement, sql_query, config, mode,
+                                           batch_config.get('max_rows', 20))
+        timings[f"{mode}_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+    
+    result['timings'] = timings
+    return result
+
+
+async def run_batch(config, input_path, output_path, mode=None, concurrency=None, schema_name=None):
+    """
+    Answer the prompts of a JSONL file without user interaction.
+    
+    Prompts are sent to the AI providers concurrently, bounded by the 'concurrency' key of
+    the 'batch' configuration block and by the per-provider requests-per-minute limits of
+    its 'rate_limits' key. The context of each schema is built once and shared by all
+    prompts. Output records are written to the JSONL output file in input order.
+    
+    Args:
+        config: Configuration dictionary
+        input_path: Path of the JSONL file with the prompts
+        output_path: Path of the JSONL file the results are written to
+        mode: 'sql' to only generate queries, 'explain' to also explain them, 'execute' to
+              also run them; defaults to the 'mode' key of the 'batch' configuration block
+        concurrency: Maximum number of prompts processed at once; overrides the configuration
+        schema_name: Schema used by prompts that do not name one
+        
+    Returns:
+        True if every prompt was answered without error, False otherwise
+    """
+    records = load_batch_prompts(input_path)
+    if records is None:
+        return False
+    
+    batch_config = config.get('batch', {})
+    mode = mode or batch_config.get('mode', 'sql')
+    concurrency = concurrency or batch_config.get('concurrency', 4)
+    
+    for record in records:
+        record.setdefault('schema', schema_name)
+    
+    # Build the context of every schema used by the batch once, before sending any prompt
+    contexts = {}
+    for name in sorted({record['schema'] for record in records if record['schema']}):
+        def build_context(name=name):
+            with borrow_connection(config) as connection:
+                return get_schema_context(connection, name, config) if connection else None
+        try:
+            context = await asyncio.to_thread(build_context)
+        except psycopg2.Error as e:
+            logger.error(f"Error loading schema context of '{name}': {e}")
+            continue
+        if context is not None and context['tables']:
+            contexts[name] = context
+            print(f"[Schema context: {name}, {len(context['tables'])} tables, ~{context['schema_tokens']} tokens]")
+        else:
+            logger.error(f"Schema '{name}' has no tables or the database is unreachable")
+    
+    # Initialize the provider clients once rather than in every concurrent prompt
+    for provider in {record.get('provider') for record in records}:
+        await asyncio.to_thread(get_ai_client, config, provider, True)
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiters = {}
+    results = [None] * len(records)
+    errors = 0
+    
+    async def process(position, record):
+        async with semaphore:
+            try:
+                results[position] = await answer_batch_prompt(record, contexts, config, mode, rate_limiters)
+            except Exception as e:
+                results[position] = {'id': record['id'], 'prompt': record['prompt'],
+                                     'schema': record['schema'], 'error': str(e)}
+    
+    print(f"Processing {len(records)} prompts (mode: {mode}, concurrency: {concurrency})...")
+    start_time = time.perf_counter()
+    
+    try:
+        output_file = open(output_path, 'w')
+    except OSError as e:
+        print(f"Error opening output file {output_path}: {e}")
+        return False
+    
+    with output_file:
+        pending = [asyncio.create_task(process(position, record)) for position, record in enumerate(records)]
+        written = 0
+        for finished in asyncio.as_completed(pending):
+            await finished
+            # Write the completed prefix of the batch so that the output follows the input order
+            while written < len(results) and results[written] is not None:
+                result = results[written]
+                statement = result.get(mode) if mode in ('explain', 'execute') else None
+                if result.get('error') or (statement or {}).get('error'):
+                    errors += 1
+                output_file.write(json.dumps(result, default=str) + "\n")
+                output_file.flush()
+                written += 1
+    
+    elapsed = time.perf_counter() - start_time
+    extracted = sum(1 for result in results if result.get('sql'))
+    print(f"Processed {len(records)} prompts in {elapsed:.1f}s: {extracted} SQL queries extracted, "
+          f"{errors} errors. Results written to {output_path}")
+    return errors == 0
 
 
 def main():
     # Declare global variables at the beginning of the function
-    global tables_list, current_schema, current_query
+    global current_config, connection_pool, response_cache, result_cache, session_stats
     
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Natural Language Query Tool')
     parser.add_argument('--config', default='config.json',
                         help='Path to the configuration file (default: config.json)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Bypass the AI response cache for this session')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Run prompts, queries and schema loading as concurrent background tasks')
+    parser.add_argument('--batch', metavar='PROMPTS',
+                        help='Answer the prompts of a JSONL file without user interaction')
+    parser.add_argument('--out', default='results.jsonl',
+                        help='Path of the JSONL file batch results are written to (default: results.jsonl)')
+    parser.add_argument('--mode', choices=('sql', 'explain', 'execute'),
+                        help='Batch mode: only generate SQL, also explain it, or also execute it (rolled back)')
+    parser.add_argument('--concurrency', type=int,
+                        help='Maximum number of batch prompts processed at once')
+    parser.add_argument('--schema',
+                        help='Schema used by batch prompts that do not name one')
     args = parser.parse_args()
     
     # Set the configuration path
@@ -655,167 +5277,44 @@ def main():
     
     # Load configuration
     config = load_configuration(config_path)
+    current_config = config
     
-    nlprompt = ""
-    nlcommand = ""
+    # Collect the latency of each processing stage
+    session_stats = create_session_stats(config)
     
-    while True:
-        # Display the prompt and get user input
-        user_input = input("nlquery> ")
-        
-        # Check if input is a command (starts with '/')
-        if user_input.startswith('/'):
-            nlcommand = user_input[1:]  # Store the command without the '/' prefix
-            nlprompt = ""  # Clear nlprompt as input is a command
-            
-            # Check if the command is 'exit' (case-insensitive)
-            if nlcommand.lower() == 'exit':
-                break  # Exit the program
-            
-            # Handle the 'help' command to display available commands
-            elif nlcommand.lower() == 'help':
-                display_help()
-            
-            # Handle the 'clear' command to reset all global variables
-            elif nlcommand.lower() == 'clear':
-                tables_list = ""
-                current_schema = None
-                print("All global variables have been reset.")
-            
-            # Handle the 'schema <schema_name>' command to set the current schema
-            elif nlcommand.lower().startswith('schema '):
-                # Extract schema name from the command
-                current_schema = nlcommand[7:].strip()
-                
-                if not current_schema:
-                    print("Error: Schema name is required. Usage: /schema <schema_name>")
-                else:
-                    print(f"Current schema set to '{current_schema}'")
-                    
-                    # Verify the schema exists
-                    connection = connect_to_database(config)
-                    if connection:
-                        try:
-                            schemas = get_database_schemas(connection)
-                            if current_schema in schemas:
-                                print(f"Schema '{current_schema}' found in the database.")
-                            else:
-                                print(f"Warning: Schema '{current_schema}' not found in the database.")
-                        finally:
-                            connection.close()
-                    else:
-                        print("Failed to connect to the database. Please check your configuration.")
-            
-            # Handle the 'schemas' command to retrieve database schemas
-            elif nlcommand.lower() == 'schemas':
-                print("Retrieving database schemas...")
-                connection = connect_to_database(config)
-                
-                if connection:
-                    try:
-                        schemas = get_database_schemas(connection)
-                        display_schemas(schemas)
-                    finally:
-                        connection.close()
-                else:
-                    print("Failed to connect to the database. Please check your configuration.")
-                    
-            # Handle the 'tables <schema_name>' command to retrieve tables from a specific schema
-            elif nlcommand.lower().startswith('tables '):
-                # Extract schema name from the command
-                schema_name = nlcommand[7:].strip()
-                
-                if not schema_name:
-                    print("Error: Schema name is required. Usage: /tables <schema_name>")
-                else:
-                    print(f"Retrieving tables for schema '{schema_name}'...")
-                    connection = connect_to_database(config)
-                    
-                    if connection:
-                        try:
-                            tables = get_database_tables_by_schema(connection, schema_name)
-                            display_tables(schema_name, tables)
-                        finally:
-                            connection.close()
-                    else:
-                        print("Failed to connect to the database. Please check your configuration.")
-            
-            # Handle the 'table <schema_name> <table_name>' command to retrieve table structure
-            elif nlcommand.lower().startswith('table '):
-                # Split the command into parts to extract schema and table names
-                parts = nlcommand.split()
-                
-                if len(parts) < 3:
-                    print("Error: Schema name and table name are required. Usage: /table <schema_name> <table_name>")
-                else:
-                    schema_name = parts[1]
-                    table_name = parts[2]
-                    
-                    print(f"Retrieving structure for table '{schema_name}.{table_name}'...")
-                    connection = connect_to_database(config)
-                    
-                    if connection:
-                        try:
-                            columns = get_table_structure(connection, schema_name, table_name)
-                            display_table_structure(schema_name, table_name, columns)
-                        finally:
-                            connection.close()
-                    else:
-                        print("Failed to connect to the database. Please check your configuration.")
-            
-            # Handle the 'ddl <schema_name>' command to generate DDL statements for a schema
-            elif nlcommand.lower().startswith('ddl '):
-                # Extract schema name from the command
-                schema_name = nlcommand[4:].strip()
-                
-                if not schema_name:
-                    print("Error: Schema name is required. Usage: /ddl <schema_name>")
-                else:
-                    print(f"Generating DDL for schema '{schema_name}'...")
-                    connection = connect_to_database(config)
-                    
-                    if connection:
-                        try:
-                            ddl_statements = generate_ddl(connection, schema_name)
-                            print(ddl_statements)
-                        finally:
-                            connection.close()
-                    else:
-                        print("Failed to connect to the database. Please check your configuration.")
-                
-            # Handle the 'exec' command to execute the current SQL query
-            elif nlcommand.lower() == 'exec':
-                if not current_query:
-                    print("Error: No SQL query to execute. First generate a query using natural language.")
-                else:
-                    print(f"Executing SQL query:\n{current_query}\n")
-                    execute_query(current_query, config)
-                
-            # Handle the 'execute' command to execute SQL queries
-            elif nlcommand.lower().startswith('execute'):
-                # Check if a custom query is provided after 'execute'
-                custom_query = nlcommand[8:].strip() if len(nlcommand) > 8 else None
-                
-                # If custom query is provided, use it; otherwise use the last extracted query
-                query_to_execute = custom_query if custom_query else current_query
-                
-                if not query_to_execute:
-                    print("Error: No SQL query to execute. Use '/execute <sql_query>' or first generate a query.")
-                else:
-                    print(f"Executing SQL query:\n{query_to_execute}\n")
-                    execute_query(query_to_execute, config)
-            else:
-                print(f"Unknown command: {nlcommand}")
-        else:
-            # Input is not a command, store it in nlprompt
-            nlprompt = user_input
-            nlcommand = ""  # Clear nlcommand as input is not a command
-            # Process the natural language prompt using the AI client
-            response = parse_prompt(setup_ai_client(config), nlprompt)
-            if response:
-                print(f"AI Response: {response}")
-            else:
-                print("Error processing the prompt. Please check your input or configuration.")
+    # Make running queries interruptible: Ctrl-C cancels the statement on the server
+    psycopg2.extensions.set_wait_callback(psycopg2.extras.wait_select)
+    
+    # Create the shared database connection pool once for the whole session
+    connection_pool = create_connection_pool(config)
+    
+    # Open the persistent AI response cache
+    response_cache = create_response_cache(config)
+    if response_cache is not None and args.no_cache:
+        response_cache.enabled = False
+    
+    # Keep the results of repeated queries in memory
+    result_cache = create_result_cache(config)
+    
+    exit_code = 0
+    if args.batch:
+        if not asyncio.run(run_batch(config, args.batch, args.out, args.mode, args.concurrency, args.schema)):
+            exit_code = 1
+    elif args.use_async:
+        asyncio.run(run_async_repl(config))
+    else:
+        run_repl(config)
+    
+    # Close the open result set and all pooled database connections
+    stop_schema_warmup()
+    close_active_result()
+    if connection_pool is not None:
+        connection_pool.closeall()
+    if response_cache is not None:
+        response_cache.close()
+    session_stats.close()
+    
+    return exit_code
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
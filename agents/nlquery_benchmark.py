@@ -0,0 +1,421 @@
+import argparse
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import nlquery
+
+logger = logging.getLogger(__name__)
+
+# Words used to build table and column names, so that prompts can be ranked against them
+VOCABULARY = [
+    'account', 'address', 'audit', 'balance', 'batch', 'billing', 'branch', 'campaign', 'category',
+    'contract', 'customer', 'delivery', 'device', 'discount', 'employee', 'event', 'invoice', 'item',
+    'ledger', 'license', 'location', 'message', 'order', 'partner', 'payment', 'price', 'product',
+    'project', 'receipt', 'refund', 'region', 'report', 'schedule', 'session', 'shipment', 'stock',
+    'subscription', 'supplier', 'task', 'ticket', 'transaction', 'user', 'vendor', 'warehouse'
+]
+
+COLUMN_TYPES = [
+    'integer', 'bigint', 'text', 'varchar(64)', 'numeric(12,2)', 'boolean', 'date', 'timestamptz', 'jsonb'
+]
+
+BENCHMARK_SCHEMA_PREFIX = 'nlq_bench_'
+
+
+class StubLLMClient:
+    """
+    Deterministic stand-in for an Ollama client.
+
+    The answer selects the first table described in the system message and its latency
+    grows with the size of the prompt, like the prompt evaluation of a local model.
+    """
+
+    def __init__(self, base_ms=50.0, ms_per_1k_tokens=20.0):
+        """
+        Args:
+            base_ms: Fixed latency of every answer in milliseconds
+            ms_per_1k_tokens: Additional latency per 1,000 estimated prompt tokens
+        """
+        self.base_ms = base_ms
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+
+    def generate(self, model=None, prompt=None, stream=False, **kwargs):
+        prompt_tokens = nlquery.estimate_tokens(prompt)
+        time.sleep((self.base_ms + prompt_tokens / 1000 * self.ms_per_1k_tokens) / 1000)
+
+        match = re.search(r'\b(' + re.escape(BENCHMARK_SCHEMA_PREFIX) + r'\d+)\.(\w+)', prompt)
+        table = f"{match.group(1)}.{match.group(2)}" if match else "pg_catalog.pg_class"
+        text = f"Here is the query:\n```sql\nSELECT * FROM {table} LIMIT 10\n```\nIt lists ten rows."
+        usage = {"prompt_eval_count": prompt_tokens, "eval_count": nlquery.estimate_tokens(text)}
+
+        if not stream:
+            return dict(usage, response=text)
+
+        def chunks():
+            for start in range(0, len(text), 8):
+                yield {"response": text[start:start + 8], "done": False}
+            yield dict(usage, response="", done=True)
+        return chunks()
+
+
+def summarize(samples):
+    """
+    Summarize timing samples.
+
+    Args:
+        samples: Durations in seconds
+
+    Returns:
+        A dictionary with the count and the min, median, p95, max and mean in milliseconds
+    """
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'median_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(nlquery.SessionStats.percentile(ordered, 95) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3)
+    }
+
+
+def timed(func, *args):
+    """
+    Run a function and measure its duration.
+
+    Returns:
+        A tuple (result, seconds)
+    """
+    start_time = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start_time
+
+
+def drop_benchmark_schema(connection, schema_name, batch_size=200):
+    """
+    Drop a synthetic schema, its tables in batches to stay within the lock table.
+
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to drop
+        batch_size: Number of tables dropped per transaction
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s ORDER BY tablename DESC", (schema_name,))
+    tables = [row[0] for row in cursor.fetchall()]
+    for start in range(0, len(tables), batch_size):
+        names = ", ".join(f'{schema_name}."{table}"' for table in tables[start:start + batch_size])
+        cursor.execute(f"DROP TABLE IF EXISTS {names} CASCADE")
+        connection.commit()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema_name} CASCADE")
+    connection.commit()
+    cursor.close()
+
+
+def create_benchmark_schema(connection, schema_name, table_count, min_columns, max_columns, rng, batch_size=200):
+    """
+    Create a synthetic schema with tables of varied width and foreign keys between them.
+
+    Tables are created and analyzed in batches, one transaction per batch, so that large
+    schemas do not exhaust the lock table.
+
+    Args:
+        connection: A PostgreSQL database connection object
+        schema_name: Name of the schema to create; an existing schema is dropped first
+        table_count: Number of tables
+        min_columns: Minimum number of columns per table, besides the primary key
+        max_columns: Maximum number of columns per table, besides the primary key
+        rng: random.Random instance making the schema reproducible
+        batch_size: Number of tables created per transaction
+
+    Returns:
+        The list of created table names
+    """
+    drop_benchmark_schema(connection, schema_name)
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE SCHEMA {schema_name}")
+
+    tables = []
+    statements = []
+    for index in range(table_count):
+        table_name = f"{rng.choice(VOCABULARY)}_{rng.choice(VOCABULARY)}_{index}"
+        columns = ["id serial PRIMARY KEY"]
+        for column_index in range(rng.randint(min_columns, max_columns)):
+            columns.append(f"{rng.choice(VOCABULARY)}_{column_index} {rng.choice(COLUMN_TYPES)}"
+                           f"{' NOT NULL' if rng.random() < 0.3 else ''}")
+        # Link about a third of the tables to an earlier table
+        if tables and rng.random() < 0.3:
+            columns.append(f"{rng.choice(VOCABULARY)}_ref integer REFERENCES {schema_name}.{rng.choice(tables)}(id)")
+        statements.append(f"CREATE TABLE {schema_name}.{table_name} ({', '.join(columns)})")
+        tables.append(table_name)
+
+        if len(statements) == batch_size or index == table_count - 1:
+            cursor.execute(";\n".join(statements))
+            connection.commit()
+            # Analyze only the tables just created, not the whole database
+            batch = tables[-len(statements):]
+            cursor.execute(f"ANALYZE {', '.join(f'{schema_name}.{name}' for name in batch)}")
+            connection.commit()
+            statements = []
+
+    cursor.close()
+    return tables
+
+
+def build_prompts(tables, count, rng):
+    """
+    Build reproducible natural language prompts naming tables of a schema.
+
+    Args:
+        tables: Table names of the schema
+        count: Number of prompts
+        rng: random.Random instance
+
+    Returns:
+        A list of prompts
+    """
+    prompts = []
+    for table_name in rng.sample(tables, min(count, len(tables))):
+        words = " ".join(table_name.split('_')[:2])
+        prompts.append(f"Show the ten most recent {words} records")
+    return prompts
+
+
+def benchmark_schema(config, schema_name, tables, args, rng):
+    """
+    Measure DDL generation, system message size and prompt latency for one schema.
+
+    Args:
+        config: Configuration dictionary
+        schema_name: Name of the synthetic schema
+        tables: Table names of the schema
+        args: Parsed command line arguments
+        rng: random.Random instance
+
+    Returns:
+        A dictionary of measurements, or None if no database connection could be obtained
+    """
+    results = {'tables': len(tables)}
+
+    with nlquery.borrow_connection(config) as connection:
+        if not connection:
+            print("Failed to connect to the database. Please check your configuration.")
+            return None
+
+        # DDL generation from the catalog, without the schema context cache
+        catalog_samples, ddl_samples = [], []
+        for _ in range(args.repeat):
+            catalog, seconds = timed(nlquery.load_schema_catalog, connection, schema_name)
+            catalog_samples.append(seconds)
+            _, seconds = timed(nlquery.generate_ddl, connection, schema_name)
+            ddl_samples.append(seconds)
+        results['load_schema_catalog'] = summarize(catalog_samples)
+        results['generate_ddl'] = summarize(ddl_samples)
+        results['columns'] = sum(len(table['columns']) for table in catalog.values())
+
+        # Size of the schema description in each format
+        nlquery.invalidate_schema_context()
+        context, seconds = timed(nlquery.get_schema_context, connection, schema_name, config)
+        results['schema_context_build_ms'] = round(seconds * 1000, 3)
+        prompts = build_prompts(tables, args.prompts, rng)
+        results['system_message'] = {}
+        for schema_format in nlquery.SCHEMA_FORMATS:
+            formatted = nlquery.format_schema_context(context, schema_name, schema_format)
+            messages = [nlquery.build_system_message(formatted, schema_name, prompt, config) for prompt in prompts]
+            results['system_message'][schema_format] = {
+                'full_characters': len(formatted['system_message']),
+                'full_tokens': nlquery.estimate_tokens(formatted['system_message']),
+                'budgeted_characters': round(statistics.fmean(len(message) for message, _, _ in messages)),
+                'budgeted_tokens': round(statistics.fmean(nlquery.estimate_tokens(message)
+                                                          for message, _, _ in messages)),
+                'budgeted_tables': round(statistics.fmean(table_count for _, table_count, _ in messages), 1)
+            }
+
+    # End-to-end prompt latency with the stub model: cold, then with a cached schema context
+    ai_client_config = {
+        'provider': 'ollama',
+        'client': StubLLMClient(args.llm_base_ms, args.llm_ms_per_1k_tokens),
+        'model': 'stub'
+    }
+    nlquery.current_schema = schema_name
+    cold_samples, warm_samples = [], []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for prompt in prompts:
+            nlquery.invalidate_schema_context()
+            _, seconds = timed(nlquery.parse_prompt, ai_client_config, prompt)
+            cold_samples.append(seconds)
+        nlquery.session_stats.reset()
+        for prompt in prompts:
+            _, seconds = timed(nlquery.parse_prompt, ai_client_config, prompt)
+            warm_samples.append(seconds)
+    results['prompt_latency_cold'] = summarize(cold_samples)
+    results['prompt_latency_warm'] = summarize(warm_samples)
+    results['warm_stages'] = {stage: {'count': count, 'p50_ms': round(p50 * 1000, 3), 'p95_ms': round(p95 * 1000, 3)}
+                              for stage, count, _, p50, p95, _ in nlquery.session_stats.summary()}
+    results['extracted_query'] = nlquery.current_query
+    return results
+
+
+def benchmark_execute_query(config, row_count, page_size, repeat):
+    """
+    Measure the throughput of execute_query and the paging of a large result.
+
+    Args:
+        config: Configuration dictionary
+        row_count: Number of rows of the result
+        page_size: Number of rows per page
+        repeat: Number of runs
+
+    Returns:
+        A dictionary of measurements
+    """
+    sql_query = (f"SELECT g AS id, md5(g::text) AS digest, g * 1.5 AS amount, now() AS created_at "
+                 f"FROM generate_series(1, {row_count}) g")
+    query_config = dict(config, query=dict(config.get('query', {}), page_size=page_size, max_rows=0,
+                                           statement_timeout=0))
+    first_page_samples, total_samples = [], []
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            nlquery.execute_query(sql_query, query_config, fresh=True)
+            first_page_samples.append(time.perf_counter() - start_time)
+            while nlquery.active_result is not None:
+                nlquery.fetch_result_page(page_size)
+            total_samples.append(time.perf_counter() - start_time)
+
+    median_total = statistics.median(total_samples)
+    return {
+        'rows': row_count,
+        'page_size': page_size,
+        'first_page': summarize(first_page_samples),
+        'all_pages': summarize(total_samples),
+        'rows_per_second': round(row_count / median_total)
+    }
+
+
+def get_environment(connection):
+    """
+    Describe the environment of a benchmark run.
+
+    Args:
+        connection: A PostgreSQL database connection object
+
+    Returns:
+        A dictionary with the commit, Python and PostgreSQL versions and the time of the run
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    cursor = connection.cursor()
+    cursor.execute("SHOW server_version")
+    server_version = cursor.fetchone()[0]
+    cursor.close()
+
+    return {
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'postgresql': server_version,
+        'platform': platform.platform()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nlquery against synthetic schemas with a stub LLM')
+    parser.add_argument('--config', default='config.json',
+                        help='Path to the nlquery configuration file with the database settings (default: config.json)')
+    parser.add_argument('--sizes', default='10,1000,10000',
+                        help='Comma-separated numbers of tables of the synthetic schemas (default: 10,1000,10000)')
+    parser.add_argument('--min-columns', type=int, default=3, help='Minimum number of columns per table (default: 3)')
+    parser.add_argument('--max-columns', type=int, default=30, help='Maximum number of columns per table (default: 30)')
+    parser.add_argument('--prompts', type=int, default=5, help='Number of prompts per schema (default: 5)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each timing (default: 3)')
+    parser.add_argument('--rows', type=int, default=200000,
+                        help='Number of rows of the large result read with execute_query (default: 200000)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Page size used to read the large result (default: 1000)')
+    parser.add_argument('--llm-base-ms', type=float, default=50.0, help='Fixed latency of the stub model (default: 50)')
+    parser.add_argument('--llm-ms-per-1k-tokens', type=float, default=20.0,
+                        help='Latency of the stub model per 1,000 prompt tokens (default: 20)')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the synthetic schemas and prompts (default: 42)')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic schemas after the run')
+    parser.add_argument('--output', default='nlquery_benchmark.json',
+                        help='Path of the JSON results file (default: nlquery_benchmark.json)')
+    args = parser.parse_args()
+
+    config = nlquery.load_configuration(args.config)
+    if not config:
+        return 1
+
+    # Run against the nlquery module state exactly as the REPL does, without the AI response cache
+    nlquery.current_config = config
+    nlquery.connection_pool = nlquery.create_connection_pool(config)
+    nlquery.response_cache = None
+    nlquery.result_cache = None
+    nlquery.session_stats = nlquery.SessionStats()
+    logging.getLogger(nlquery.__name__).setLevel(logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    results = {'parameters': vars(args), 'schemas': {}}
+
+    with nlquery.borrow_connection(config) as connection:
+        if not connection:
+            print("Failed to connect to the database. Please check your configuration.")
+            return 1
+        results['environment'] = get_environment(connection)
+
+    try:
+        for size in sizes:
+            rng = random.Random(f"{args.seed}:{size}")
+            schema_name = f"{BENCHMARK_SCHEMA_PREFIX}{size}"
+
+            print(f"Creating schema {schema_name} with {size:,} tables...")
+            with nlquery.borrow_connection(config) as connection:
+                if not connection:
+                    print("Failed to connect to the database. Please check your configuration.")
+                    return 1
+                tables, seconds = timed(create_benchmark_schema, connection, schema_name, size,
+                                        args.min_columns, args.max_columns, rng)
+            print(f"Created in {seconds:.1f}s. Measuring...")
+
+            schema_results = benchmark_schema(config, schema_name, tables, args, rng)
+            if schema_results is None:
+                return 1
+            results['schemas'][str(size)] = schema_results
+            print(f"  generate_ddl median {schema_results['generate_ddl']['median_ms']:.1f} ms, "
+                  f"system message {schema_results['system_message']['ddl']['budgeted_tokens']:,} tokens, "
+                  f"prompt latency median {schema_results['prompt_latency_warm']['median_ms']:.1f} ms")
+
+            if not args.keep:
+                with nlquery.borrow_connection(config) as connection:
+                    if connection:
+                        drop_benchmark_schema(connection, schema_name)
+
+        print(f"Reading a result of {args.rows:,} rows with execute_query...")
+        results['execute_query'] = benchmark_execute_query(config, args.rows, args.page_size, args.repeat)
+        print(f"  {results['execute_query']['rows_per_second']:,} rows/s")
+    finally:
+        nlquery.close_active_result()
+        nlquery.connection_pool.closeall()
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
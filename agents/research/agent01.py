@@ -2,11 +2,66 @@ import json
 import requests
 import os
 import argparse
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from azure.ai.inference import ChatCompletionsClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+from azure.core.pipeline.transport import RequestsTransport
+
+PROVIDERS = ("ollama", "azure")
+
+# HTTP status codes worth retrying: rate limiting and server errors
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+class RetryableError(Exception):
+    """
+    A failed request that may succeed when sent again
+    """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def parse_retry_after(value):
+    """
+    Return the delay in seconds of a Retry-After header, or None if it is missing or not a number
+    """
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """
+    Space the requests sent to a provider to stay under a requests-per-minute limit.
+    Safe to share between worker threads.
+    """
+    def __init__(self, requests_per_minute=0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until the next request may be sent
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 class Agent:
-    def __init__(self, config_path):
+    def __init__(self, config_path, pool_size=10):
         with open(config_path, 'r') as f:
             self.config = json.load(f)
         
@@ -14,6 +69,136 @@ class Agent:
         self.options = self.config.get("modelOptions", {})
         
         self.model = self.config.get("model", "")
+        
+        # Requests per minute allowed for each provider, 0 or missing means unlimited
+        rate_limits = self.config.get("rate_limits", {})
+        self.rate_limiters = {provider: RateLimiter(rate_limits.get(provider, 0)) for provider in PROVIDERS}
+        
+        # Timeouts and retries of the HTTP requests
+        http_config = self.config.get("http", {})
+        self.timeout = (http_config.get("connect_timeout", 10), http_config.get("read_timeout", 900))
+        self.max_retries = http_config.get("max_retries", 4)
+        self.backoff_base = http_config.get("backoff_base", 1.0)
+        self.backoff_max = http_config.get("backoff_max", 60.0)
+        
+        # One pooled session for every request of the run, keeping a connection per worker alive
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        
+        self.azure_client = None
+        self.lock = threading.Lock()
+        self.retries = 0
+        # Set when the run is interrupted, so that requests in flight are not retried
+        self.stopping = threading.Event()
+
+    def send_with_retries(self, description, send):
+        """
+        Call send until it succeeds or the retries are exhausted. Retries wait with an
+        exponential backoff and full jitter, or as long as the server's Retry-After asks.
+        RetryableError is raised when the last attempt fails, or as soon as the run is
+        interrupted.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.stopping.is_set():
+                raise RetryableError("run interrupted")
+            try:
+                return self.send_until_stopped(send)
+            except RetryableError as e:
+                if attempt == self.max_retries or self.stopping.is_set():
+                    raise
+                delay = e.retry_after
+                if delay is None:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                with self.lock:
+                    self.retries += 1
+                print(f"Retrying {description} in {delay:.1f}s ({attempt + 1}/{self.max_retries}): {e}")
+                if self.stopping.wait(delay):
+                    raise
+
+    def send_until_stopped(self, send):
+        """
+        Call send in a daemon thread and wait for it until the run is interrupted.
+        
+        A request in flight can take up to the read timeout to return. When the run is
+        interrupted, it is abandoned instead: RetryableError is raised at once, and the
+        daemon thread does not keep the process alive.
+        """
+        outcome = {}
+        finished = threading.Event()
+        
+        def target():
+            try:
+                outcome["result"] = send()
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                finished.set()
+        
+        threading.Thread(target=target, name="agent01-request", daemon=True).start()
+        while not finished.wait(0.1):
+            if self.stopping.is_set():
+                raise RetryableError("run interrupted")
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    def get_azure_client(self, endpoint, api_key):
+        """
+        Return the Azure client of the run, creating it on first use. It sends its requests
+        through the pooled session; retries are left to send_with_retries.
+        """
+        with self.lock:
+            if self.azure_client is None:
+                self.azure_client = ChatCompletionsClient(
+                    endpoint=endpoint,
+                    credential=AzureKeyCredential(api_key),
+                    transport=RequestsTransport(session=self.session, session_owner=False,
+                                                connection_timeout=self.timeout[0],
+                                                read_timeout=self.timeout[1]),
+                    retry_total=0
+                )
+            return self.azure_client
+
+    def connection_stats(self):
+        """
+        Return the number of HTTP requests sent, connections opened and retries of the run
+        """
+        pools = self.adapter.poolmanager.pools
+        requests_sent = connections = 0
+        for key in pools.keys():
+            pool = pools[key]
+            requests_sent += pool.num_requests
+            connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections,
+                "reused": max(requests_sent - connections, 0), "retries": self.retries}
+
+    def close(self):
+        """
+        Close the Azure client and the HTTP session
+        """
+        if self.azure_client is not None:
+            self.azure_client.close()
+        self.session.close()
+
+    def model_name(self, provider):
+        """
+        Return the model queried on a provider
+        """
+        if provider == "azure":
+            # Extract deployment name from azure_model or fallback to model or default
+            return self.config.get("azure_model") or self.model or "gpt-4"
+        return self.model
+
+    def query(self, prompt, provider="ollama", options=None):
+        """
+        Query the given provider once its rate limit allows it
+        """
+        self.rate_limiters[provider].acquire()
+        if provider == "azure":
+            return self.query_azure(prompt, options)
+        return self.query_ollama(prompt, options)
 
     def query_ollama(self, prompt, options=None):
         """
@@ -34,7 +219,21 @@ class Agent:
         base_url = os.environ.get("OLLAMA_API_BASE", "http://127.0.0.1:11434")
         api_endpoint = f"{base_url}/api/generate"
         
-        response = requests.post(api_endpoint, json=payload)
+        def send():
+            try:
+                response = self.session.post(api_endpoint, json=payload, timeout=self.timeout)
+            except requests.ConnectionError as e:
+                raise RetryableError(f"connection error: {e}")
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                raise RetryableError(f"HTTP {response.status_code}",
+                                     parse_retry_after(response.headers.get("Retry-After")))
+            return response
+        
+        try:
+            response = self.send_with_retries("Ollama request", send)
+        except RetryableError as e:
+            print(f"Error: {e}")
+            return None
         
         if response.status_code == 200:
             return response.json()
@@ -58,17 +257,13 @@ class Agent:
             return None
         
         try:
-            # Create a client for the Azure OpenAI service
-            client = ChatCompletionsClient(
-                endpoint=azure_endpoint, 
-                credential=AzureKeyCredential(azure_api_key)
-            )
+            # Reuse the client of the run for the Azure OpenAI service
+            client = self.get_azure_client(azure_endpoint, azure_api_key)
             
             # Create the messages for the chat completion
             messages = [{"role": "user", "content": prompt}]
             
-            # Extract deployment name from azure_model or fallback to model or default
-            deployment_name = self.config.get("azure_model") or self.model or "gpt-4"
+            deployment_name = self.model_name("azure")
             
             # Extract parameters from options if they exist
             temperature = options.get("temperature")
@@ -76,21 +271,37 @@ class Agent:
             max_tokens = options.get("max_tokens")
             
             # Call the Azure OpenAI service with parameters directly
-            response = client.complete(
-                deployment_name=deployment_name,
-                messages=messages,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens
-            )
+            def send():
+                try:
+                    return client.complete(
+                        deployment_name=deployment_name,
+                        messages=messages,
+                        temperature=temperature,
+                        top_p=top_p,
+                        max_tokens=max_tokens
+                    )
+                except (ServiceRequestError, ServiceResponseError) as e:
+                    raise RetryableError(f"connection error: {e}")
+                except HttpResponseError as e:
+                    if e.status_code not in RETRYABLE_STATUS_CODES:
+                        raise
+                    headers = e.response.headers if e.response is not None else {}
+                    raise RetryableError(f"HTTP {e.status_code}", parse_retry_after(headers.get("Retry-After")))
+            
+            start_time = time.perf_counter()
+            response = self.send_with_retries("Azure OpenAI request", send)
             
             # Format the response similar to the Ollama response
             formatted_response = {
                 "model": self.model,
                 "created_at": str(response.created_at),
                 "response": response.choices[0].message.content,
-                "done": True
+                "done": True,
+                "total_duration": int((time.perf_counter() - start_time) * 1e9)
             }
+            if response.usage:
+                formatted_response["prompt_eval_count"] = response.usage.prompt_tokens
+                formatted_response["eval_count"] = response.usage.completion_tokens
             
             return formatted_response
         
@@ -98,6 +309,415 @@ class Agent:
             print(f"Error querying Azure OpenAI: {str(e)}")
             return None
 
+def repair_jsonl_tail(path):
+    """
+    Create a JSONL file and its directory if needed, and cut off a torn last line left by a
+    killed process, so that records can be appended to it.
+    
+    Args:
+        path (str): Path of the JSONL file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'ab+') as file:
+        end = file.seek(0, os.SEEK_END)
+        if not end:
+            return
+        file.seek(end - 1)
+        if file.read(1) == b"\n":
+            return
+        # Read backwards in chunks until the end of the last complete line, however long the torn one is
+        while end > 0:
+            start = max(end - 65536, 0)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            end = start
+        file.truncate(0)
+
+class ProgressJournal:
+    """
+    Append-only JSONL journal of the files completed by a run, used to resume it.
+    
+    The first line describes the run (prompt hash, provider, model and options); a journal
+    written by a run with a different description is not resumed. Every record is written
+    with a single write and flushed, so a killed process leaves at most one torn line at
+    the end, which is ignored when the journal is read and cut off before it is appended
+    to. The journal is fsynced every fsync_every records or fsync_interval seconds rather
+    than after each record.
+    """
+    def __init__(self, path, run, fsync_every=50, fsync_interval=5.0):
+        self.path = path
+        self.run = run
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Read the journal.
+        
+        Returns:
+            dict: The last record of each file, keyed by path; None if there is no journal or
+            it was written by a different run
+        """
+        if not os.path.exists(self.path):
+            return None
+        records = {}
+        with open(self.path, 'r') as file:
+            header = file.readline()
+            try:
+                header = json.loads(header) if header.endswith("\n") else None
+            except ValueError:
+                return None
+            if not isinstance(header, dict) or header.get("run") != self.run:
+                return None
+            for line_number, line in enumerate(file, 2):
+                if not line.endswith("\n"):
+                    break  # Torn record of a killed run
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(record, dict) or "path" not in record:
+                    print(f"Warning: Ignoring record without a path on line {line_number} of {self.path}")
+                    continue
+                records[record["path"]] = record
+        return records
+
+    def open(self, append=False):
+        """
+        Open the journal. A resumed run appends to it, cutting off a torn last record;
+        any other run starts a new journal with the description of the run.
+        """
+        if append:
+            repair_jsonl_tail(self.path)
+            self.file = open(self.path, 'a')
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'w')
+        self.file.write(json.dumps({"run": self.run}) + "\n")
+        self.file.flush()
+
+    def record(self, result):
+        """
+        Append the outcome of a file. Safe to call from worker threads.
+        """
+        line = json.dumps({"path": result["path"], "sha256": result["sha256"], "status": result["status"],
+                           "error": result["error"], "time": round(time.time(), 3)}) + "\n"
+        with self.lock:
+            if self.file is None:
+                return  # Closed after an interruption
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self.sync()
+
+    def sync(self):
+        """
+        Force the records written so far to disk; the caller holds the lock
+        """
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """
+        Sync and close the journal
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                self.sync()
+                self.file.close()
+                self.file = None
+
+class ReportWriter:
+    """
+    Streaming JSONL report with one record per file, followed by a summary file.
+    
+    Each record is written and flushed as soon as its file is reported, so an interrupted
+    run leaves a usable report. Only running totals are kept in memory, whatever the number
+    of files. The summary is written next to the report at the end of the run.
+    """
+    # Token counts and durations (in nanoseconds) copied from the model response
+    USAGE_FIELDS = ("prompt_eval_count", "eval_count", "total_duration", "load_duration",
+                    "prompt_eval_duration", "eval_duration")
+
+    def __init__(self, path, model, provider, append=False):
+        self.path = path
+        self.summary_path = f"{os.path.splitext(path)[0]}.summary.json"
+        self.model = model
+        self.provider = provider
+        self.started_at = time.time()
+        self.counts = {"ok": 0, "incomplete": 0, "error": 0}
+        self.cached = 0
+        self.totals = dict.fromkeys(self.USAGE_FIELDS, 0)
+        self.elapsed_ms = 0.0
+        
+        if append:
+            repair_jsonl_tail(path)
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self.append = append
+        self.file = open(path, 'a' if append else 'w')
+
+    def remove_duplicates(self):
+        """
+        Keep only the last record of each file in a resumed report, since files that failed
+        in the interrupted run are reported again. The report is read twice rather than
+        loaded, and replaced atomically.
+        """
+        last_lines = {}
+        with open(self.path, 'r') as file:
+            for line_number, line in enumerate(file):
+                try:
+                    last_lines[json.loads(line)["path"]] = line_number
+                except (ValueError, KeyError, TypeError):
+                    continue
+        
+        kept_lines = set(last_lines.values())
+        temporary_path = f"{self.path}.tmp"
+        with open(self.path, 'r') as file, open(temporary_path, 'w') as output:
+            for line_number, line in enumerate(file):
+                if line_number in kept_lines:
+                    output.write(line)
+        os.replace(temporary_path, self.path)
+
+    def write(self, result):
+        """
+        Append the record of a processed file and add it to the totals
+        """
+        response = result["response"] or {}
+        record = {
+            "path": result["path"],
+            "model": self.model,
+            "provider": self.provider,
+            "status": result["status"],
+            "cached": result["cached"],
+            "response": response.get("response"),
+            "error": result["error"],
+            "elapsed_ms": result["elapsed_ms"]
+        }
+        for field in self.USAGE_FIELDS:
+            record[field] = response.get(field)
+            # Cached responses did not cost tokens or model time in this run
+            if response.get(field) and not result["cached"]:
+                self.totals[field] += response[field]
+        
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        
+        self.counts[result["status"]] += 1
+        self.cached += result["cached"]
+        self.elapsed_ms += result["elapsed_ms"]
+
+    def close(self, skipped=0, interrupted=False):
+        """
+        Close the report and write the summary of the run
+        
+        Args:
+            skipped (int): Number of files skipped as completed by a previous run
+            interrupted (bool): Whether the run was interrupted
+        """
+        self.file.close()
+        if self.append:
+            self.remove_duplicates()
+        
+        wall_seconds = time.time() - self.started_at
+        files = sum(self.counts.values())
+        summary = {
+            "report": self.path,
+            "model": self.model,
+            "provider": self.provider,
+            "started_at": self.started_at,
+            "finished_at": time.time(),
+            "interrupted": interrupted,
+            "files": files,
+            "statuses": self.counts,
+            "cached": self.cached,
+            "skipped": skipped,
+            "wall_seconds": round(wall_seconds, 3),
+            "files_per_minute": round(files / wall_seconds * 60, 2) if wall_seconds else None,
+            "mean_file_ms": round(self.elapsed_ms / files, 1) if files else None,
+            "tokens": {"prompt": self.totals["prompt_eval_count"], "eval": self.totals["eval_count"]},
+            "durations_ms": {field: round(self.totals[field] / 1e6, 1) for field in self.USAGE_FIELDS
+                             if field.endswith("duration")},
+            "eval_tokens_per_second": (round(self.totals["eval_count"] / (self.totals["eval_duration"] / 1e9), 2)
+                                       if self.totals["eval_duration"] else None)
+        }
+        
+        # Replace the summary atomically so that it is never half written
+        temporary_path = f"{self.summary_path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(summary, file, indent=2)
+        os.replace(temporary_path, self.summary_path)
+        return summary
+
+class ResultCache:
+    """
+    Content-addressed SQLite cache of model responses, shared across runs, branches and copies.
+    
+    A response is keyed by the provider, the model, the model options, the prompt and the
+    Java file content, so identical files are only sent to the model once. The least
+    recently used responses are evicted above max_mb; the size is checked every
+    EVICTION_INTERVAL writes and when the cache is closed, so the cache may briefly exceed
+    the limit by a few responses. A read-only cache is never written, so CI machines can
+    share a cache filled by a nightly job.
+    """
+    EVICTION_INTERVAL = 64
+    
+    def __init__(self, path, max_mb=512, read_only=False):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        
+        if read_only:
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The default rollback journal keeps the cache a single file that read-only copies can open;
+        # concurrent runs wait up to the timeout for each other's writes
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                model TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+        self.db.commit()
+
+    @staticmethod
+    def make_key(provider, model, options, prompt_content, content_hash):
+        """
+        Build the cache key of a Java file.
+        
+        Args:
+            provider (str): Provider queried
+            model (str): Model or deployment name
+            options (dict): Model options
+            prompt_content (str): Content of the prompt file
+            content_hash (str): SHA-256 of the Java file content
+        
+        Returns:
+            str: A hexadecimal SHA-256 digest
+        """
+        prompt_hash = hashlib.sha256(prompt_content.encode("utf-8")).hexdigest()
+        key_material = json.dumps([provider, model, options, prompt_hash, content_hash], sort_keys=True)
+        return hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached response of a key, or None on a miss
+        """
+        with self.lock:
+            row = self.db.execute("SELECT response FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self.db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+        return json.loads(row[0])
+
+    def put(self, key, response, model):
+        """
+        Store a response and evict the least recently used responses above the size limit
+        """
+        if self.read_only:
+            return
+        payload = json.dumps(response)
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, payload, model, len(payload), now, now))
+            self.writes += 1
+            if self.writes % self.EVICTION_INTERVAL == 0:
+                self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """
+        Evict the least recently used responses above the size limit; the caller holds the lock
+        """
+        size = self.db.execute("SELECT coalesce(sum(size), 0) FROM results").fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        # Walk the last_access index from the most recent response and cut at the limit
+        self.evictions += self.db.execute("""
+            DELETE FROM results WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, sum(size) OVER (ORDER BY last_access DESC, key) AS total FROM results
+                ) WHERE total > ?
+            )
+        """, (self.max_bytes,)).rowcount
+
+    def stats(self):
+        """
+        Return the hits, misses, writes and evictions of the run and the size of the cache
+        """
+        with self.lock:
+            entries, size = self.db.execute("SELECT count(*), coalesce(sum(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes,
+                "evictions": self.evictions, "entries": entries, "size_bytes": size}
+
+    def close(self):
+        """
+        Evict above the size limit and close the SQLite database
+        """
+        with self.lock:
+            if not self.read_only and self.writes % self.EVICTION_INTERVAL:
+                self.evict()
+                self.db.commit()
+            self.db.close()
+
+def open_result_cache(config, read_only=False):
+    """
+    Open the result cache described by the "cache" block of the configuration.
+    
+    Args:
+        config (dict): Agent configuration
+        read_only (bool): Open the cache read-only whatever the configuration says
+    
+    Returns:
+        ResultCache: The cache, or None if it is disabled or cannot be opened
+    """
+    cache_config = config.get("cache", {})
+    if not cache_config.get("enabled", True):
+        return None
+    
+    path = cache_config.get("path", os.path.join("~", ".cache", "agent01", "results.sqlite"))
+    try:
+        return ResultCache(path, cache_config.get("max_mb", 512), read_only or cache_config.get("read_only", False))
+    except sqlite3.Error as e:
+        print(f"Error opening result cache {path}: {e}")
+        return None
+
 def collect_java_files(scan_directory):
     """
     Recursively collect all Java files (.java) in the given directory.
@@ -121,7 +741,8 @@ def collect_java_files(scan_directory):
             if file.endswith(".java"):
                 java_files.append(os.path.join(root, file))
     
-    return java_files
+    # Sort the files so that every run processes and reports them in the same order
+    return sorted(java_files)
 
 def validate_prompt_file(file_path):
     """
@@ -148,13 +769,130 @@ def validate_prompt_file(file_path):
         print(f"Error: Could not read prompt file {file_path}.")
         return None
 
+def process_file(agent, file_path, prompt_content, provider, completed=None, cache=None):
+    """
+    Send one Java file to the model. Errors are returned instead of raised, so that a
+    failing file does not stop the files processed next to it.
+    
+    Args:
+        agent (Agent): Agent used to query the model
+        file_path (str): Path of the Java file
+        prompt_content (str): Content of the prompt file
+        provider (str): Provider to query, "ollama" or "azure"
+        completed (dict): Content hashes of the files completed by a previous run, keyed
+            by path; a file whose content has not changed since is skipped
+        cache (ResultCache): Optional cache consulted before the model is queried
+    
+    Returns:
+        dict: The file path, its content hash, its status ("ok", "incomplete", "error"
+        or "skipped"), whether the response came from the cache, the model response, the
+        error message if any and the processing time in milliseconds
+    """
+    result = {"path": file_path, "sha256": None, "status": "error", "cached": False, "response": None,
+              "error": None, "elapsed_ms": 0.0}
+    start_time = time.perf_counter()
+    try:
+        with open(file_path, 'r') as file:
+            java_content = file.read()
+        
+        result["sha256"] = hashlib.sha256(java_content.encode("utf-8", "surrogateescape")).hexdigest()
+        if completed and completed.get(file_path) == result["sha256"]:
+            result["status"] = "skipped"
+            return result
+        
+        # Identical content is answered from the cache, whatever its path
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(provider, agent.model_name(provider), agent.options, prompt_content,
+                                       result["sha256"])
+            response = cache.get(cache_key)
+            if response is not None:
+                result.update(status="ok", cached=True, response=response)
+                result["elapsed_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+                return result
+        
+        # Combine prompt with Java content
+        combined_prompt = f"{prompt_content}\n\nJava code:\n```java\n{java_content}\n```"
+        
+        response = agent.query(combined_prompt, provider)
+        
+        if response is None:
+            result["error"] = f"No response from {provider}"
+        elif not response["done"]:
+            result["status"] = "incomplete"
+            result["response"] = response
+        else:
+            result["status"] = "ok"
+            result["response"] = response
+            if cache_key is not None:
+                cache.put(cache_key, response, agent.model_name(provider))
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+    return result
+
+def process_files(agent, java_files, prompt_content, provider, workers, completed=None, cache=None):
+    """
+    Process Java files with a bounded pool of worker threads.
+    
+    At most a few files per worker are queued ahead, and results are yielded in the order
+    of java_files whatever the order in which the files finish.
+    
+    Args:
+        agent (Agent): Agent used to query the model
+        java_files (list): Paths of the Java files
+        prompt_content (str): Content of the prompt file
+        provider (str): Provider to query, "ollama" or "azure"
+        workers (int): Number of files processed concurrently
+        completed (dict): Content hashes of the files to skip, keyed by path
+        cache (ResultCache): Optional cache of the model responses
+    
+    Yields:
+        dict: The result of process_file for each file
+    """
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent01")
+    pending = deque()
+    files = iter(java_files)
+    try:
+        while True:
+            # Keep the pool busy without queueing the whole file list
+            while len(pending) < workers * 4:
+                file_path = next(files, None)
+                if file_path is None:
+                    break
+                pending.append(executor.submit(process_file, agent, file_path, prompt_content, provider,
+                                               completed, cache))
+            if not pending:
+                break
+            yield pending.popleft().result()
+    except BaseException:
+        # On Ctrl-C, the requests in flight are abandoned and get no further attempts
+        agent.stopping.set()
+        raise
+    finally:
+        # Drop the queued files; the workers return as soon as their request is abandoned
+        executor.shutdown(wait=True, cancel_futures=True)
+
 def main():
     """Main function for agent01."""
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(description="Process Java files with Ollama")
     parser.add_argument("--prompt", required=True, help="Path to the prompt file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of files processed concurrently (default: 1)")
+    parser.add_argument("--provider", choices=PROVIDERS, default="ollama",
+                        help="Model provider to query (default: ollama)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the files completed by a previous run whose content has not changed")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the result cache")
+    parser.add_argument("--cache-read-only", action="store_true",
+                        help="Use the result cache without storing new responses, e.g. on CI machines")
     args = parser.parse_args()
     
+    if args.workers < 1:
+        print("Error: --workers must be at least 1.")
+        return
+    
     # Validate the prompt file
     prompt_content = validate_prompt_file(args.prompt)
     if prompt_content is None:
@@ -167,15 +905,37 @@ def main():
         print("Error: config.json not found in the working directory.")
         return
     
-    agent = Agent(config_path)
+    agent = Agent(config_path, pool_size=args.workers)
     
     scandir = agent.config.get("scandir")
-    report = agent.config.get("report")
+    report = agent.config.get("report") or "./research/report01.jsonl"
     
     print(f"Configuration loaded successfully:")
     print(f"- Scan directory: {scandir}")
     print(f"- Report file: {report}")
     print(f"- Model: {agent.model}")
+    print(f"- Provider: {args.provider} ({args.workers} workers)")
+    
+    # The progress journal lives next to the report; only a run with the same prompt, provider,
+    # model and options resumes it
+    journal_config = agent.config.get("journal", {})
+    run = {"prompt_sha256": hashlib.sha256(prompt_content.encode("utf-8")).hexdigest(), "provider": args.provider,
+           "model": agent.model_name(args.provider), "options": agent.options}
+    journal = ProgressJournal(f"{os.path.splitext(report)[0]}.journal", run,
+                              journal_config.get("fsync_every", 50), journal_config.get("fsync_interval", 5.0))
+    completed = None
+    if args.resume:
+        records = journal.load()
+        if records is None:
+            print(f"- Not resuming: {journal.path} is missing or was written with another prompt, provider, "
+                  f"model or options; starting a new report")
+        else:
+            completed = {path: record["sha256"] for path, record in records.items() if record["status"] == "ok"}
+            print(f"- Resuming: {len(completed)} files completed according to {journal.path}")
+    
+    cache = None if args.no_cache else open_result_cache(agent.config, args.cache_read_only)
+    if cache is not None:
+        print(f"- Result cache: {cache.path}{' (read-only)' if cache.read_only else ''}")
 
     # Collect Java files
     print(f"Scanning for Java files in {scandir}...")
@@ -190,30 +950,62 @@ def main():
         if len(java_files) > 5:
             print(f"  ... and {len(java_files) - 5} more.")
         
-        # Process Java files with Ollama using the provided prompt
-        print("Processing Java files with Ollama...")
-        for file_path in java_files:
-            try:
-                with open(file_path, 'r') as file:
-                    java_content = file.read()
-                    
-                    # Combine prompt with Java content
-                    combined_prompt = f"{prompt_content}\n\nJava code:\n```java\n{java_content}\n```"
-                    
-                    response = agent.query_ollama(combined_prompt)
-
-                    if response is None:
-                        print(f"Error: No response from Ollama for {file_path}")
-                        continue
-                    elif not response["done"]:
-                        print(f"Warning: Response not complete for {file_path}")
-                        continue
-                    
-                    # Here you could save or process the response
-                    # This is a placeholder for actual response handling
-                    print(f"Processed {file_path}")
-            except Exception as e:
-                print(f"Error processing {file_path}: {str(e)}")
+        # Process Java files with the provider using the provided prompt
+        print(f"Processing Java files with {args.provider}...")
+        counts = {"ok": 0, "incomplete": 0, "error": 0, "skipped": 0}
+        start_time = time.monotonic()
+        # A resumed run adds the remaining files to the journal and report of the interrupted one
+        journal.open(append=completed is not None)
+        report_writer = ReportWriter(report, agent.model_name(args.provider),
+                                     args.provider, append=completed is not None)
+        interrupted = False
+        try:
+            for result in process_files(agent, java_files, prompt_content, args.provider, args.workers,
+                                        completed, cache):
+                counts[result["status"]] += 1
+                if result["status"] == "skipped":
+                    continue
+                # Journal a file only once it is in the report, so that --resume never skips a
+                # file missing from it
+                report_writer.write(result)
+                try:
+                    journal.record(result)
+                except (OSError, ValueError) as e:
+                    print(f"Error writing the progress journal for {result['path']}: {e}")
+                if result["status"] == "error":
+                    print(f"Error processing {result['path']}: {result['error']}")
+                elif result["status"] == "incomplete":
+                    print(f"Warning: Response not complete for {result['path']}")
+                else:
+                    print(f"Processed {result['path']}{' (cached)' if result['cached'] else ''}")
+        except KeyboardInterrupt:
+            interrupted = True
+            print("Interrupted, the remaining files were not processed. Run again with --resume to continue.")
+        finally:
+            journal.close()
+            report_writer.close(counts["skipped"], interrupted)
+        
+        print(f"Report written to {report_writer.path}, summary to {report_writer.summary_path}")
+        
+        print(f"Done in {time.monotonic() - start_time:.1f}s: {counts['ok']} processed, "
+              f"{counts['incomplete']} incomplete, {counts['error']} failed, "
+              f"{counts['skipped']} skipped as already completed.")
+        
+        stats = agent.connection_stats()
+        print(f"HTTP: {stats['requests']} requests over {stats['connections']} connections "
+              f"({stats['reused']} reused), {stats['retries']} retries.")
+        
+        if cache is not None:
+            stats = cache.stats()
+            lookups = stats["hits"] + stats["misses"]
+            hit_ratio = f"{stats['hits'] / lookups:.0%}" if lookups else "n/a"
+            print(f"Cache: {stats['hits']} hits, {stats['misses']} misses ({hit_ratio}), "
+                  f"{stats['writes']} stored, {stats['evictions']} evicted; {stats['entries']} entries, "
+                  f"{stats['size_bytes'] / (1024 * 1024):.1f} MB.")
+    
+    if cache is not None:
+        cache.close()
+    agent.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The agents are scripts rather than an installed package: import them from their directories
+AGENTS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, AGENTS_DIRECTORY)
+sys.path.insert(0, os.path.join(AGENTS_DIRECTORY, 'research'))
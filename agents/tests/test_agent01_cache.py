@@ -0,0 +1,69 @@
+import sqlite3
+
+import pytest
+
+import agent01
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = agent01.ResultCache(str(tmp_path / "results.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_key_depends_on_every_input():
+    key = agent01.ResultCache.make_key("ollama", "llama3", {"temperature": 0}, "prompt", "hash")
+
+    assert key == agent01.ResultCache.make_key("ollama", "llama3", {"temperature": 0}, "prompt", "hash")
+    for changed in (("azure", "llama3", {"temperature": 0}, "prompt", "hash"),
+                    ("ollama", "mistral", {"temperature": 0}, "prompt", "hash"),
+                    ("ollama", "llama3", {"temperature": 1}, "prompt", "hash"),
+                    ("ollama", "llama3", {"temperature": 0}, "other prompt", "hash"),
+                    ("ollama", "llama3", {"temperature": 0}, "prompt", "other hash")):
+        assert key != agent01.ResultCache.make_key(*changed)
+
+
+def test_put_and_get(cache):
+    cache.put("key", {"response": "{}", "eval_count": 3}, "llama3")
+
+    assert cache.get("key") == {"response": "{}", "eval_count": 3}
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses, cache.writes) == (1, 1, 1)
+
+
+def test_least_recently_used_responses_are_evicted_above_the_limit(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = agent01.ResultCache(path, max_mb=0.01)
+    for index in range(agent01.ResultCache.EVICTION_INTERVAL):
+        cache.put(f"key{index}", {"response": "x" * 500}, "llama3")
+
+    stats = cache.stats()
+    assert stats["evictions"] > 0
+    assert stats["size_bytes"] <= cache.max_bytes
+    assert cache.get(f"key{agent01.ResultCache.EVICTION_INTERVAL - 1}") is not None
+    assert cache.get("key0") is None
+    cache.close()
+
+
+def test_size_limit_is_enforced_when_the_cache_is_closed(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    cache = agent01.ResultCache(path, max_mb=0.01)
+    for index in range(30):
+        cache.put(f"key{index}", {"response": "x" * 500}, "llama3")
+    cache.close()
+
+    size = sqlite3.connect(path).execute("SELECT sum(size) FROM results").fetchone()[0]
+    assert size <= 0.01 * 1024 * 1024
+
+
+def test_read_only_cache_is_never_written(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    agent01.ResultCache(path).close()
+
+    cache = agent01.ResultCache(path, read_only=True)
+    cache.put("key", {"response": "{}"}, "llama3")
+
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0
+    cache.close()
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+
+import agent01
+
+
+RUN = {"prompt_sha256": "abc", "provider": "ollama", "model": "llama3", "options": {}}
+
+
+def make_result(path, status="ok"):
+    return {"path": path, "sha256": f"hash of {path}", "status": status, "error": None,
+            "response": {"response": "{}", "eval_count": 5}, "cached": False, "elapsed_ms": 10.0}
+
+
+@pytest.mark.parametrize('content, expected', [
+    (b"", b""),
+    (b'{"a": 1}\n', b'{"a": 1}\n'),
+    (b'{"a": 1}\n{"b": ', b'{"a": 1}\n'),
+    (b'{"torn": ', b""),
+    (b'{"a": 1}\n' + b"x" * 200000, b'{"a": 1}\n')
+])
+def test_repair_jsonl_tail_cuts_off_a_torn_line(tmp_path, content, expected):
+    path = tmp_path / "journal.jsonl"
+    path.write_bytes(content)
+
+    agent01.repair_jsonl_tail(str(path))
+
+    assert path.read_bytes() == expected
+
+
+def test_repair_jsonl_tail_creates_the_file_and_its_directory(tmp_path):
+    path = tmp_path / "research" / "journal.jsonl"
+
+    agent01.repair_jsonl_tail(str(path))
+
+    assert path.read_bytes() == b""
+
+
+def test_journal_records_are_loaded_by_path(tmp_path):
+    path = str(tmp_path / "report01.journal")
+    journal = agent01.ProgressJournal(path, RUN)
+    journal.open()
+    journal.record(make_result("A.java", "error"))
+    journal.record(make_result("B.java"))
+    journal.record(make_result("A.java"))
+    journal.close()
+
+    records = agent01.ProgressJournal(path, RUN).load()
+
+    assert sorted(records) == ["A.java", "B.java"]
+    assert records["A.java"]["status"] == "ok"
+
+
+def test_journal_of_another_run_is_not_resumed(tmp_path):
+    path = str(tmp_path / "report01.journal")
+    journal = agent01.ProgressJournal(path, RUN)
+    journal.open()
+    journal.record(make_result("A.java"))
+    journal.close()
+
+    assert agent01.ProgressJournal(path, dict(RUN, model="mistral")).load() is None
+    assert agent01.ProgressJournal(str(tmp_path / "missing.journal"), RUN).load() is None
+
+
+def test_torn_and_invalid_records_are_skipped(tmp_path, capsys):
+    path = tmp_path / "report01.journal"
+    path.write_text(json.dumps({"run": RUN}) + "\n" + json.dumps({"status": "ok"}) + "\nnot json\n"
+                    + json.dumps({"path": "A.java", "status": "ok"}) + "\n" + '{"path": "B.ja')
+
+    records = agent01.ProgressJournal(str(path), RUN).load()
+
+    assert list(records) == ["A.java"]
+    assert "line 2" in capsys.readouterr().out
+
+
+def test_resumed_journal_is_appended_after_the_torn_record(tmp_path):
+    path = tmp_path / "report01.journal"
+    path.write_text(json.dumps({"run": RUN}) + "\n" + json.dumps({"path": "A.java", "status": "ok"}) + "\n"
+                    + '{"path": "B.ja')
+
+    journal = agent01.ProgressJournal(str(path), RUN)
+    journal.open(append=True)
+    journal.record(make_result("B.java"))
+    journal.close()
+
+    assert sorted(agent01.ProgressJournal(str(path), RUN).load()) == ["A.java", "B.java"]
+
+
+def test_resumed_report_keeps_the_last_record_of_each_file(tmp_path):
+    path = str(tmp_path / "report01.jsonl")
+    report = agent01.ReportWriter(path, "llama3", "ollama")
+    report.write(make_result("A.java", "error"))
+    report.write(make_result("B.java"))
+    report.close()
+
+    report = agent01.ReportWriter(path, "llama3", "ollama", append=True)
+    report.write(make_result("A.java"))
+    summary = report.close(skipped=1)
+
+    with open(path) as file:
+        records = [json.loads(line) for line in file]
+    assert [(record["path"], record["status"]) for record in records] == [("B.java", "ok"), ("A.java", "ok")]
+    assert summary["files"] == 1 and summary["skipped"] == 1
@@ -0,0 +1,38 @@
+import pytest
+
+import nlquery
+
+
+RESPONSE = ("Here are the queries:\n```sql\nSELECT 1;\n```\nand\n```sql\nSELECT 2\n```\n"
+            "```python\nprint('not sql')\n```\n")
+
+
+def test_extract_sql_queries_keeps_every_block_in_order():
+    assert nlquery.extract_sql_queries(RESPONSE) == ["SELECT 1;", "SELECT 2"]
+
+
+@pytest.mark.parametrize('text', [None, "", "No query here", "```sql\nSELECT unterminated"])
+def test_extract_sql_queries_without_complete_block(text):
+    assert nlquery.extract_sql_queries(text) == []
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64])
+def test_streamed_chunks_give_the_same_queries(chunk_size):
+    completed = []
+    extractor = nlquery.SqlBlockExtractor(on_query=completed.append)
+    for start in range(0, len(RESPONSE), chunk_size):
+        extractor.feed(RESPONSE[start:start + chunk_size])
+
+    assert extractor.queries == ["SELECT 1;", "SELECT 2"]
+    assert completed == extractor.queries
+    assert extractor.text == RESPONSE
+
+
+def test_query_is_reported_as_soon_as_its_block_closes():
+    completed = []
+    extractor = nlquery.SqlBlockExtractor(on_query=completed.append)
+
+    extractor.feed("```sql\nSELECT 1\n")
+    assert completed == []
+    extractor.feed("```\nThe rest of the answer")
+    assert completed == ["SELECT 1"]
@@ -0,0 +1,97 @@
+import pytest
+
+import nlquery
+
+
+CONFIG = {'query': {'large_table_rows': 1000000, 'large_table_limit': 500}}
+
+
+@pytest.fixture
+def catalog():
+    return {
+        'orders': {'row_estimate': 5000000, 'indexes': [{'columns': ['customer_id']}],
+                   'partition_columns': ['created_at']},
+        'events': {'row_estimate': 2000000, 'indexes': [], 'partition_columns': []},
+        'customers': {'row_estimate': 1000, 'indexes': [], 'partition_columns': []}
+    }
+
+
+def test_plain_read_of_a_large_table_is_limited_and_hinted(catalog):
+    sql_query, notes = nlquery.guard_large_table_query("SELECT * FROM orders;", catalog, 'shop', CONFIG)
+
+    assert sql_query == ("-- Hint: shop.orders has ~5M rows; filter on an indexed or partition key column: "
+                         "customer_id, created_at\nSELECT * FROM orders\nLIMIT 500")
+    assert notes[0] == "added LIMIT 500 because shop.orders is a large table"
+
+
+def test_filter_on_an_indexed_column_removes_the_hint(catalog):
+    sql_query, notes = nlquery.guard_large_table_query(
+        "SELECT * FROM orders WHERE customer_id = 4", catalog, 'shop', CONFIG)
+
+    assert sql_query == "SELECT * FROM orders WHERE customer_id = 4\nLIMIT 500"
+    assert len(notes) == 1
+
+
+def test_filter_on_a_partition_column_removes_the_hint(catalog):
+    sql_query, notes = nlquery.guard_large_table_query(
+        "SELECT * FROM shop.orders o WHERE o.created_at > '2024-01-01'", catalog, 'shop', CONFIG)
+
+    assert not sql_query.startswith("-- Hint")
+    assert sql_query.endswith("\nLIMIT 500")
+
+
+def test_limit_is_added_after_a_trailing_comment(catalog):
+    sql_query, _ = nlquery.guard_large_table_query(
+        "SELECT * FROM orders WHERE customer_id = 4 -- one customer", catalog, 'shop', CONFIG)
+
+    assert sql_query.endswith("-- one customer\nLIMIT 500")
+
+
+@pytest.mark.parametrize('sql_query', [
+    "SELECT count(*) FROM orders",
+    "SELECT customer_id, sum(total) FROM orders GROUP BY customer_id",
+    "SELECT DISTINCT customer_id FROM orders",
+    "SELECT * FROM orders ORDER BY created_at"
+])
+def test_aggregates_and_sorts_are_never_limited(catalog, sql_query):
+    guarded, _ = nlquery.guard_large_table_query(sql_query, catalog, 'shop', CONFIG)
+
+    assert "LIMIT" not in guarded
+
+
+def test_limited_sort_of_an_unindexed_table_is_hinted(catalog):
+    sql_query, notes = nlquery.guard_large_table_query(
+        "SELECT * FROM events ORDER BY id LIMIT 10", catalog, 'shop', CONFIG)
+
+    assert notes == ["shop.events has ~2M rows and no index; the query reads the whole table"]
+    assert sql_query.endswith("SELECT * FROM events ORDER BY id LIMIT 10")
+
+
+@pytest.mark.parametrize('sql_query', [
+    "SELECT * FROM customers",
+    "SELECT * FROM other.orders",
+    "SELECT 'from orders' FROM customers",
+    "DELETE FROM orders"
+])
+def test_queries_not_reading_a_large_table_are_unchanged(catalog, sql_query):
+    assert nlquery.guard_large_table_query(sql_query, catalog, 'shop', CONFIG) == (sql_query, [])
+
+
+def test_zero_threshold_disables_the_guard(catalog):
+    config = {'query': {'large_table_rows': 0}}
+
+    assert nlquery.guard_large_table_query("SELECT * FROM orders", catalog, 'shop', config) == \
+        ("SELECT * FROM orders", [])
+
+
+@pytest.mark.parametrize('sql_query, expected', [
+    ("SELECT * FROM orders", True),
+    ("  -- comment\nWITH recent AS (SELECT 1) SELECT * FROM recent", True),
+    ("VALUES (1), (2)", True),
+    ("SELECT * INTO archive FROM orders", False),
+    ("WITH gone AS (DELETE FROM orders RETURNING *) SELECT * FROM gone", False),
+    ("UPDATE orders SET total = 0", False),
+    ("SELECT 'delete' AS action", True)
+])
+def test_is_streamable_query(sql_query, expected):
+    assert nlquery.is_streamable_query(sql_query) is expected
@@ -0,0 +1,52 @@
+import pytest
+
+import nlquery
+
+
+@pytest.fixture
+def index():
+    catalog = {
+        'customers': {'columns': [{'name': 'id'}, {'name': 'email', 'comment': 'contact address'}],
+                      'foreign_keys': []},
+        'orders': {'comment': 'sales orders', 'columns': [{'name': 'id'}, {'name': 'customer_id'}, {'name': 'total'}],
+                   'foreign_keys': [{'ref_table': 'customers'}]},
+        'order_items': {'columns': [{'name': 'order_id'}, {'name': 'product_id'}, {'name': 'quantity'}],
+                        'foreign_keys': [{'ref_table': 'orders'}, {'ref_table': 'products'}]},
+        'products': {'columns': [{'name': 'id'}, {'name': 'name'}, {'name': 'price'}], 'foreign_keys': []}
+    }
+    return nlquery.build_schema_index(catalog)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ("orderItems", ["order", "item"]),
+    ("customer_addresses", ["customer", "addresse"]),
+    ("HTTPServer", ["http", "server"]),
+    ("categories", ["category"]),
+    ("class", ["class"]),
+    (None, [])
+])
+def test_tokenize_terms(text, expected):
+    assert nlquery.tokenize_terms(text) == expected
+
+
+def test_table_named_in_the_prompt_ranks_first(index):
+    ranked = nlquery.rank_tables(index, "total of the orders per customer")
+
+    assert [table_name for table_name, _ in ranked] == ['orders', 'customers', 'order_items']
+    assert all(score > 0 for _, score in ranked)
+
+
+def test_column_names_match_the_prompt(index):
+    ranked = nlquery.rank_tables(index, "product prices")
+
+    assert ranked[0][0] == 'products'
+    assert 'order_items' in dict(ranked)
+
+
+def test_unrelated_prompt_ranks_no_table(index):
+    assert nlquery.rank_tables(index, "weather forecast") == []
+
+
+def test_foreign_keys_are_undirected_neighbours(index):
+    assert index['neighbours']['orders'] == {'customers', 'order_items'}
+    assert index['neighbours']['products'] == {'order_items'}
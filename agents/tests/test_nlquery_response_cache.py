@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+import nlquery
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = nlquery.ResponseCache(str(tmp_path / "responses.sqlite"), max_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_key_ignores_case_and_whitespace_of_the_prompt():
+    key = nlquery.ResponseCache.make_key("List  the Orders", 'ollama', 'llama3', "system")
+
+    assert key == nlquery.ResponseCache.make_key(" list the\norders ", 'ollama', 'llama3', "system")
+
+
+@pytest.mark.parametrize('prompt, provider, model, system_message', [
+    ("list the customers", 'ollama', 'llama3', "system"),
+    ("list the orders", 'anthropic', 'llama3', "system"),
+    ("list the orders", 'ollama', 'mistral', "system"),
+    ("list the orders", 'ollama', 'llama3', "system with another schema")
+])
+def test_key_changes_with_prompt_model_and_schema_context(prompt, provider, model, system_message):
+    key = nlquery.ResponseCache.make_key("list the orders", 'ollama', 'llama3', "system")
+
+    assert key != nlquery.ResponseCache.make_key(prompt, provider, model, system_message)
+
+
+def test_put_and_get(cache):
+    cache.put("key", "```sql\nSELECT 1\n```", 'ollama', 'llama3')
+
+    assert cache.get("key") == {'response': "```sql\nSELECT 1\n```"}
+    assert cache.get("missing") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put("first", "1", 'ollama', 'llama3')
+    cache.put("second", "2", 'ollama', 'llama3')
+    cache.get("first")
+    cache.put("third", "3", 'ollama', 'llama3')
+
+    assert cache.get("second") is None
+    assert cache.get("first") is not None
+    assert cache.stats()['entries'] == 2
+
+
+def test_expired_entry_is_removed(tmp_path):
+    cache = nlquery.ResponseCache(str(tmp_path / "responses.sqlite"), ttl_seconds=-1)
+    cache.put("key", "response", 'ollama', 'llama3')
+
+    assert cache.get("key") is None
+    assert cache.stats()['entries'] == 0
+    cache.close()
+
+
+def test_cache_with_the_query_column_is_discarded(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, query TEXT NOT NULL, "
+               "provider TEXT, model TEXT, created_at REAL NOT NULL, last_access REAL NOT NULL)")
+    db.execute("INSERT INTO responses VALUES ('key', 'response', 'SELECT 1', 'ollama', 'llama3', 0, 0)")
+    db.commit()
+    db.close()
+
+    cache = nlquery.ResponseCache(path)
+    cache.put("other", "response", 'ollama', 'llama3')
+
+    assert cache.get("key") is None
+    assert cache.get("other") == {'response': "response"}
+    cache.close()
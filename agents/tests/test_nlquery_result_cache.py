@@ -0,0 +1,79 @@
+import pytest
+
+import nlquery
+
+
+CONFIG = {'database': {'host': 'db', 'port': 5432, 'name': 'shop', 'user': 'reader'}}
+
+
+def test_key_ignores_layout_leading_comments_and_semicolon():
+    key = nlquery.ResultCache.make_key("SELECT *\n  FROM orders", CONFIG)
+
+    assert key == nlquery.ResultCache.make_key("-- all orders\nSELECT * FROM orders ;", CONFIG)
+    assert key == ('db:5432/shop', 'reader', "SELECT * FROM orders")
+
+
+def test_key_keeps_whitespace_inside_literals():
+    key = nlquery.ResultCache.make_key("SELECT 'a  b'", CONFIG)
+
+    assert key != nlquery.ResultCache.make_key("SELECT 'a b'", CONFIG)
+
+
+def test_key_changes_with_database_and_user():
+    key = nlquery.ResultCache.make_key("SELECT 1", CONFIG)
+    other_user = {'database': dict(CONFIG['database'], user='writer')}
+    other_database = {'database': dict(CONFIG['database'], name='archive')}
+
+    assert key != nlquery.ResultCache.make_key("SELECT 1", other_user)
+    assert key != nlquery.ResultCache.make_key("SELECT 1", other_database)
+
+
+def test_least_recently_used_results_are_evicted_above_the_budget():
+    cache = nlquery.ResultCache(max_bytes=100)
+    cache.put('first', ['a'], [(1,)], 40)
+    cache.put('second', ['a'], [(2,)], 40)
+    cache.get('first')
+    cache.put('third', ['a'], [(3,)], 40)
+
+    assert cache.get('second') is None
+    assert cache.get('first')['rows'] == [(1,)]
+    assert cache.size_bytes == 80
+
+
+def test_result_larger_than_the_budget_is_not_cached():
+    cache = nlquery.ResultCache(max_bytes=100)
+    cache.put('key', ['a'], [(1,)], 101)
+
+    assert not cache.contains('key')
+
+
+def test_expired_result_is_a_miss():
+    cache = nlquery.ResultCache(max_bytes=100, ttl_seconds=-1)
+    cache.put('key', ['a'], [(1,)], 10)
+
+    assert cache.get('key') is None
+    assert cache.size_bytes == 0
+
+
+def test_invalidate_removes_the_results_of_one_database():
+    cache = nlquery.ResultCache(max_bytes=1000)
+    other = {'database': dict(CONFIG['database'], name='archive')}
+    cache.put(nlquery.ResultCache.make_key("SELECT 1", CONFIG), ['a'], [(1,)], 10)
+    cache.put(nlquery.ResultCache.make_key("SELECT 1", other), ['a'], [(1,)], 10)
+
+    assert cache.invalidate(CONFIG) == 1
+    assert cache.contains(nlquery.ResultCache.make_key("SELECT 1", other))
+    assert cache.invalidate() == 1
+
+
+@pytest.mark.parametrize('sql_query, expected', [
+    ("SELECT * FROM orders", True),
+    ("SELECT 'now()' AS label, \"user\" FROM orders", True),
+    ("SELECT now()", False),
+    ("SELECT * FROM orders WHERE created_at > current_date", False),
+    ("SELECT random()", False),
+    ("SELECT current_user", False),
+    ("DELETE FROM orders", False)
+])
+def test_is_cacheable_query(sql_query, expected):
+    assert nlquery.is_cacheable_query(sql_query) is expected
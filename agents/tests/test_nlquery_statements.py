@@ -0,0 +1,16 @@
+import pytest
+
+import nlquery
+
+
+@pytest.mark.parametrize('sql_query, expected', [
+    ("SELECT 1", ["SELECT 1"]),
+    ("SELECT 1; SELECT 2;", ["SELECT 1", "SELECT 2"]),
+    ("SELECT ';' AS semicolon; SELECT \"a;b\" FROM t", ["SELECT ';' AS semicolon", "SELECT \"a;b\" FROM t"]),
+    ("SELECT $body$ a; b $body$", ["SELECT $body$ a; b $body$"]),
+    ("SELECT 1 -- last; line", ["SELECT 1 -- last; line"]),
+    ("SELECT 1; /* nothing */ ; -- trailing", ["SELECT 1"]),
+    ("", [])
+])
+def test_split_sql_statements(sql_query, expected):
+    assert nlquery.split_sql_statements(sql_query) == expected
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import nlquery
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+    assert nlquery.SessionStats.percentile(values, 50) == 5
+    assert nlquery.SessionStats.percentile(values, 95) == 10
+    assert nlquery.SessionStats.percentile([7], 95) == 7
+
+
+def test_summary_aggregates_each_stage_in_recording_order():
+    stats = nlquery.SessionStats()
+    for seconds in (0.3, 0.1, 0.2):
+        stats.record('llm', seconds)
+    stats.record('connect', 0.01)
+
+    (llm, count, total, p50, p95, maximum), connect = stats.summary()
+    assert (llm, count, p50, p95, maximum) == ('llm', 3, 0.2, 0.3, 0.3)
+    assert total == pytest.approx(0.6)
+    assert connect == ('connect', 1, 0.01, 0.01, 0.01, 0.01)
+
+
+def test_openmetrics_file(tmp_path):
+    path = tmp_path / "metrics.prom"
+    stats = nlquery.SessionStats('openmetrics', str(path), flush_interval=3600)
+    stats.record('llm', 0.5)
+    stats.record_tokens('ollama', 'llama3', 120, 30)
+    stats.record_tokens('ollama', 'llama3', None, None)
+    stats.close()
+
+    assert path.read_text().splitlines() == [
+        "# TYPE nlquery_stage_duration_seconds summary",
+        "# UNIT nlquery_stage_duration_seconds seconds",
+        "# HELP nlquery_stage_duration_seconds Duration of the nlquery processing stages.",
+        'nlquery_stage_duration_seconds{stage="llm",quantile="0.5"} 0.500000',
+        'nlquery_stage_duration_seconds{stage="llm",quantile="0.95"} 0.500000',
+        'nlquery_stage_duration_seconds_sum{stage="llm"} 0.500000',
+        'nlquery_stage_duration_seconds_count{stage="llm"} 1',
+        "# TYPE nlquery_tokens counter",
+        "# HELP nlquery_tokens Tokens reported by the AI providers.",
+        'nlquery_tokens_total{provider="ollama",model="llama3",kind="prompt"} 120',
+        'nlquery_tokens_total{provider="ollama",model="llama3",kind="completion"} 30',
+        "# EOF"
+    ]
+    assert not (tmp_path / "metrics.prom.tmp").exists()
+
+
+def test_jsonl_sink_appends_every_span(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    stats = nlquery.SessionStats('jsonl', str(path))
+    stats.record('execute', 0.25)
+    stats.record_tokens('anthropic', 'claude', 10, None)
+    stats.close()
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [event['type'] for event in events] == ['span', 'tokens']
+    assert events[0]['stage'] == 'execute' and events[0]['duration_ms'] == 250.0
+    assert events[1]['completion_tokens'] is None